@@ -1,12 +1,21 @@
 import hashlib
+import operator
+from datetime import datetime
 from typing import Dict
+
+import numpy as np
 import pandas as pd
 from fs.base import FS
 
 from liiatools_pipeline.assets.external_dataset import external_data_folder
 
-from liiatools.common.converters import to_nth_of_month, to_short_postcode
-from liiatools.common.reference import authorities
+from liiatools.common.converters import (
+    POSTCODE_PATTERN,
+    to_nth_of_month,
+    to_short_postcode,
+)
+from liiatools.common.pseudonymise import pseudonymiser
+from liiatools.common.reference import PostcodeLookup, authorities
 
 from .data import ColumnConfig, Metadata
 
@@ -36,22 +45,24 @@ def add_year(row: pd.Series, column_config: ColumnConfig, metadata: Metadata) ->
     return metadata["year"]
 
 
+MONTH_MAP = {
+    "jan": 1,
+    "feb": 2,
+    "mar": 3,
+    "apr": 4,
+    "may": 5,
+    "jun": 6,
+    "jul": 7,
+    "aug": 8,
+    "sep": 9,
+    "oct": 10,
+    "nov": 11,
+    "dec": 12,
+}
+
+
 def add_month(row: pd.Series, column_config: ColumnConfig, metadata: Metadata) -> str:
-    month_map = {
-        "jan": 1,
-        "feb": 2,
-        "mar": 3,
-        "apr": 4,
-        "may": 5,
-        "jun": 6,
-        "jul": 7,
-        "aug": 8,
-        "sep": 9,
-        "oct": 10,
-        "nov": 11,
-        "dec": 12,
-    }
-    return month_map[metadata["month"]]
+    return MONTH_MAP[metadata["month"]]
 
 
 def add_term(row: pd.Series, column_config: ColumnConfig, metadata: Metadata) -> str:
@@ -92,16 +103,13 @@ def add_school_year(
     return school_year
 
 
+postcode_las = PostcodeLookup(
+    external_data_folder, "postcode_la_lookup.parquet", "pcds", "CTYUA25CD"
+)
+
+
 def add_la_from_postcode(data: pd.DataFrame, mapping_field: str, output_field: str) -> pd.DataFrame:
-    # Load postcode lookup
-    ext_folder = external_data_folder()
-    mapping_file = "postcode_la_lookup.parquet"
-    with ext_folder.open(mapping_file, "rb") as f:
-        mapping_df = pd.read_parquet(f)
-
-    # Merge LA name into data
-    merged = data.merge(mapping_df, left_on=mapping_field, right_on="pcds", how="left")
-    data[output_field] = merged["CTYUA25CD"]
+    data[output_field] = postcode_las.lookup(data[mapping_field])
     return data
 
 
@@ -119,6 +127,120 @@ enrich_functions = {
 }
 
 
+def _infer(values: pd.Series) -> pd.Series:
+    """
+    Rebuild a series so its dtype is inferred from its values, as it is for the result of a row-wise apply.
+    """
+    return pd.Series(values.tolist(), index=values.index)
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def _constant(data: pd.DataFrame, value) -> pd.Series:
+    return pd.Series(value, index=data.index)
+
+
+def _is_blank(values: pd.Series) -> pd.Series:
+    """
+    Column-wise version of the blank check used by allow_blank: null or a whitespace only string.
+    """
+    is_blank = values.isna()
+    if pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+        strings = values.astype(object).where(values.map(type).eq(str))
+        is_blank |= strings.str.strip().eq("")
+    return is_blank
+
+
+def add_la_suffix_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    return data[column_config.id].map(str) + f"_{metadata['la_code']}"
+
+
+def add_la_code_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    return _constant(data, metadata["la_code"])
+
+
+def add_la_name_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    return _constant(data, authorities.get_by_code(metadata["la_code"]))
+
+
+def add_year_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    return _constant(data, metadata["year"])
+
+
+def add_month_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    return _constant(data, MONTH_MAP[metadata["month"]])
+
+
+def add_term_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    return _constant(data, metadata["term"])
+
+
+def add_school_type_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    return _constant(data, metadata["school_type"])
+
+
+def to_integer_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    values = data[column_config.id].astype(object)
+    is_str = values.map(type).eq(str)
+    values = values.mask(is_str, values.where(is_str).str.strip())
+
+    numbers = pd.to_numeric(values, errors="coerce")
+    # Strings that float() accepts but to_numeric does not, such as "1_000", are converted one at a time
+    unparsed = is_str & numbers.isna()
+    if unparsed.any():
+        numbers[unparsed] = values[unparsed].map(_to_float)
+    is_number = numbers.notna() & np.isfinite(numbers) & ~values.isna()
+
+    # Built as an object array so that numbers alongside strings stay ints rather than being cast to float
+    result = values.mask(is_str, values.where(is_str).str.upper())
+    result = result.to_numpy(dtype=object, copy=True)
+    result[is_number.to_numpy()] = numbers[is_number].map(int).to_numpy(dtype=object)
+    result[values.isna().to_numpy()] = ""
+    return _infer(pd.Series(result, index=values.index))
+
+
+def add_school_year_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    dates = pd.to_datetime(data["PersonBirthDate"])
+    school_year = dates.dt.year.where(dates.dt.month >= 9, dates.dt.year - 1)
+    return _infer(school_year.astype(object).where(dates.notna(), None))
+
+# Column-wise versions of the enrich functions, used in preference to the row-wise ones
+enrich_column_functions = {
+    "add_la_suffix": add_la_suffix_column,
+    "la_code": add_la_code_column,
+    "la_name": add_la_name_column,
+    "year": add_year_column,
+    "month": add_month_column,
+    "term": add_term_column,
+    "integer": to_integer_column,
+    "school_year": add_school_year_column,
+    "school_type": add_school_type_column,
+}
+
+
 def degrade_to_first_of_month(
     row: pd.Series, column_config: ColumnConfig, metadata: Metadata
 ) -> str:
@@ -164,3 +286,78 @@ degrade_functions = {
     "hash_sha256": hash_column_sha256,
     "remove_row": remove_row,
 }
+
+
+def degrade_to_first_of_month_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    values = data[column_config.id]
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values - pd.to_timedelta(values.dt.day - 1, unit="D")
+
+    is_blank = _is_blank(values)
+    dates = pd.to_datetime(values.mask(is_blank), format="mixed")
+    first_of_month = (dates - pd.to_timedelta(dates.dt.day - 1, unit="D")).dt.date
+    first_of_month = first_of_month.astype(object).where(~is_blank, pd.NaT)
+
+    # Datetimes (including Timestamps) keep their type and time, as replace does in the row-wise version
+    types = values.map(type)
+    datetime_types = [t for t in types.unique() if issubclass(t, datetime)]
+    is_datetime = types.isin(datetime_types) & ~is_blank
+    if is_datetime.any():
+        first_of_month[is_datetime] = values[is_datetime].map(
+            lambda v: v.replace(day=1)
+        )
+    return _infer(first_of_month)
+
+
+def degrade_to_short_postcode_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    values = data[column_config.id]
+    is_blank = _is_blank(values)
+    postcodes = (
+        values.mask(is_blank)
+        .astype(object)
+        .map(str, na_action="ignore")
+        .str.replace(r"\s+", "", regex=True)
+        .str.upper()
+    )
+    match = postcodes.str.extract(POSTCODE_PATTERN)
+
+    invalid = match[0].isna() & ~is_blank
+    if invalid.any():
+        raise ValueError(f"Invalid postcode: {postcodes[invalid].iloc[0]}")
+
+    return _infer((match[0] + " " + match[1]).astype(object).where(~is_blank, ""))
+
+
+def hash_column_sha256_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    salt = _get_first(metadata, f"sha256_salt_{column_config.id}", "sha256_salt")
+    return _infer(pseudonymiser.hash_series(data[column_config.id], salt))
+
+
+def remove_row_column(
+    data: pd.DataFrame, column_config: ColumnConfig, metadata: Metadata
+) -> pd.Series:
+    values = data[column_config.id]
+    if pd.api.types.is_bool_dtype(values):
+        is_falsy = ~values
+    elif pd.api.types.is_numeric_dtype(values):
+        is_falsy = values.eq(0)
+    elif pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    else:
+        is_falsy = values.astype(object).map(operator.not_).astype(bool)
+    return _infer(values.astype(object).mask(is_falsy, "remove_row"))
+
+
+# Column-wise versions of the degrade functions, used in preference to the row-wise ones
+degrade_column_functions = {
+    "first_of_month": degrade_to_first_of_month_column,
+    "short_postcode": degrade_to_short_postcode_column,
+    "hash_sha256": hash_column_sha256_column,
+    "remove_row": remove_row_column,
+}
@@ -1,30 +1,108 @@
 import re
-from typing import Iterable, List
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Collection, Iterable, List
 
 import pandas as pd
 from fs.base import FS
 
-from liiatools.common.archive import _normalise_table
+from liiatools.common.archive import DEFAULT_MAX_WORKERS, _load_all, _normalise_table
+from liiatools.common.checks import check_la_signature
 from liiatools.common.data import DataContainer, PipelineConfig
+from liiatools.common.reference import authorities
+
+
+@dataclass
+class RetentionFilter:
+    """
+    The rows to keep when loading files: those with a year after year_cutoff from a local authority in
+    signed_las. Files from local authorities that are not signed are skipped without being read.
+    """
+
+    year_column: str
+    la_column: str
+    year_cutoff: int
+    signed_las: Collection[str]
+
+    @classmethod
+    def for_profiles(
+        cls,
+        config: PipelineConfig,
+        profiles: Iterable[str],
+        year_column: str,
+        la_column: str,
+    ) -> "RetentionFilter":
+        """
+        Create a filter keeping the rows retained for any of the profiles. Retention for each profile still
+        needs to be applied to the loaded data.
+        """
+        profiles = list(profiles)
+        return cls(
+            year_column=year_column,
+            la_column=la_column,
+            year_cutoff=datetime.now().year
+            - max(config.retention_period[profile] for profile in profiles),
+            signed_las=frozenset(
+                la
+                for profile in profiles
+                for la in check_la_signature(config.la_signed, profile)
+            ),
+        )
+
+    def keep_la_code(self, la_code: str) -> bool:
+        try:
+            return authorities.get_by_code(la_code) in self.signed_las
+        except KeyError:
+            # Keep files we cannot place, their rows are still filtered on the LA column
+            return True
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        mask = pd.Series(True, index=df.index)
+        if self.year_column in df.columns:
+            years = pd.to_numeric(df[self.year_column], errors="coerce")
+            mask &= years > self.year_cutoff
+        if self.la_column in df.columns:
+            mask &= df[self.la_column].isin(self.signed_las)
+        return df[mask]
 
 
 class DataframeAggregator:
     """
     The dataframe aggregator aggregates dataframes that are stored in a filesystem.
 
-    Only tables and columns defined in the pipeline config are aggregated.
+    Only tables and columns defined in the pipeline config are aggregated. Files are read using up to
+    max_workers threads. If a retention filter is given, files from unsigned local authorities are skipped
+    and rows outside retention are dropped as each file is read.
     """
 
-    def __init__(self, fs: FS, config: PipelineConfig, dataset: str):
+    def __init__(
+        self,
+        fs: FS,
+        config: PipelineConfig,
+        dataset: str,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        retention_filter: RetentionFilter = None,
+    ):
         self.fs = fs
         self.config = config
         self.dataset = dataset
+        self.max_workers = max_workers
+        self.retention_filter = retention_filter
 
     def list_files(self) -> List[str]:
         """
         List the files in the current directory.
         """
-        return sorted(self.fs.listdir("/"))
+        files = sorted(self.fs.listdir("/"))
+        if self.retention_filter is None:
+            return files
+
+        kept = []
+        for file in files:
+            la_code = re.match(rf"(.+?)_{self.dataset}_", file)
+            if la_code is None or self.retention_filter.keep_la_code(la_code.group(1)):
+                kept.append(file)
+        return kept
 
     def current(self, deduplicate: bool = False) -> DataContainer:
         """
@@ -45,6 +123,8 @@ class DataframeAggregator:
                 with self.fs.open(file, "r") as f:
                     df = pd.read_csv(f)
                     df = _normalise_table(df, table_spec)
+                    if self.retention_filter is not None:
+                        df = self.retention_filter.apply(df)
                     data[table_spec.id] = df
 
         return data
@@ -55,10 +135,10 @@ class DataframeAggregator:
 
         """
         combined = DataContainer()
-        for file in files:
+        for data in _load_all(self.load_file, files, self.max_workers):
             combined = self._combine_files(
                 combined,
-                self.load_file(file),
+                data,
             )
 
         if deduplicate:
@@ -107,7 +187,7 @@ class DataframeAggregator:
             if len(all_sources) == 0:
                 continue
             elif len(all_sources) == 1:
-                data[table_id] = all_sources[0].copy()
+                data[table_id] = all_sources[0].copy(deep=False)
             else:
                 data[table_id] = pd.concat(all_sources, ignore_index=True)
 
@@ -1,5 +1,6 @@
 import re
-from typing import Dict, Iterable, Literal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Literal, TypeVar
 
 import fs.errors
 import pandas as pd
@@ -16,12 +17,34 @@ from liiatools.common.data import (
 
 log = get_dagster_logger(__name__)
 
+DEFAULT_MAX_WORKERS = 4
+
+T = TypeVar("T")
+
+
+def _load_all(
+    loader: Callable[[str], T], paths: Iterable[str], max_workers: int
+) -> List[T]:
+    """
+    Load a list of files using a bounded pool of worker threads.
+
+    Results are returned in the same order as the paths so that files are always combined
+    deterministically. The workers share the same filesystem object; remote filesystems such as S3FS keep
+    one client per thread, so each worker reuses a single connection for all the files it loads.
+    """
+    paths = list(paths)
+    if max_workers is None or max_workers <= 1 or len(paths) <= 1:
+        return [loader(path) for path in paths]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as executor:
+        return list(executor.map(loader, paths))
+
 
 def _normalise_table(df: pd.DataFrame, table_spec: TableConfig) -> pd.DataFrame:
     """
     Normalise the dataframe to match the table spec.
     """
-    df = df.copy()
+    df = df.copy(deep=False)
 
     # Add any columns that are in the table spec but not in the dataframe
     for c in table_spec.columns:
@@ -48,12 +71,22 @@ class DataframeArchive:
 
     Because files are not always loaded in chronological order, the 'primary keys' and 'sort' configurations are used
     to ensure that the dataframes are deduplicated in the right order.
+
+    Snapshots are read using up to max_workers threads, as reading is dominated by request latency on remote
+    filesystems.
     """
 
-    def __init__(self, fs: FS, config: PipelineConfig, dataset: str):
+    def __init__(
+        self,
+        fs: FS,
+        config: PipelineConfig,
+        dataset: str,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ):
         self.fs = fs
         self.config = config
         self.dataset = dataset
+        self.max_workers = max_workers
 
     def add(
         self,
@@ -196,10 +229,10 @@ class DataframeArchive:
         assert deduplicate_mode in ["E", "A", "N"]
 
         combined = DataContainer()
-        for snap_id in snap_ids:
+        for snapshot in _load_all(self.load_snapshot, snap_ids, self.max_workers):
             combined = self._combine_snapshots(
                 combined,
-                self.load_snapshot(snap_id),
+                snapshot,
                 deduplicate=deduplicate_mode == "E",
             )
 
@@ -231,31 +264,31 @@ class DataframeArchive:
                     subset=subset if subset else None,
                     keep="first",
                 )
-
-                duplicate_rows = df.index[duplicate_mask].tolist()
+                duplicate_rows = df.index[duplicate_mask]
 
                 df = df[~duplicate_mask]
 
-                for index in duplicate_rows:
-                    # CIN xml file cannot give rows TO DO: add node information instead
-                    if self.dataset == "cin":
-                        errors.append(
-                            dict(
-                                type="DuplicateRemoval",
-                                message=f"Row removed as it was a duplicate",
-                                table_name=table_spec.id,
-                            )
+                # CIN xml file cannot give rows TO DO: add node information instead
+                if self.dataset == "cin":
+                    errors.extend(
+                        dict(
+                            type="DuplicateRemoval",
+                            message="Row removed as it was a duplicate",
+                            table_name=table_spec.id,
                         )
-                    # For other csv files, row can be given as index + 2
-                    else:
-                        errors.append(
-                            dict(
-                                type="DuplicateRemoval",
-                                message=f"Row {index + 2} removed as it was a duplicate",
-                                row_number=index + 2,
-                                table_name=table_spec.id,
-                            )
+                        for _ in range(len(duplicate_rows))
+                    )
+                # For other csv files, row can be given as index + 2
+                else:
+                    errors.extend(
+                        dict(
+                            type="DuplicateRemoval",
+                            message=f"Row {row_number} removed as it was a duplicate",
+                            row_number=row_number,
+                            table_name=table_spec.id,
                         )
+                        for row_number in (duplicate_rows + 2).tolist()
+                    )
                 data[table_spec.id] = df
 
         return ProcessResult(data=data, errors=errors)
@@ -278,7 +311,7 @@ class DataframeArchive:
             if len(all_sources) == 0:
                 continue
             elif len(all_sources) == 1:
-                data[table_id] = all_sources[0].copy()
+                data[table_id] = all_sources[0].copy(deep=False)
             else:
                 data[table_id] = pd.concat(all_sources, ignore_index=True)
 
@@ -0,0 +1,207 @@
+import hashlib
+import json
+from typing import Any, Dict, Iterable, Tuple
+
+import fs.errors
+import pandas as pd
+from dagster import get_dagster_logger
+from fs.base import FS
+
+from liiatools.common.data import (
+    DataContainer,
+    ErrorContainer,
+    Metadata,
+    PipelineConfig,
+)
+from liiatools.common.pipeline import hash_file
+from liiatools.common.transform import TRANSFORM_VERSION
+
+log = get_dagster_logger(__name__)
+
+
+def _sha256(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+class ProcessedFileCache:
+    """
+    The processed file cache is a content-addressed store of the results of cleaning a file.
+
+    Each entry holds the cleaned, enriched and (optionally) degraded tables for one file as parquet,
+    together with the error entries raised while producing them. Entries are keyed by the SHA-256 of the
+    incoming file, the schema it was cleaned with, the pipeline config, the file metadata, the hashes of the
+    external data files read by the enrich transforms and TRANSFORM_VERSION, so an entry is only reused when
+    re-processing the file would produce the same result.
+
+    Entries that are no longer used, e.g. for a file that has since been replaced, are removed with prune.
+
+    The error entries are stored without the filename and uuid of the file that produced them, as the same
+    content may arrive under a different name.
+    """
+
+    ERRORS_FILE = "errors.json"
+
+    def __init__(self, fs: FS, dataset: str):
+        self.fs = fs
+        self.dataset = dataset
+
+    @staticmethod
+    def key(
+        file_sha: str,
+        schema: Any,
+        config: PipelineConfig,
+        metadata: Metadata,
+        external_hashes: Dict[str, str | None] = None,
+    ) -> str:
+        """
+        Create the cache key for a file.
+
+        The schema is identified by a digest of its representation, which covers every column definition for
+        the yaml schemas and the schema file for the xml ones. external_hashes is given by
+        external_data_hashes for the config.
+        """
+        schema_version = _sha256(repr(schema))
+        config_hash = _sha256(config.model_dump_json())
+        file_metadata = {k: v for k, v in metadata.items() if k != "schema"}
+        return _sha256(
+            json.dumps(
+                [
+                    file_sha,
+                    schema_version,
+                    config_hash,
+                    file_metadata,
+                    external_hashes or {},
+                    TRANSFORM_VERSION,
+                ],
+                sort_keys=True,
+                default=str,
+            )
+        )
+
+    def _entry_path(self, key: str) -> str:
+        return f"{self.dataset}/{key}"
+
+    def get(self, key: str) -> Tuple[Dict[str, DataContainer], ErrorContainer] | None:
+        """
+        Load an entry from the cache. Returns None if there is no complete entry for the key.
+        """
+        entry_path = self._entry_path(key)
+        if not self.fs.exists(f"{entry_path}/{self.ERRORS_FILE}"):
+            return None
+
+        try:
+            entry_fs = self.fs.opendir(entry_path)
+            stages = {}
+            for stage in entry_fs.listdir("/"):
+                if not entry_fs.isdir(stage):
+                    continue
+                data = DataContainer()
+                for file in sorted(entry_fs.listdir(stage)):
+                    with entry_fs.open(f"{stage}/{file}", "rb") as f:
+                        data[file.removesuffix(".parquet")] = pd.read_parquet(f)
+                stages[stage] = data
+
+            errors = ErrorContainer(json.loads(entry_fs.readtext(self.ERRORS_FILE)))
+        except (fs.errors.FSError, ValueError) as err:
+            log.error(f"Failed to read cache entry {key}: {err}")
+            return None
+
+        return stages, errors
+
+    def put(self, key: str, stages: Dict[str, DataContainer], errors: ErrorContainer):
+        """
+        Add an entry to the cache. The errors file is written last so that an interrupted write is not read
+        back as a complete entry.
+        """
+        entry_path = self._entry_path(key)
+        if self.fs.exists(entry_path):
+            self.fs.removetree(entry_path)
+        entry_fs = self.fs.makedirs(entry_path)
+
+        for stage, data in stages.items():
+            data.export(entry_fs.makedir(stage), "", "parquet")
+
+        entry_fs.writetext(self.ERRORS_FILE, json.dumps(errors, default=str))
+
+    def prune(self, keep: Iterable[str]) -> int:
+        """
+        Remove every entry whose key is not in keep and return the number removed.
+        """
+        if not self.fs.isdir(self.dataset):
+            return 0
+
+        keep = set(keep)
+        removed = 0
+        for key in self.fs.listdir(self.dataset):
+            if key not in keep:
+                self.fs.removetree(self._entry_path(key))
+                removed += 1
+        return removed
+
+
+class ExternalDataCache:
+    """
+    The external data cache stores tables transformed from external data files as parquet.
+
+    External datasets such as the ONS areas, postcodes and Ofsted providers only change a few times a year, so
+    the transformed tables are stored under a key made from the SHA-256 of each input file and the version of the
+    transform. Only the latest entry for each name is kept.
+
+    It is also used for tables made from the files of a session which more than one job reads, such as the School
+    Census on roll tables shared by the CROSS and REGION outputs.
+    """
+
+    TABLES_FILE = "tables.json"
+
+    def __init__(self, fs: FS, name: str):
+        self.fs = fs
+        self.name = name
+
+    @staticmethod
+    def key(input_fs: FS, paths: Iterable[str], version: Any) -> str:
+        """
+        Create the cache key for a set of input files. Raises ResourceNotFound if one of the files is missing.
+        """
+        file_hashes = {path: hash_file(input_fs, path)[0] for path in sorted(paths)}
+        return _sha256(json.dumps([file_hashes, version], sort_keys=True, default=str))
+
+    def get(self, key: str) -> DataContainer | None:
+        """
+        Load the tables for a key. Returns None if there is no complete entry for the key.
+        """
+        entry_path = f"{self.name}/{key}"
+        if not self.fs.exists(f"{entry_path}/{self.TABLES_FILE}"):
+            return None
+
+        try:
+            entry_fs = self.fs.opendir(entry_path)
+            data = DataContainer()
+            for table_name in json.loads(entry_fs.readtext(self.TABLES_FILE)):
+                with entry_fs.open(f"{table_name}.parquet", "rb") as f:
+                    data[table_name] = pd.read_parquet(f)
+        except (fs.errors.FSError, ValueError) as err:
+            log.error(f"Failed to read cache entry {self.name}/{key}: {err}")
+            return None
+
+        return data
+
+    def put(self, key: str, data: DataContainer):
+        """
+        Store the tables for a key, replacing any earlier entry. The list of tables is written last so that an
+        interrupted write is not read back as a complete entry. Tables that cannot be stored as parquet are
+        logged and the entry is not kept.
+
+        Jobs sharing a cache may run at the same time, so one may remove the entry another is writing. The error
+        is logged and the entry is left to be rebuilt, in the same way as get treats an entry it cannot read.
+        """
+        try:
+            if self.fs.exists(self.name):
+                self.fs.removetree(self.name)
+            entry_fs = self.fs.makedirs(f"{self.name}/{key}")
+            data.export(entry_fs, "", "parquet")
+            entry_fs.writetext(self.TABLES_FILE, json.dumps(list(data)))
+        except (ValueError, TypeError) as err:
+            log.error(f"Failed to store cache entry {self.name}/{key}: {err}")
+            self.fs.removetree(self.name)
+        except fs.errors.FSError as err:
+            log.error(f"Failed to store cache entry {self.name}/{key}: {err}")
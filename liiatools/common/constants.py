@@ -9,6 +9,7 @@ class ProcessNames(StrEnum):
 
     SESSIONS_FOLDER = "sessions"
     CURRENT_FOLDER = "current"
+    CACHE_FOLDER = "cache"
 
 
 class SessionNames(StrEnum):
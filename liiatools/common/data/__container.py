@@ -1,6 +1,5 @@
+import gzip
 import logging
-import io
-import csv
 from dataclasses import dataclass
 from typing import Any, Dict, List
 
@@ -11,6 +10,23 @@ from tablib.formats import registry as tablib_registry
 
 logger = logging.getLogger(__name__)
 
+CSV_CHUNK_ROWS = 10_000
+
+
+def _render_csv(df: pd.DataFrame, header: bool = False) -> bytes:
+    """
+    Render rows of a DataFrame as csv, with nulls of every dtype written as empty cells and the same
+    line endings and datetime format as the tablib csv export.
+    """
+    return df.to_csv(
+        None,
+        index=False,
+        header=header,
+        na_rep="",
+        lineterminator="\r\n",
+        date_format="%Y-%m-%d %H:%M:%S",
+    ).encode("utf-8")
+
 
 class DataContainer(Dict[str, pd.DataFrame]):
     """
@@ -27,23 +43,42 @@ class DataContainer(Dict[str, pd.DataFrame]):
     def to_databook(self) -> Databook:
         return Databook([self.to_dataset(k) for k in self.keys()])
 
-    def copy(self) -> "DataContainer":
-        """
-        Returns a deep copy of the DataContainer
+    def copy(self, deep: bool = False) -> "DataContainer":
         """
-        return DataContainer({k: v.copy() for k, v in self.items()})
+        Returns a copy of the DataContainer
 
-    def export(self, fs: FS, basename: str, format="csv", max_file_size_mb=None):
+        Under pandas copy-on-write the tables of a shallow copy share their data with the originals until either
+        of them is modified, so changes to one are never seen in the other and the copy itself is O(1). Pass
+        deep=True to copy the data straight away.
+        """
+        return DataContainer({k: v.copy(deep=deep) for k, v in self.items()})
+
+    def export(
+        self,
+        fs: FS,
+        basename: str,
+        format="csv",
+        max_file_size_mb=None,
+        compression=None,
+    ):
         """
         Export the data to a filesystem. Supports any format supported by tablib, plus parquet.
 
         If the format supports multiple sheets (e.g. xlsx), then each table will be exported to a separate sheet in the same file,
         otherwise each table will be exported to a separate file.
+
+        csv files are streamed from the DataFrames, split into _partN files of at most max_file_size_mb if given,
+        and gzipped if compression is "gzip".
         """
         logger.debug("Exporting data to %s", basename)
         if format == "parquet":
             return self._export_parquet(fs, basename)
 
+        if format == "csv":
+            for table_name in self:
+                self._export_csv(fs, basename, table_name, max_file_size_mb, compression)
+            return
+
         fmt = tablib_registry.get_format(format)
         fmt_ext = fmt.extensions[0]
 
@@ -54,12 +89,8 @@ class DataContainer(Dict[str, pd.DataFrame]):
         else:
             for table_name in self:
                 dataset = self.to_dataset(table_name)
-
-                if max_file_size_mb and format=="csv":
-                    self._export_csv_chunked(fs, basename, table_name, dataset, max_file_size_mb)
-                else:
-                    data = dataset.export(format)
-                    self._write(fs, f"{basename}{table_name}.{fmt_ext}", data)
+                data = dataset.export(format)
+                self._write(fs, f"{basename}{table_name}.{fmt_ext}", data)
 
     def _export_parquet(self, fs: FS, basename: str):
         for table_name in self:
@@ -74,46 +105,80 @@ class DataContainer(Dict[str, pd.DataFrame]):
                 data = data.replace("<NA>", "").replace("nan", "").replace("NaT", "")
             f.write(data)
 
-    def _export_csv_chunked(self, fs, basename, table_name, dataset, max_file_size_mb):
+    def _export_csv(
+        self,
+        fs: FS,
+        basename: str,
+        table_name: str,
+        max_file_size_mb=None,
+        compression=None,
+    ):
+        """
+        Stream a table to csv in chunks of rows, written straight to the file.
 
-        max_bytes = max_file_size_mb * 1024 * 1024
+        If max_file_size_mb is given, the bytes written are tracked and a new file is started whenever the next
+        rows would take the file over the limit. If that happens, the files are named _part1, _part2, etc.
+        A single row larger than the limit is written to a file of its own. With gzip compression the limit
+        applies to the uncompressed csv.
+        """
+        df = self[table_name]
+        ext = "csv.gz" if compression == "gzip" else "csv"
+        max_bytes = max_file_size_mb * 1024 * 1024 if max_file_size_mb else None
+        header = _render_csv(df.iloc[:0], header=True)
+
+        def _open(path):
+            f = fs.openbin(path, "w")
+            if compression == "gzip":
+                return f, gzip.GzipFile(fileobj=f, mode="wb")
+            return f, f
+
+        def _close(f, stream):
+            if stream is not f:
+                stream.close()
+            f.close()
 
         part = 1
-        split_occurred = False
-
-        buffer = io.StringIO()
-        writer = csv.writer(buffer)
-
-        # Write header
-        writer.writerow(dataset.headers)
-
-        for row in dataset:
-            row_buffer = io.StringIO()
-            row_writer = csv.writer(row_buffer)
-            row_writer.writerow(row)
-
-            row_data = row_buffer.getvalue()
-            row_size = len(row_data.encode("utf-8"))
-
-            # Flush current file if writing row would exceed max size
-            if buffer.tell() + row_size > max_bytes:
-                split_occurred = True
-                filename = f"{basename}{table_name}_part{part}.csv"
-                self._write(fs, filename, buffer.getvalue())
-
+        path = f"{basename}{table_name}.{ext}"
+        f, stream = _open(path)
+        stream.write(header)
+        written = len(header)
+
+        start = 0
+        while start < len(df):
+            chunk = df.iloc[start : start + CSV_CHUNK_ROWS]
+            data = _render_csv(chunk)
+            rows = len(chunk)
+
+            if max_bytes and written + len(data) > max_bytes:
+                # Find the most rows of the chunk that still fit in this file
+                low, high, fitted = 0, rows - 1, b""
+                while low < high:
+                    mid = (low + high + 1) // 2
+                    candidate = _render_csv(chunk.iloc[:mid])
+                    if written + len(candidate) <= max_bytes:
+                        low, fitted = mid, candidate
+                    else:
+                        high = mid - 1
+                rows, data = low, fitted
+
+                if rows == 0 and written == len(header):
+                    rows, data = 1, _render_csv(chunk.iloc[:1])
+
+            stream.write(data)
+            written += len(data)
+            start += rows
+
+            if rows < len(chunk):
+                _close(f, stream)
+                if part == 1:
+                    fs.move(path, f"{basename}{table_name}_part1.{ext}", overwrite=True)
                 part += 1
-                buffer = io.StringIO()
-                writer = csv.writer(buffer)
-                writer.writerow(dataset.headers)
+                path = f"{basename}{table_name}_part{part}.{ext}"
+                f, stream = _open(path)
+                stream.write(header)
+                written = len(header)
 
-            writer.writerow(row)
-
-        # Final write
-        if split_occurred:
-            filename = f"{basename}{table_name}_part{part}.csv"
-        else:
-            filename = f"{basename}{table_name}.csv"
-        self._write(fs, filename, buffer.getvalue())
+        _close(f, stream)
 
 
 class ErrorContainer(List[Dict[str, Any]]):
@@ -0,0 +1,29 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+
+def composite_key_codes(keys: List[List[pd.Series]]) -> List[np.ndarray]:
+    """
+    Factorises a key made up of several columns across several tables at once
+
+    Each table is given as the list of its key columns, in the same order for every table. Rows with equal keys
+    get the same int64 code whichever table they are in, so tables can be joined on the codes instead of on the
+    key columns. Missing values match each other, as they do in a merge.
+    """
+    lengths = [len(columns[0]) for columns in keys]
+    codes = np.zeros(sum(lengths), dtype=np.int64)
+    bound = 1
+    for columns in zip(*keys):
+        column_codes, uniques = pd.factorize(
+            pd.concat(columns, ignore_index=True), use_na_sentinel=False
+        )
+        size = max(len(uniques), 1)
+        if bound > np.iinfo(np.int64).max // size:
+            # Renumber the codes so far, which are then fewer than the number of rows, before they overflow
+            codes, renumbered = pd.factorize(codes)
+            bound = len(renumbered)
+        codes = codes * size + column_codes
+        bound *= size
+    return np.split(codes, np.cumsum(lengths)[:-1])
@@ -1,13 +1,19 @@
+import codecs
 import hashlib
 import logging
 import re
+import shutil
+import threading
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from enum import Enum
 from os.path import basename, dirname
-from typing import List, Tuple
+from typing import BinaryIO, Dict, List, Tuple
 
 import chardet
+import fs.errors
 import numpy as np
 import pandas as pd
 import yaml
@@ -15,6 +21,7 @@ from fs.base import FS
 from fs.info import Info
 from fs.move import copy_file
 
+from liiatools.common.archive import DEFAULT_MAX_WORKERS
 from liiatools.common.checks import check_la, check_month, check_year, check_term, check_school_type, check_identifier
 from liiatools.common.constants import ProcessNames, SessionNames
 
@@ -27,6 +34,131 @@ def _get_timestamp():
     return datetime.utcnow().strftime("%Y%m%dT%H%M%S.%f")
 
 
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _delegate(fs: FS, path: str) -> Tuple[FS, str]:
+    """
+    Resolve a path on a sub or wrapped filesystem to the underlying filesystem.
+    """
+    while hasattr(fs, "delegate_path"):
+        fs, path = fs.delegate_path(path)
+    return fs, path
+
+
+def hash_file(fs: FS, path: str) -> Tuple[str, int]:
+    """
+    Calculate the SHA-256 and size of a file, reading it in chunks.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with fs.openbin(path) as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _s3_location(fs: FS, path: str) -> Tuple[tuple, str, str] | None:
+    """
+    Return the connection, bucket and key of a path on an S3 filesystem, or None for any other filesystem.
+
+    The connection is the endpoint, region and access key, which two S3 filesystems must share for an object to
+    be copied from one to the other by the destination's client.
+    """
+    if not (hasattr(fs, "_bucket_name") and hasattr(fs, "_path_to_key")):
+        return None
+    connection = (
+        getattr(fs, "endpoint_url", None),
+        getattr(fs, "region", None),
+        getattr(fs, "aws_access_key_id", None),
+    )
+    return connection, fs._bucket_name, fs._path_to_key(fs.validatepath(path))
+
+
+def _server_side_copy(source_fs: FS, file_path: str, dest_fs: FS, dest_path: str) -> bool:
+    """
+    Copy a file without streaming it through the pipeline where the filesystems allow it, i.e. when both paths
+    are on the same filesystem, both are on local disk, or both are on S3 with the same connection. The
+    filesystems are opened afresh for each job, so S3 filesystems are compared by connection rather than identity.
+
+    Returns False if the file has to be streamed instead.
+    """
+    src_fs, src_path = _delegate(source_fs, file_path)
+    dst_fs, dst_path = _delegate(dest_fs, dest_path)
+
+    if src_fs is dst_fs:
+        src_fs.copy(src_path, dst_path, overwrite=True)
+        return True
+    if src_fs.hassyspath(src_path) and dst_fs.hassyspath(dst_path):
+        shutil.copyfile(src_fs.getsyspath(src_path), dst_fs.getsyspath(dst_path))
+        return True
+
+    src_s3 = _s3_location(src_fs, src_path)
+    dst_s3 = _s3_location(dst_fs, dst_path)
+    if src_s3 and dst_s3 and src_s3[0] == dst_s3[0]:
+        try:
+            dst_fs.client.copy_object(
+                Bucket=dst_s3[1],
+                Key=dst_s3[2],
+                CopySource={"Bucket": src_s3[1], "Key": src_s3[2]},
+            )
+        except Exception as err:
+            logger.warning(
+                f"Server-side copy of {file_path} failed, streaming it instead: {err}"
+            )
+            return False
+        return True
+    return False
+
+
+def copy_and_hash_file(
+    source_fs: FS, file_path: str, dest_fs: FS, dest_path: str, size: int = None
+) -> str:
+    """
+    Copy a file between filesystems and return its SHA-256.
+
+    Where possible the file is copied server-side and the source is hashed in place. Otherwise the file is
+    streamed in chunks and hashed as it is written, so it is read only once and never held in memory. In both
+    cases the copy is then re-hashed, and its size and hash are checked against the source before the hash is
+    returned.
+
+    :param source_fs: The filesystem containing the file
+    :param file_path: The location of the file in the source filesystem
+    :param dest_fs: The filesystem to copy the file to
+    :param dest_path: The location of the copy in the destination filesystem
+    :param size: The expected size of the file in bytes, if known
+    :return: The hex digest of the SHA-256 of the copied file
+    """
+    if _server_side_copy(source_fs, file_path, dest_fs, dest_path):
+        file_sha, copied_size = hash_file(source_fs, file_path)
+    else:
+        digest = hashlib.sha256()
+        copied_size = 0
+        with source_fs.openbin(file_path) as src, dest_fs.openbin(dest_path, "w") as dst:
+            for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                dst.write(chunk)
+                copied_size += len(chunk)
+        file_sha = digest.hexdigest()
+
+    if size is None:
+        size = source_fs.getsize(file_path)
+    dest_sha, dest_size = hash_file(dest_fs, dest_path)
+    if copied_size != size or dest_size != size:
+        raise fs.errors.OperationFailed(
+            path=dest_path,
+            msg=f"Copy of {file_path} is incomplete: expected {size} bytes, copied {dest_size}",
+        )
+    if dest_sha != file_sha:
+        raise fs.errors.OperationFailed(
+            path=dest_path,
+            msg=f"Copy of {file_path} does not match the source: expected SHA-256 {file_sha}, copied {dest_sha}",
+        )
+
+    return file_sha
+
+
 def _move_incoming_file(
     source_fs: FS, dest_fs: FS, file_path: str, file_info: Info
 ) -> FileLocator:
@@ -34,7 +166,9 @@ def _move_incoming_file(
     Move a file from the incoming folder to the correct location in the archive.
     """
     file_uuid = uuid.uuid4().hex
-    file_sha = hashlib.sha256(source_fs.readbytes(file_path)).hexdigest()
+    file_sha = copy_and_hash_file(
+        source_fs, file_path, dest_fs, file_uuid, size=file_info.size
+    )
 
     file_locator = FileLocator(
         dest_fs,
@@ -51,7 +185,6 @@ def _move_incoming_file(
     )
 
     dest_fs.writetext(f"{file_uuid}_meta.yaml", yaml.dump(file_locator.meta))
-    copy_file(source_fs, file_path, dest_fs, file_uuid)
 
     return file_locator
 
@@ -84,31 +217,44 @@ def create_session_folder(destination_fs: FS, session_names) -> Tuple[FS, str]:
 
 
 def move_files_for_processing(
-    source_fs: FS, session_fs: FS, continue_on_error: bool = False
+    source_fs: FS,
+    session_fs: FS,
+    continue_on_error: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
 ) -> List[FileLocator]:
     """
-    Moves all files from the source filesystem to the session folder. This is a generator function that yields a FileLocator for each file moved.
+    Moves all files from the source filesystem to the session folder and returns a FileLocator for each file moved.
+
+    Files are copied using up to max_workers threads. The locators are returned in the order the files were found.
     """
 
     destination_fs = session_fs.opendir(SessionNames.INCOMING_FOLDER)
-    source_file_list = source_fs.walk.info(namespaces=["details"])
+    source_file_list = [
+        (file_path, file_info)
+        for file_path, file_info in source_fs.walk.info(namespaces=["details"])
+        if file_info.is_file
+    ]
+
+    def _move(file):
+        file_path, file_info = file
+        try:
+            return _move_incoming_file(source_fs, destination_fs, file_path, file_info)
+        except Exception as e:
+            logger.error(f"Error moving file {file_path} to session folder")
+            if continue_on_error:
+                return None
+            else:
+                raise e
 
-    locator_list = []
+    if max_workers is None or max_workers <= 1 or len(source_file_list) <= 1:
+        moved = [_move(file) for file in source_file_list]
+    else:
+        with ThreadPoolExecutor(
+            max_workers=min(max_workers, len(source_file_list))
+        ) as executor:
+            moved = list(executor.map(_move, source_file_list))
 
-    for file_path, file_info in source_file_list:
-        if file_info.is_file:
-            try:
-                locator_list.append(
-                    _move_incoming_file(source_fs, destination_fs, file_path, file_info)
-                )
-            except Exception as e:
-                logger.error(f"Error moving file {file_path} to session folder")
-                if continue_on_error:
-                    pass
-                else:
-                    raise e
-
-    return locator_list
+    return [locator for locator in moved if locator is not None]
 
 
 def move_files_for_sharing(
@@ -374,29 +520,130 @@ def remove_files(regex: str, existing_files: list, folder: FS):
         folder.remove(file)
 
 
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+_BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# The most recently used encodings are kept, so a long running code server does not hold one for every file it
+# has ever opened
+ENCODING_CACHE_SIZE = 4096
+
+_encoding_cache: "OrderedDict[Tuple[str, int, datetime], str]" = OrderedDict()
+_encoding_cache_lock = threading.Lock()
+
+
+def _encoding_cache_key(fs: FS, file_path: str) -> Tuple[str, int, datetime] | None:
+    """
+    Key detected encodings by the file's location, size and modified time so a changed file is detected again.
+    """
+    info = fs.getinfo(file_path, namespaces=["details"])
+    if info.modified is None:
+        return None
+    return fs.desc(file_path), info.size, info.modified
+
+
+def _get_cached_encoding(cache_key: Tuple[str, int, datetime] | None) -> str | None:
+    if cache_key is None:
+        return None
+    with _encoding_cache_lock:
+        encoding = _encoding_cache.get(cache_key)
+        if encoding is not None:
+            _encoding_cache.move_to_end(cache_key)
+    return encoding
+
+
+def _cache_encoding(cache_key: Tuple[str, int, datetime] | None, encoding: str):
+    if cache_key is None:
+        return
+    with _encoding_cache_lock:
+        _encoding_cache[cache_key] = encoding
+        _encoding_cache.move_to_end(cache_key)
+        while len(_encoding_cache) > ENCODING_CACHE_SIZE:
+            _encoding_cache.popitem(last=False)
+
+
+def _detect_encoding(f: BinaryIO) -> str:
+    """
+    Detect the encoding of an open binary file from a bounded sample at its start, leaving the file at the
+    position it was opened at.
+
+    A byte order mark or a sample that is valid UTF-8 is trusted without running chardet.
+    """
+    start = f.tell()
+    sample = f.read(ENCODING_SAMPLE_SIZE)
+    complete = len(sample) < ENCODING_SAMPLE_SIZE
+    f.seek(start)
+
+    for bom, encoding in _BOM_ENCODINGS:
+        if sample.startswith(bom):
+            return encoding
+
+    try:
+        sample.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as err:
+        # The sample may end part way through a multibyte character
+        if not complete and err.start >= len(sample) - 3 and err.reason == "unexpected end of data":
+            return "utf-8"
+
+    return chardet.detect(sample)["encoding"]
+
+
+def _detect_encoding_full(f: BinaryIO) -> str:
+    """
+    Detect the encoding of an open binary file by feeding chardet the whole file in chunks, leaving the file
+    at the position it was opened at.
+    """
+    start = f.tell()
+    detector = chardet.UniversalDetector()
+    for chunk in iter(lambda: f.read(ENCODING_SAMPLE_SIZE), b""):
+        detector.feed(chunk)
+        if detector.done:
+            break
+    f.seek(start)
+    return detector.close()["encoding"]
+
+
 def open_file(fs: FS, file: str) -> pd.DataFrame:
     """
     Opens a file within a pyfilesystem
+
+    The encoding is detected from a sample at the start of the file, which is then read from the same handle.
+    If the rest of the file turns out not to match the sample, the encoding is detected from the whole file.
     """
-    # Check file encoding
-    encoding = check_encoding(fs, file)
-    # Open the CSV file using the FS URL
+    cache_key = _encoding_cache_key(fs, file)
     with fs.open(file, "rb") as f:
-        # Read the file content into a pandas DataFrame
-        df = pd.read_csv(f, encoding=encoding)
+        encoding = _get_cached_encoding(cache_key) or _detect_encoding(f)
+        try:
+            df = pd.read_csv(f, encoding=encoding)
+        except UnicodeDecodeError:
+            f.seek(0)
+            encoding = _detect_encoding_full(f)
+            df = pd.read_csv(f, encoding=encoding)
+    _cache_encoding(cache_key, encoding)
     df = drop_blank_columns(df)
     return df
 
 
 def check_encoding(fs: FS, file_path: str) -> str:
     """
-    Check encoding of a file
+    Check encoding of a file from a sample at its start. Results are cached by path, size and modified time.
     """
-    file = fs.open(file_path, "rb")
+    cache_key = _encoding_cache_key(fs, file_path)
+    encoding = _get_cached_encoding(cache_key)
+    if encoding is not None:
+        return encoding
 
-    bytes_data = file.read()  # Read as bytes
-    result = chardet.detect(bytes_data)  # Detect encoding on bytes
-    return result["encoding"]
+    with fs.open(file_path, "rb") as f:
+        encoding = _detect_encoding(f)
+    _cache_encoding(cache_key, encoding)
+    return encoding
 
 
 def drop_blank_columns(df: pd.DataFrame) -> pd.DataFrame:
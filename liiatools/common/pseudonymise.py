@@ -0,0 +1,129 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+def _sha256_batch(values: Sequence[str], salt: str | None) -> List[str]:
+    """
+    Hash a batch of strings, appending the salt if there is one. Top level so it can be sent to a process pool.
+    """
+    salt_bytes = salt.encode("utf-8") if salt else b""
+    return [
+        hashlib.sha256(value.encode("utf-8") + salt_bytes).hexdigest()
+        for value in values
+    ]
+
+
+class Sha256Pseudonymiser:
+    """
+    Pseudonymises values with a salted SHA-256, giving the same digest as hashing each value on its own.
+
+    Only the distinct values of a column are hashed and the digests are broadcast back to the rows. Digests are kept
+    in a bounded LRU cache so identifiers that appear in several tables and files in a run (e.g. CHILD in the 903
+    header, episodes, uasc, missing and oc2 tables) are only hashed once. When there are more than
+    process_threshold values to hash, they are split across a process pool.
+
+    :param max_cache_size: The maximum number of digests to keep
+    :param process_threshold: The number of uncached values above which hashing uses a process pool
+    :param max_workers: The number of processes in the pool, defaults to the number of CPUs
+    """
+
+    def __init__(
+        self,
+        max_cache_size: int = 200_000,
+        process_threshold: int = 500_000,
+        max_workers: int = None,
+    ):
+        self.max_cache_size = max_cache_size
+        self.process_threshold = process_threshold
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.hits = 0
+        self.misses = 0
+        self.__cache = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__cache)
+
+    def clear(self):
+        with self.__lock:
+            self.__cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _hash_uncached(self, values: List[str], salt: str | None) -> List[str]:
+        if len(values) <= self.process_threshold or self.max_workers <= 1:
+            return _sha256_batch(values, salt)
+
+        chunk_size = -(-len(values) // self.max_workers)
+        chunks = [
+            values[start : start + chunk_size]
+            for start in range(0, len(values), chunk_size)
+        ]
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(_sha256_batch, chunks, [salt] * len(chunks))
+            return [digest for result in results for digest in result]
+
+    def hash_strings(self, values: Sequence[str], salt: str | None = None) -> List[str]:
+        """
+        Return the salted SHA-256 hex digest of each string, using cached digests where available.
+        """
+        digests = [None] * len(values)
+        uncached = []
+        with self.__lock:
+            for ix, value in enumerate(values):
+                digest = self.__cache.get((salt, value))
+                if digest is None:
+                    uncached.append(ix)
+                else:
+                    self.__cache.move_to_end((salt, value))
+                    digests[ix] = digest
+            self.hits += len(values) - len(uncached)
+            self.misses += len(uncached)
+
+        if not uncached:
+            return digests
+
+        new_digests = self._hash_uncached([values[ix] for ix in uncached], salt)
+
+        with self.__lock:
+            for ix, digest in zip(uncached, new_digests):
+                digests[ix] = digest
+                self.__cache[(salt, values[ix])] = digest
+            while len(self.__cache) > self.max_cache_size:
+                self.__cache.popitem(last=False)
+
+        return digests
+
+    def hash_series(self, values: pd.Series, salt: str | None = None) -> pd.Series:
+        """
+        Pseudonymise a column. Falsy values (None, empty strings, 0) are returned unchanged, everything else is
+        hashed as its string representation.
+        """
+        index, name = values.index, values.name
+        values = values.to_numpy(dtype=object)
+        is_na = pd.isna(values)
+
+        # Falsiness is checked per value and the distinct values are found on the string form, so values that
+        # compare equal but print differently (1, 1.0 and True, or 0 and False) are hashed separately
+        to_hash = ~is_na
+        to_hash[to_hash] = values[to_hash].astype(bool)
+        codes, uniques = pd.factorize(values[to_hash].astype(str))
+        digests = self.hash_strings(uniques.tolist(), salt)
+
+        hashed = values.copy()
+        hashed[to_hash] = np.array(digests, dtype=object)[codes]
+        hashed[is_na] = [
+            self.hash_strings([str(value)], salt)[0] if value else value
+            for value in values[is_na]
+        ]
+        return pd.Series(hashed, index=index, name=name, dtype=object)
+
+
+pseudonymiser = Sha256Pseudonymiser()
@@ -1,3 +1,4 @@
 from liiatools.common.reference._authorities import LACodeLookup
+from liiatools.common.reference._postcodes import PostcodeLookup
 
 authorities = LACodeLookup()
@@ -0,0 +1,104 @@
+import logging
+import threading
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from fs.base import FS
+from fs.errors import NoSysPath
+
+logger = logging.getLogger(__name__)
+
+
+def normalise_postcodes(postcodes: pd.Series) -> pd.Series:
+    """
+    Normalise postcodes to the key used for lookups by upper-casing them and removing all whitespace.
+    """
+    return (
+        postcodes.astype(object)
+        .map(str, na_action="ignore")
+        .str.replace(r"\s+", "", regex=True)
+        .str.upper()
+    )
+
+
+class PostcodeLookup:
+    """
+    A resident lookup from postcode to another column of a postcode parquet file, such as the upper tier local
+    authority code.
+
+    The parquet is read once, on the first lookup, and indexed by normalised postcode. It is read again if the
+    file's size or modification time changes.
+
+    :param open_folder: A callable returning the folder holding the parquet file
+    :param filename: The name of the parquet file
+    :param postcode_column: The column holding the postcodes
+    :param value_column: The column to return
+    """
+
+    def __init__(
+        self,
+        open_folder: Callable[[], FS],
+        filename: str,
+        postcode_column: str,
+        value_column: str,
+    ):
+        self.open_folder = open_folder
+        self.filename = filename
+        self.postcode_column = postcode_column
+        self.value_column = value_column
+        self.__folder = None
+        self.__version = None
+        self.__index = None
+        self.__values = None
+        self.__lock = threading.Lock()
+
+    def invalidate(self):
+        with self.__lock:
+            self.__version = None
+            self.__index = None
+            self.__values = None
+
+    def _read_table(self, folder: FS) -> pd.DataFrame:
+        columns = [self.postcode_column, self.value_column]
+        try:
+            path = folder.getsyspath(self.filename)
+            table = pq.read_table(path, columns=columns, memory_map=True)
+        except NoSysPath:
+            with folder.open(self.filename, "rb") as f:
+                table = pq.read_table(f, columns=columns)
+        return table.to_pandas()
+
+    def _load(self):
+        if self.__folder is None:
+            self.__folder = self.open_folder()
+
+        info = self.__folder.getinfo(self.filename, namespaces=["details"])
+        version = (info.size, info.modified)
+        if version == self.__version:
+            return
+
+        logger.info(f"Loading postcode lookup from {self.filename}")
+        mapping = self._read_table(self.__folder)
+        keys = normalise_postcodes(mapping[self.postcode_column])
+        first = ~keys.duplicated() & keys.notna()
+
+        self.__index = pd.Index(keys[first].to_numpy())
+        # The extra None is picked up by the -1 returned by get_indexer for postcodes that are not found
+        self.__values = np.append(
+            mapping.loc[first, self.value_column].to_numpy(dtype=object), [None]
+        )
+        self.__version = version
+
+    def lookup(self, postcodes: pd.Series) -> pd.Series:
+        """
+        Look up a column of postcodes, returning a series with the same index. Postcodes that are blank or not
+        found give a null value.
+        """
+        with self.__lock:
+            self._load()
+            index, values = self.__index, self.__values
+
+        indexer = index.get_indexer(normalise_postcodes(postcodes))
+        return pd.Series(values[indexer], index=postcodes.index)
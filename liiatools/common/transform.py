@@ -1,11 +1,14 @@
 import logging
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Callable, Dict, Optional
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, Optional, Tuple
 
+import fs.errors
 import pandas as pd
 
 from liiatools.common.checks import check_la_signature
 from liiatools.common.data import (
+    ColumnConfig,
     DataContainer,
     ErrorContainer,
     Metadata,
@@ -13,11 +16,43 @@ from liiatools.common.data import (
     ProcessResult,
     TableConfig,
 )
-
-from ._transform_functions import degrade_functions, enrich_functions
+from liiatools.common.pipeline import hash_file
+
+from ._transform_functions import (
+    degrade_column_functions,
+    degrade_functions,
+    enrich_column_functions,
+    enrich_functions,
+    postcode_las,
+)
 
 logger = logging.getLogger(__name__)
 
+# Version of the enrich and degrade transforms, which is part of the key of the processed file cache. Increase it when
+# one of them changes so that cached results are rebuilt
+TRANSFORM_VERSION = 1
+
+
+def external_data_hashes(config: PipelineConfig) -> Dict[str, str | None]:
+    """
+    Returns the SHA-256 of each external data file read by the enrich transforms in the config, keyed by filename,
+    or None for a file which is missing
+    """
+    uses_postcode_lookup = any(
+        "postcode_la_lookup"
+        in (column.enrich if isinstance(column.enrich, list) else [column.enrich])
+        for table in config.table_list
+        for column in table.columns
+    )
+    if not uses_postcode_lookup:
+        return {}
+
+    try:
+        file_sha = hash_file(postcode_las.open_folder(), postcode_las.filename)[0]
+    except fs.errors.ResourceNotFound:
+        file_sha = None
+    return {postcode_las.filename: file_sha}
+
 
 def _transform(
     data: pd.DataFrame,
@@ -26,42 +61,64 @@ def _transform(
     property: str,
     functions: Dict[str, Callable],
     additional_property: Optional[str] = None,
+    column_functions: Optional[Dict[str, Callable]] = None,
 ):
-    """Performs a transform on a table"""
+    """
+    Performs a transform on a table
+
+    Where a transform has a column-wise implementation in column_functions it is used in preference to applying
+    the row-wise function to every row.
+    """
+    if column_functions is None:
+        column_functions = {}
+
     for column_config in table_config.columns:
-        transform_name = getattr(column_config, property)
-        if transform_name:
-            if isinstance(transform_name, list):
-                for transform_name in transform_name:
-                    assert (
-                        transform_name in functions
-                    ), f"Unknown transform for property '{property}': {transform_name}"
-                    if transform_name == "postcode_la_lookup":
-                        mapping_field = getattr(column_config, additional_property)
-                        mapping_function = functions[transform_name]
-                        data = mapping_function(data, mapping_field, column_config.id)
-                    else:
-                        data[column_config.id] = data.apply(
-                            lambda row: functions[transform_name](
-                                row, column_config, metadata
-                            ),
-                            axis=1,
-                        )
+        transform_names = getattr(column_config, property)
+        if not transform_names:
+            continue
+        if not isinstance(transform_names, list):
+            transform_names = [transform_names]
+
+        for transform_name in transform_names:
+            assert (
+                transform_name in functions
+            ), f"Unknown transform for property '{property}': {transform_name}"
+            if transform_name == "postcode_la_lookup":
+                mapping_field = getattr(column_config, additional_property)
+                mapping_function = functions[transform_name]
+                data = mapping_function(data, mapping_field, column_config.id)
+            elif transform_name in column_functions:
+                data[column_config.id] = column_functions[transform_name](
+                    data, column_config, metadata
+                )
             else:
-                assert (
-                    transform_name in functions
-                ), f"Unknown transform for property '{property}': {transform_name}"
-                if transform_name == "postcode_la_lookup":
-                    mapping_field = getattr(column_config, additional_property)
-                    mapping_function = functions[transform_name]
-                    data = mapping_function(data, mapping_field, column_config.id)
-                else:
-                    data[column_config.id] = data.apply(
-                        lambda row: functions[transform_name](
-                            row, column_config, metadata
-                        ),
-                        axis=1,
-                    )
+                data[column_config.id] = data.apply(
+                    lambda row: functions[transform_name](row, column_config, metadata),
+                    axis=1,
+                )
+
+
+def _remove_rows(
+    table: pd.DataFrame, table_name: str, errors: ErrorContainer
+) -> pd.DataFrame:
+    """
+    Drops the rows a transform has marked with "remove_row", recording an error for each of them
+    """
+    remove_row_mask = ~table.isin(["remove_row"]).any(axis=1)
+    remove_row_indices = table.index[~remove_row_mask].tolist()
+
+    for row in remove_row_indices:
+        r_ix = row + 2  # Adjust for 0-indexing and header row
+        errors.append(
+            dict(
+                type="InvalidMandatoryField",
+                message=f"Row {r_ix} removed due to invalid mandatory field",
+                table_name=table_name,
+                row_number=r_ix,
+            )
+        )
+
+    return table[remove_row_mask]
 
 
 def data_transforms(
@@ -71,14 +128,17 @@ def data_transforms(
     property: str,
     functions: Dict[str, Callable],
     additional_property: Optional[str] = None,
+    column_functions: Optional[Dict[str, Callable]] = None,
 ) -> ProcessResult:
     """Pipelines can have a set of data transforms that are applied to the data after it has been cleaned.
 
     The standard ones we have are enrich and degrade. Enrich adds new columns to the data, degrade modifies existing
     columns to remove or minimise identifying information.
+
+    Transforms are looked up in column_functions first, which hold column-wise versions of the row-wise functions.
     """
 
-    # Create a copy of the data so we don't mutate the original
+    # Create a copy of the data so we don't mutate the original, this is cheap under copy-on-write
     data = data.copy()
 
     errors = ErrorContainer()
@@ -94,25 +154,11 @@ def data_transforms(
                     property,
                     functions,
                     additional_property,
+                    column_functions,
                 )
-                remove_row_mask = (
-                    ~data[table_config.id].isin(["remove_row"]).any(axis=1)
+                data[table_config.id] = _remove_rows(
+                    data[table_config.id], table_config.id, errors
                 )
-                remove_row_indices = (
-                    data[table_config.id].index[~remove_row_mask].tolist()
-                )
-                data[table_config.id] = data[table_config.id][remove_row_mask]
-
-                for row in remove_row_indices:
-                    r_ix = row + 2  # Adjust for 0-indexing and header row
-                    errors.append(
-                        dict(
-                            type="InvalidMandatoryField",
-                            message=f"Row {r_ix} removed due to invalid mandatory field",
-                            table_name=table_config.id,
-                            row_number=r_ix,
-                        )
-                    )
     except Exception as e:
         # As this step is crucial for ensure privacy, if we have any errors we should fail and return no data for this dataset.
         logger.exception(f"Error in {property} transform")
@@ -130,7 +176,13 @@ def enrich_data(
         metadata = {}
 
     return data_transforms(
-        data, config, metadata, "enrich", enrich_functions, "enrich_input"
+        data,
+        config,
+        metadata,
+        "enrich",
+        enrich_functions,
+        "enrich_input",
+        enrich_column_functions,
     )
 
 
@@ -141,7 +193,14 @@ def degrade_data(
     if metadata is None:
         metadata = {}
 
-    return data_transforms(data, config, metadata, "degrade", degrade_functions)
+    return data_transforms(
+        data,
+        config,
+        metadata,
+        "degrade",
+        degrade_functions,
+        column_functions=degrade_column_functions,
+    )
 
 
 def prepare_export(
@@ -166,35 +225,143 @@ def prepare_export(
 
     # Loop over known tables
     for table_config in table_list:
-        table_name = table_config.id
-        table_config = table_config.columns_for_profile(profile)
-        table_columns = [column.id for column in table_config]
-        column_types = {col.id: col.type for col in table_config}
-
         # Only export if the table is in the data
-        if table_name in data:
-            table = data[table_name].copy()
-
-            for column_name, type in column_types.items():
-                # Create any missing columns
-                if column_name not in table.columns:
-                    table[column_name] = None
-                # If column is numeric, ensure blanks are converted to NaN
-                if type == "float":
-                    table[column_name] = pd.to_numeric(
-                        table[column_name], errors="coerce"
-                    )
-                elif type == "integer":
-                    table[column_name] = pd.to_numeric(
-                        table[column_name], errors="coerce"
-                    ).astype("Int64")
-
-            # Return the subset
-            data_container[table_name] = table[table_columns].copy()
+        if table_config.id in data:
+            data_container[table_config.id] = _prepare_table(
+                data[table_config.id], table_config.columns_for_profile(profile)
+            )
 
     return data_container
 
 
+def _prepare_table(table: pd.DataFrame, columns: List[ColumnConfig]) -> pd.DataFrame:
+    """
+    Selects the configured columns of a table in config order, creating any that are missing and coercing
+    numeric columns. Only the selected columns are copied.
+    """
+    table_columns = [column.id for column in columns]
+    table = table[[column for column in table_columns if column in table.columns]]
+
+    for column in columns:
+        # Create any missing columns
+        if column.id not in table.columns:
+            table[column.id] = None
+        # If column is numeric, ensure blanks are converted to NaN
+        if column.type == "float":
+            table[column.id] = pd.to_numeric(table[column.id], errors="coerce")
+        elif column.type == "integer":
+            table[column.id] = pd.to_numeric(table[column.id], errors="coerce").astype(
+                "Int64"
+            )
+
+    return table[table_columns]
+
+
+@dataclass
+class ExportResult:
+    cleaned: DataContainer
+    enriched: DataContainer
+    degraded: DataContainer | None
+    errors: ErrorContainer
+
+
+class ExportPlan:
+    """
+    A plan for preparing a file for export, enriching it and, optionally, degrading it.
+
+    This gives the same result as calling prepare_export, enrich_data and degrade_data in turn, but the tables
+    and columns for the profiles are worked out once when the plan is created, and each table is then taken
+    through every step in one pass. The only copy of the data is made when the columns are selected. The
+    cleaned and enriched tables are kept as shallow copies, which pandas copy-on-write keeps unchanged when the
+    later steps modify the table.
+
+    :param config: The pipeline config
+    :param profile: The profile or list of profiles to export for
+    :param degrade: Whether to degrade the data
+    """
+
+    def __init__(
+        self, config: PipelineConfig, profile: str | list[str], degrade: bool = True
+    ):
+        self.degrade = degrade
+        self.tables = [
+            (table_config, table_config.columns_for_profile(profile))
+            for table_config in config.tables_for_profile(profile)
+        ]
+
+    def run(self, data: DataContainer, metadata: Metadata = None) -> ExportResult:
+        if metadata is None:
+            metadata = {}
+
+        cleaned = DataContainer()
+        enriched = DataContainer()
+        degraded = DataContainer() if self.degrade else None
+        enrich_errors = ErrorContainer()
+        degrade_errors = ErrorContainer()
+        enrich_failed = False
+        degrade_failed = not self.degrade
+
+        for table_config, columns in self.tables:
+            if table_config.id not in data:
+                continue
+
+            table = _prepare_table(data[table_config.id], columns)
+            cleaned[table_config.id] = table.copy(deep=False)
+            if enrich_failed:
+                continue
+
+            try:
+                _transform(
+                    table,
+                    table_config,
+                    metadata,
+                    "enrich",
+                    enrich_functions,
+                    "enrich_input",
+                    enrich_column_functions,
+                )
+                table = _remove_rows(table, table_config.id, enrich_errors)
+            except Exception as e:
+                # As with enrich_data, a failure removes all the enriched and degraded data
+                logger.exception("Error in enrich transform")
+                enrich_failed = True
+                enrich_errors.append(dict(type="TransformError", message=str(e)))
+                continue
+            enriched[table_config.id] = table.copy(deep=False)
+            if degrade_failed:
+                continue
+
+            try:
+                _transform(
+                    table,
+                    table_config,
+                    metadata,
+                    "degrade",
+                    degrade_functions,
+                    column_functions=degrade_column_functions,
+                )
+                degraded[table_config.id] = _remove_rows(
+                    table, table_config.id, degrade_errors
+                )
+            except Exception as e:
+                logger.exception("Error in degrade transform")
+                degrade_failed = True
+                degrade_errors.append(dict(type="TransformError", message=str(e)))
+
+        if enrich_failed:
+            enriched = DataContainer()
+            degrade_errors = ErrorContainer()
+        if self.degrade and (enrich_failed or degrade_failed):
+            degraded = DataContainer()
+
+        errors = ErrorContainer()
+        errors.extend(enrich_errors)
+        errors.extend(degrade_errors)
+        return ExportResult(
+            cleaned=cleaned, enriched=enriched, degraded=degraded, errors=errors
+        )
+
+
 def apply_retention(
     data: DataContainer,
     config: PipelineConfig,
@@ -214,17 +381,89 @@ def apply_retention(
     :return: The data with retention applied
     """
     data_container = DataContainer()
-    retention_period = config.retention_period[profile]
+    year_cutoff = datetime.now().year - config.retention_period[profile]
     signed_las = check_la_signature(config.la_signed, profile)
-    current_year = datetime.now().year
 
     for table_name in data:
-        table = data[table_name].copy()
+        table = data[table_name]
         data_container[table_name] = table[
-            table[year_column] > current_year - retention_period
+            _retention_mask(table, year_column, la_column, year_cutoff, signed_las)
         ]
 
-        table = data_container[table_name].copy()
-        data_container[table_name] = table[table[la_column].isin(signed_las)]
-
     return data_container
+
+
+def _retention_mask(
+    table: pd.DataFrame,
+    year_column: str,
+    la_column: str,
+    year_cutoff: int,
+    signed_las: Collection[str],
+) -> pd.Series:
+    return (table[year_column] > year_cutoff) & table[la_column].isin(signed_las)
+
+
+class ReportPlan:
+    """
+    A plan for producing the reports for every profile from the same aggregated data.
+
+    Profiles that are degraded at report time share one degraded copy of the data, which is only created if a
+    profile needs it. Each profile's tables are a projection of the aggregate onto its columns, and the retention
+    masks are worked out once for each distinct retention period and set of signed LAs.
+
+    :param config: The pipeline config
+    :param year_column: The column containing the year for data retention
+    :param la_column: The column containing the LA for data retention
+    """
+
+    def __init__(self, config: PipelineConfig, year_column: str, la_column: str):
+        self.config = config
+        self.year_column = year_column
+        self.la_column = la_column
+
+    def degrade(self, profile: str) -> bool:
+        """
+        Reports are degraded when the data was not degraded at clean and the profile requires degraded data
+        """
+        degrade_at_clean = self.config.degrade_at_clean
+        return (
+            any(not v for v in degrade_at_clean.values()) and degrade_at_clean[profile]
+        )
+
+    def reports(
+        self, data: DataContainer, profiles: Iterable[str] = None
+    ) -> Iterator[Tuple[str, DataContainer]]:
+        """
+        Yields the report data for each profile in turn, by default for every profile with a retention period
+        """
+        if profiles is None:
+            profiles = self.config.retention_period.keys()
+
+        degraded = None
+        masks = {}
+        current_year = datetime.now().year
+
+        for profile in profiles:
+            source = data
+            if self.degrade(profile):
+                if degraded is None:
+                    logger.info("Degrading report data...")
+                    degraded = degrade_data(data, self.config).data
+                source = degraded
+
+            year_cutoff = current_year - self.config.retention_period[profile]
+            signed_las = frozenset(check_la_signature(self.config.la_signed, profile))
+
+            report_data = DataContainer()
+            for table_name, table in prepare_export(
+                source, self.config, profile
+            ).items():
+                # Prepared tables keep the index of their source, so a mask can be shared between profiles
+                key = (source is degraded, table_name, year_cutoff, signed_las)
+                if key not in masks:
+                    masks[key] = _retention_mask(
+                        table, self.year_column, self.la_column, year_cutoff, signed_las
+                    )
+                report_data[table_name] = table[masks[key]]
+
+            yield profile, report_data
@@ -0,0 +1,252 @@
+import numpy as np
+import pandas as pd
+from dagster import get_dagster_logger
+
+from liiatools.common.keys import composite_key_codes
+from liiatools.pnw_census_pipeline.pnw_dataset_join import (
+    episodes_open_on_snapshot,
+    format_postcode_sectors,
+    latest_cans_assessments,
+    missing_in_last_12m,
+    oc2_in_snapshot_year,
+)
+
+log = get_dagster_logger(__name__)
+
+
+class PNWJoinPlan:
+    """
+    Enriches the PNW census with the 903, ONSPD and CANS datasets without re-merging
+    each of them onto the growing census
+
+    Each dataset is reduced to a table keyed by child identifier or postcode, and the
+    census rows are looked up in it. Only an integer indexer into the table is kept for
+    each join, and the joined frame is assembled once in result(). The rows, columns and
+    column order are the same as applying join_episode_data, join_onspd_data,
+    join_header_data, join_uasc_data, join_oc2_data, join_missing_data and
+    join_cans_data in turn, including the rows repeated when a key matches more than once
+    """
+
+    def __init__(self, pnw_census: pd.DataFrame):
+        self._pnw_census = pnw_census
+        self._rows = np.arange(len(pnw_census))
+        self._tables = []
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def column(self, name: str) -> pd.Series:
+        """
+        Returns a census or joined column for the current rows
+        """
+        if name in self._pnw_census.columns:
+            return self._pnw_census[name].take(self._rows).reset_index(drop=True)
+        for table, indexer in reversed(self._tables):
+            if name in table.columns:
+                return table[name].reindex(indexer).reset_index(drop=True)
+        raise KeyError(name)
+
+    def _lookup(
+        self,
+        table: pd.DataFrame,
+        left_on: list[str],
+        right_on: list[str],
+        description: str,
+    ) -> np.ndarray:
+        """
+        Finds the table row matching each census row, or -1 if there is none
+        Census rows matching more than one table row are repeated once for each match,
+        in table order, as a left merge would
+        """
+        left_codes, right_codes = composite_key_codes(
+            [
+                [self.column(column) for column in left_on],
+                [table[column] for column in right_on],
+            ]
+        )
+        order = np.argsort(right_codes, kind="stable")
+        lo = np.searchsorted(right_codes[order], left_codes, side="left")
+        counts = np.searchsorted(right_codes[order], left_codes, side="right") - lo
+
+        repeats = np.maximum(counts, 1)
+        if len(repeats) and repeats.max() > 1:
+            log.error(
+                f"Join with {description} results in incorrect row count: {repeats.sum() - len(repeats)} additional rows."
+            )
+            self._rows = np.repeat(self._rows, repeats)
+            self._tables = [
+                (table, np.repeat(indexer, repeats)) for table, indexer in self._tables
+            ]
+            lo, counts = np.repeat(lo, repeats), np.repeat(counts, repeats)
+            lo += np.arange(len(lo)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+
+        indexer = np.full(len(lo), -1)
+        indexer[counts > 0] = order[lo[counts > 0]]
+        log.info(f"{np.count_nonzero(counts)} joins made from {description}")
+        return indexer
+
+    def join(
+        self,
+        table: pd.DataFrame,
+        left_on: list[str],
+        right_on: list[str],
+        columns: dict,
+        description: str,
+    ):
+        """
+        Left joins the given table columns onto the census, renamed according to columns
+        """
+        indexer = self._lookup(table, left_on, right_on, description)
+        table = table[list(columns)].rename(columns=columns).reset_index(drop=True)
+        self._tables.append((table, indexer))
+
+    def assign(self, columns: dict):
+        """
+        Adds columns of values for the current rows, or of a single value for every row
+        """
+        table = pd.DataFrame(columns, index=pd.RangeIndex(len(self)))
+        self._tables.append((table, np.arange(len(self))))
+
+    def join_episode_data(self, episodes: pd.DataFrame):
+        episodes_merged = episodes_open_on_snapshot(
+            episodes,
+            pd.DataFrame(
+                {
+                    "Identifier": self.column("Identifier"),
+                    "snapshot_date": self.column("snapshot_date"),
+                }
+            ),
+        )
+        self.join(
+            episodes_merged,
+            left_on=["Identifier", "snapshot_date"],
+            right_on=["CHILD", "snapshot_date"],
+            columns={
+                "PLACE": "903 placement type",
+                "PLACE_PROVIDER": "903 provider type",
+                "HOME_POST": "Home postcode",
+                "PL_POST": "Placement postcode",
+                "# placements in last 12 months": "# placements in last 12 months",
+            },
+            description="903 episodes file",
+        )
+
+    def join_onspd_data(self, postcode: pd.DataFrame):
+        postcode = format_postcode_sectors(postcode)
+        self.join(
+            postcode,
+            left_on=["Home postcode"],
+            right_on=["pcd2"],
+            columns={"oseast1m": "Home eastings", "osnrth1m": "Home northings"},
+            description="ONSPD on home postcode",
+        )
+        self.join(
+            postcode,
+            left_on=["Placement postcode"],
+            right_on=["pcd2"],
+            columns={
+                "oseast1m": "Placement eastings",
+                "osnrth1m": "Placement northings",
+                "oslaua": "Placement LA code",
+            },
+            description="ONSPD on placement postcode",
+        )
+
+    def join_header_data(self, header: pd.DataFrame):
+        self.join(
+            header,
+            left_on=["Identifier"],
+            right_on=["CHILD"],
+            columns={"SEX": "Gender 903", "ETHNIC": "Ethnicity 903"},
+            description="903 header file",
+        )
+
+    def join_uasc_data(self, uasc: pd.DataFrame):
+        indexer = self._lookup(uasc, ["Identifier"], ["CHILD"], "903 uasc file")
+        duc = uasc["DUC"].reset_index(drop=True).reindex(indexer)
+        duc.index = pd.RangeIndex(len(self))
+
+        # Create new column for when snapshot date is less than or equal to DUC
+        self.assign({"UASC 903": np.where(self.column("snapshot_date") <= duc, 1, 0)})
+
+    def join_oc2_data(self, oc2: pd.DataFrame):
+        oc2_merged = oc2_in_snapshot_year(
+            oc2,
+            pd.DataFrame(
+                {
+                    "Identifier": self.column("Identifier"),
+                    "snapshot_date": self.column("snapshot_date"),
+                }
+            ),
+        )
+        self.join(
+            oc2_merged,
+            left_on=["Identifier"],
+            right_on=["CHILD"],
+            columns={
+                "CONVICTED": "Child convicted during the year",
+                "SUBSTANCE_MISUSE": "Child identified as having a substance misuse problem",
+                "INTERVENTION_RECEIVED": "Child received intervention for substance misuse problem",
+                "INTERVENTION_OFFERED": "Child offered intervention for substance misuse problem",
+            },
+            description="903 oc2 file",
+        )
+
+    def join_missing_data(self, missing: pd.DataFrame):
+        missing_merged = missing_in_last_12m(
+            missing,
+            pd.DataFrame(
+                {
+                    "Identifier": self.column("Identifier"),
+                    "snapshot_date": self.column("snapshot_date"),
+                }
+            ),
+        ).reset_index()
+        self.join(
+            missing_merged,
+            left_on=["Identifier"],
+            right_on=["CHILD"],
+            columns={
+                "# missing episodes in last 12 months": "# missing episodes in last 12 months"
+            },
+            description="903 missing file",
+        )
+
+    def join_cans_data(self, cans: pd.DataFrame, cans_columns: list):
+        wide_cans = latest_cans_assessments(cans, self._pnw_census, cans_columns)
+        self.join(
+            wide_cans,
+            left_on=["Identifier"],
+            right_on=["Child Unique ID"],
+            columns={column: column for column in wide_cans.columns[1:]},
+            description="CANS on Identifier",
+        )
+
+    def add_missing_cans_columns(self, cans_columns: list):
+        """
+        Adds any of the 4 CANS assessment columns for each variable that are missing as blank
+        """
+        columns = set(self._pnw_census.columns).union(
+            *(table.columns for table, _ in self._tables)
+        )
+        self.assign(
+            {
+                f"{var} {i}": pd.NA
+                for i in range(1, 5)
+                for var in cans_columns
+                if f"{var} {i}" not in columns
+            }
+        )
+
+    def result(self) -> pd.DataFrame:
+        """
+        Assembles the census rows and every joined column into one dataframe
+        """
+        return pd.concat(
+            [self._pnw_census.take(self._rows).reset_index(drop=True)]
+            + [
+                table.reindex(indexer).reset_index(drop=True)
+                for table, indexer in self._tables
+            ],
+            axis=1,
+        )
@@ -4,6 +4,105 @@ from dagster import get_dagster_logger
 
 log = get_dagster_logger(__name__)
 
+# End date used for intervals that are still open
+_OPEN = np.iinfo(np.int64).max
+_NAT = np.iinfo(np.int64).min
+
+
+def _to_ns(values) -> np.ndarray:
+    """
+    Converts dates to int64 nanoseconds, with NaT as the minimum int64
+    """
+    dates = pd.to_datetime(pd.Series(values), errors="coerce")
+    return dates.dt.as_unit("ns").to_numpy(dtype="int64", na_value=_NAT)
+
+
+def _bisect(
+    values: np.ndarray, lo: np.ndarray, hi: np.ndarray, targets: np.ndarray, side: str
+) -> np.ndarray:
+    """
+    Vectorised binary search for each target within values[lo:hi], which must be sorted
+    Returns the insertion points as np.searchsorted would with the given side
+    """
+    lo, hi = lo.copy(), hi.copy()
+    active = np.flatnonzero(lo < hi)
+    while len(active):
+        mid = (lo[active] + hi[active]) // 2
+        if side == "left":
+            right = values[mid] < targets[active]
+        else:
+            right = values[mid] <= targets[active]
+        lo[active[right]] = mid[right] + 1
+        hi[active[~right]] = mid[~right]
+        active = active[lo[active] < hi[active]]
+    return lo
+
+
+class IntervalLookup:
+    """
+    Date intervals, such as 903 episodes, sorted by child and start date once so that
+    the intervals overlapping a window can be found for each child by binary search,
+    rather than by merging every interval onto every row for that child
+
+    Intervals without a start date never overlap, intervals without an end date are open
+    """
+
+    def __init__(self, children: pd.Series, start: pd.Series, end: pd.Series):
+        start = _to_ns(start)
+        end = _to_ns(end)
+        end[end == _NAT] = _OPEN
+        codes, self._children = pd.factorize(pd.Series(children), use_na_sentinel=False)
+
+        positions = np.flatnonzero(start != _NAT)
+        order = np.lexsort((start[positions], codes[positions]))
+        self._positions = positions[order]
+        self._codes = codes[self._positions]
+        self._start = start[self._positions]
+        self._end = end[self._positions]
+        # Latest end so far for each child, intervals before the first one reaching
+        # the window start cannot overlap it
+        self._max_end = (
+            pd.Series(self._end).groupby(self._codes).cummax().to_numpy(dtype="int64")
+        )
+
+    def overlapping(
+        self,
+        children: pd.Series,
+        window_start: pd.Series,
+        window_end: pd.Series,
+        include_end: bool = True,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the intervals for each child which start on or before window_end (strictly
+        before if not include_end) and end on or after window_start or are still open
+        Returns the positions of the queries and of the intervals for each overlap, in
+        interval order then query order, as an inner merge on child would
+        """
+        query_codes, query_children = pd.factorize(
+            pd.Series(children), use_na_sentinel=False
+        )
+        codes = self._children.get_indexer(query_children)[query_codes]
+        window_start = _to_ns(window_start)
+        window_end = _to_ns(window_end)
+        codes[(window_start == _NAT) | (window_end == _NAT)] = -1
+
+        lo = np.searchsorted(self._codes, codes, side="left")
+        hi = np.searchsorted(self._codes, codes, side="right")
+        hi[codes < 0] = lo[codes < 0]
+        first = _bisect(self._max_end, lo, hi, window_start, "left")
+        side = "right" if include_end else "left"
+        last = _bisect(self._start, lo, hi, window_end, side)
+
+        counts = np.maximum(last - first, 0)
+        query = np.repeat(np.arange(len(codes)), counts)
+        offsets = np.repeat(first - np.cumsum(counts) + counts, counts)
+        candidate = np.arange(counts.sum()) + offsets
+
+        match = self._end[candidate] >= window_start[query]
+        query, positions = query[match], self._positions[candidate[match]]
+        order = np.lexsort((query, positions))
+        return query[order], positions[order]
+
 
 def _filter_to_open_in_last_12m(
     df: pd.DataFrame, episode_start: str, snapshot_date: str, episode_end: str
@@ -56,47 +155,63 @@ def _filter_to_open_on_snapshot_date(
     return filtered_df
 
 
-def join_episode_data(episodes: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.DataFrame:
+def episodes_open_on_snapshot(
+    episodes: pd.DataFrame, pnw_census: pd.DataFrame
+) -> pd.DataFrame:
     """
-    Merges data from 903 episodes dataframe onto pnw census dataframe
-    Returns pnw census dataframe
+    Finds the 903 episodes open on the snapshot date of each pnw census row, with the
+    number of placements in the 12 months before it
+    Returns one row per episode and snapshot date, keyed by CHILD and snapshot_date
     """
-    # Join pnw_census onto episodes, keeping only children in episodes with a match in pnw
-    episodes_merged = episodes.merge(
-        pnw_census[["Identifier", "snapshot_date"]],
-        left_on="CHILD",
-        right_on="Identifier",
-        how="inner",
+    intervals = IntervalLookup(episodes["CHILD"], episodes["DECOM"], episodes["DEC"])
+    snapshot_date = pd.to_datetime(pnw_census["snapshot_date"], errors="coerce")
+
+    # Count episodes open within 12 months before the snapshot date, per child and
+    # snapshot date as in _filter_to_open_in_last_12m
+    query, _ = intervals.overlapping(
+        pnw_census["Identifier"],
+        snapshot_date - pd.DateOffset(months=12),
+        snapshot_date,
+    )
+    placements = (
+        pd.Series(np.bincount(query, minlength=len(pnw_census)))
+        .groupby(
+            [
+                pd.factorize(pnw_census["Identifier"], use_na_sentinel=False)[0],
+                snapshot_date.to_numpy(),
+            ],
+            dropna=False,
+        )
+        .transform("sum")
+        .to_numpy()
     )
 
-    # Filter to episodes open within 12 months before the snapshot date
-    episodes_merged = _filter_to_open_in_last_12m(
-        episodes_merged, "DECOM", "snapshot_date", "DEC"
+    # Only keep episodes open on day of snapshot, as in _filter_to_open_on_snapshot_date
+    query, rows = intervals.overlapping(
+        pnw_census["Identifier"], snapshot_date, snapshot_date, include_end=False
+    )
+    episodes_merged = episodes.iloc[rows][
+        ["CHILD", "PLACE", "PLACE_PROVIDER", "HOME_POST", "PL_POST"]
+    ].assign(
+        **{
+            "# placements in last 12 months": placements[query],
+            "snapshot_date": snapshot_date.to_numpy()[query],
+        }
     )
 
-    # Count episodes per child
-    episodes_merged["# placements in last 12 months"] = episodes_merged.groupby(
-        ["CHILD", "snapshot_date"]
-    )["CHILD"].transform("count")
+    return episodes_merged
 
-    # Filter to only keep episodes open on day of snapshot
-    episodes_merged = _filter_to_open_on_snapshot_date(
-        episodes_merged, "DEC", "snapshot_date", "DECOM"
-    )
+
+def join_episode_data(episodes: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merges data from 903 episodes dataframe onto pnw census dataframe
+    Returns pnw census dataframe
+    """
+    episodes_merged = episodes_open_on_snapshot(episodes, pnw_census)
 
     # Merge back with pnw_census
     pnw_census_merged = pnw_census.merge(
-        episodes_merged[
-            [
-                "CHILD",
-                "PLACE",
-                "PLACE_PROVIDER",
-                "HOME_POST",
-                "PL_POST",
-                "# placements in last 12 months",
-                "snapshot_date",
-            ]
-        ],
+        episodes_merged,
         left_on=["Identifier", "snapshot_date"],
         right_on=["CHILD", "snapshot_date"],
         how="left",
@@ -192,34 +307,41 @@ def join_uasc_data(uasc: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.DataFrame
     return pnw_census_merged
 
 
-def join_oc2_data(oc2: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.DataFrame:
+def oc2_in_snapshot_year(oc2: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.DataFrame:
     """
-    Merges data from 903 OC2 dataframe onto pnw census dataframe
-    Returns pnw census dataframe
+    Finds the 903 OC2 entry from the same FY as the snapshot date for each child in the
+    pnw census, keeping the most complete entry if there are several
     """
-    # Join pnw_census onto OC2, keeping only children in episodes with a OC2 in PNW
-    oc2_merged = oc2.merge(
-        pnw_census[["Identifier", "snapshot_date"]],
-        left_on="CHILD",
-        right_on="Identifier",
-        how="inner",
+    # Find OC2 entries from the same FY as the snapshot date, for children in PNW
+    start = pd.to_datetime((oc2["YEAR"] - 1).astype(str) + "-04-01")
+    end = pd.to_datetime((oc2["YEAR"]).astype(str) + "-03-31")
+    query, rows = IntervalLookup(oc2["CHILD"], start, end).overlapping(
+        pnw_census["Identifier"],
+        pnw_census["snapshot_date"],
+        pnw_census["snapshot_date"],
     )
-
-    # Filter to OC2 entries from the same FY as the snapshot date
-    oc2_merged["start"] = pd.to_datetime(
-        (oc2_merged["YEAR"] - 1).astype(str) + "-04-01"
+    oc2_merged = oc2.iloc[rows].assign(
+        Identifier=pnw_census["Identifier"].to_numpy()[query],
+        snapshot_date=pnw_census["snapshot_date"].to_numpy()[query],
+        start=start.to_numpy()[rows],
+        end=end.to_numpy()[rows],
     )
-    oc2_merged["end"] = pd.to_datetime((oc2_merged["YEAR"]).astype(str) + "-03-31")
-    oc2_merged = oc2_merged[
-        (oc2_merged["start"] <= oc2_merged["snapshot_date"])
-        & (oc2_merged["end"] >= oc2_merged["snapshot_date"])
-    ]
 
     # Ensure only one result per child, keeping entries with the most complete data if multiple
     oc2_merged["non_blank_count"] = oc2_merged.notna().sum(axis=1)
     oc2_merged = oc2_merged.sort_values(by="non_blank_count", ascending=False)
     oc2_merged = oc2_merged.drop_duplicates("Identifier", keep="first")
 
+    return oc2_merged
+
+
+def join_oc2_data(oc2: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merges data from 903 OC2 dataframe onto pnw census dataframe
+    Returns pnw census dataframe
+    """
+    oc2_merged = oc2_in_snapshot_year(oc2, pnw_census)
+
     # Merge back with pnw_census
     pnw_census_merged = pnw_census.merge(
         oc2_merged[
@@ -262,23 +384,25 @@ def join_oc2_data(oc2: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.DataFrame:
     return pnw_census_merged
 
 
-def join_missing_data(missing: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.DataFrame:
+def missing_in_last_12m(
+    missing: pd.DataFrame, pnw_census: pd.DataFrame
+) -> pd.DataFrame:
     """
-    Merges data from 903 missing dataframe onto pnw census dataframe
-    Returns pnw census dataframe
+    Counts the 903 missing episodes open within 12 months before the snapshot dates of
+    each child in the pnw census
+    Returns the counts indexed by CHILD
     """
-    # Join pnw_census onto missing, keeping only children in episodes with a match in pnw
-    missing_merged = missing.merge(
-        pnw_census[["Identifier", "snapshot_date"]],
-        left_on="CHILD",
-        right_on="Identifier",
-        how="inner",
-    )
-
-    # Filter to episodes open within 12 months before the snapshot date
-    missing_merged = _filter_to_open_in_last_12m(
-        missing_merged, "MIS_START", "snapshot_date", "MIS_END"
+    # Find episodes open within 12 months before the snapshot date, as in
+    # _filter_to_open_in_last_12m, for children in pnw
+    snapshot_date = pd.to_datetime(pnw_census["snapshot_date"], errors="coerce")
+    _, rows = IntervalLookup(
+        missing["CHILD"], missing["MIS_START"], missing["MIS_END"]
+    ).overlapping(
+        pnw_census["Identifier"],
+        snapshot_date - pd.DateOffset(months=12),
+        snapshot_date,
     )
+    missing_merged = missing.iloc[rows]
 
     # Count episodes per child
     missing_merged = (
@@ -287,6 +411,16 @@ def join_missing_data(missing: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.Dat
         .to_frame(name="# missing episodes in last 12 months")
     )
 
+    return missing_merged
+
+
+def join_missing_data(missing: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merges data from 903 missing dataframe onto pnw census dataframe
+    Returns pnw census dataframe
+    """
+    missing_merged = missing_in_last_12m(missing, pnw_census)
+
     # Merge back with pnw_census
     pnw_census_merged = pnw_census.merge(
         missing_merged, left_on="Identifier", right_index=True, how="left"
@@ -307,15 +441,22 @@ def join_missing_data(missing: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.Dat
     return pnw_census_merged
 
 
+def format_postcode_sectors(postcode: pd.DataFrame) -> pd.DataFrame:
+    """
+    Formats the ONSPD postcode column to:
+    - have only one space between first and second halves
+    - remove trailing and leading spaces
+    """
+    postcode["pcd2"] = postcode["pcd2"].str.replace(r"\s+", " ", regex=True).str.strip()
+    return postcode
+
+
 def join_onspd_data(postcode: pd.DataFrame, pnw_census: pd.DataFrame) -> pd.DataFrame:
     """
     Merges data from ONSPD dataframe onto pnw census dataframe
     Returns pnw census dataframe
     """
-    # Format postcode column to:
-    # - have only one space between first and second halves
-    # - remove trailing and leading spaces
-    postcode["pcd2"] = postcode["pcd2"].str.replace(r"\s+", " ", regex=True).str.strip()
+    postcode = format_postcode_sectors(postcode)
 
     # Merge postcode table on pnw_census using home postcode
     pnw_census_merged = pnw_census.merge(
@@ -389,14 +530,13 @@ def add_missing_cans_columns(data: pd.DataFrame, cans_columns: list) -> pd.DataF
     return data
 
 
-def join_cans_data(
+def latest_cans_assessments(
     cans: pd.DataFrame, pnw_census: pd.DataFrame, cans_columns: list
 ) -> pd.DataFrame:
     """
-    Merges data from CANS dataframe onto PNW census dataframe
-    Returns PNW census dataframe
+    Pivots the 4 most recent CANS assessments up to the last snapshot date to one row per
+    child, keyed by Child Unique ID
     """
-
     # Make sure dates are datetime
     cans["Assessment Date"] = pd.to_datetime(cans["Assessment Date"])
 
@@ -433,6 +573,18 @@ def join_cans_data(
     ]
     wide_cans = wide_cans[cols_order]
 
+    return wide_cans
+
+
+def join_cans_data(
+    cans: pd.DataFrame, pnw_census: pd.DataFrame, cans_columns: list
+) -> pd.DataFrame:
+    """
+    Merges data from CANS dataframe onto PNW census dataframe
+    Returns PNW census dataframe
+    """
+    wide_cans = latest_cans_assessments(cans, pnw_census, cans_columns)
+
     # Merge with pnw_census
     pnw_census_merged = pnw_census.merge(
         wide_cans, left_on="Identifier", right_on="Child Unique ID", how="left"
@@ -1,5 +1,63 @@
+from typing import List
+
+import numpy as np
 import pandas as pd
 
+from liiatools.common.data import DataContainer
+from liiatools.common.keys import composite_key_codes
+
+# Integer surrogate for the identifier, NativeId, Year, Term, LA and Acad/LA key shared by the School Census tables
+CENSUS_KEY = "census_key"
+
+# Version of create_onroll_intermediates, which is part of the key of the cached intermediates shared by the CROSS and
+# REGION outputs. Increase it when the intermediates change so they are rebuilt
+INTERMEDIATES_VERSION = 1
+
+
+def key_columns(identifier: str) -> List[str]:
+    """
+    Returns the columns which together identify a pupil record across the School Census tables
+    """
+    return [identifier, "NativeId", "Year", "Term", "LA", "Acad/LA"]
+
+
+def add_census_key(
+    tables: List[pd.DataFrame | None], identifier: str
+) -> List[pd.DataFrame | None]:
+    """
+    Adds the CENSUS_KEY column to each of the School Census tables, factorising the six key columns once across
+    all of them so that the tables can be joined on a single int64 column
+
+    :param tables: A list of dataframes sharing the key columns, where any of them may be None
+    :type tables: List[pd.DataFrame | None]
+    :param identifier: A string corresponding to the name of the primary key to the pupil table
+    :type identifier: string
+    :return: The tables with the CENSUS_KEY column added, with None left in place
+    :rtype: List[pd.DataFrame | None]
+    """
+    present = [table for table in tables if table is not None]
+    codes = iter(
+        composite_key_codes(
+            [[table[column] for column in key_columns(identifier)] for table in present]
+        )
+    )
+    return [
+        None if table is None else table.assign(**{CENSUS_KEY: next(codes)})
+        for table in tables
+    ]
+
+
+def _with_census_key(
+    tables: List[pd.DataFrame | None], identifier: str
+) -> tuple[List[pd.DataFrame | None], bool]:
+    """
+    Returns the tables keyed with CENSUS_KEY, along with whether the key has been added here and so should be dropped
+    from the output
+    """
+    if all(table is None or CENSUS_KEY in table.columns for table in tables):
+        return tables, False
+    return add_census_key(tables, identifier), True
+
 
 def create_demographics_output(
     pupil: pd.DataFrame,
@@ -23,41 +81,38 @@ def create_demographics_output(
     :type sen: pd.DataFrame | None
     :return: A dataframe for the demographics output for the School Census
     :rtype: DataFrame
+
+    The tables are joined on CENSUS_KEY, which is added here unless every table already has it. In that case the key
+    is kept in the output so that it can be joined to the sessions and exclusions tables.
     """
+    (pupil, addresses, fsm, sen), drop_key = _with_census_key(
+        [pupil, addresses, fsm, sen], identifier
+    )
+    keys = key_columns(identifier)
+
     # Join addresses to pupil
-    pupil = pupil.copy().merge(
-        right=addresses.copy(),
-        on=[identifier, "NativeId", "Year", "Term", "LA", "Acad/LA"],
+    pupil = pupil.merge(
+        right=addresses.drop(columns=keys),
+        on=CENSUS_KEY,
         how="left",
     )
 
     # Join fsm (if it exists) after filtering to only open periods
     if fsm is not None:
-        fsm = fsm[fsm["fsmenddate"].isna()].copy()
+        fsm = fsm[fsm["fsmenddate"].isna()]
         pupil = pupil.merge(
-            right=fsm,
-            on=[identifier, "NativeId", "Year", "Term", "LA", "Acad/LA"],
+            right=fsm.drop(columns=keys),
+            on=CENSUS_KEY,
             how="left",
         )
 
     # Join sen if it exists
     if sen is not None:
-        sen = sen[sen["sentyperank"].isin([1, 2])].copy()
-        sen = sen[
-            [
-                identifier,
-                "NativeId",
-                "Year",
-                "Term",
-                "LA",
-                "Acad/LA",
-                "sentyperank",
-                "sentype",
-            ]
-        ]
+        sen = sen[sen["sentyperank"].isin([1, 2])]
+        sen = sen[[CENSUS_KEY, "sentyperank", "sentype"]]
         sen = (
             sen.pivot(
-                index=[identifier, "NativeId", "Year", "Term", "LA", "Acad/LA"],
+                index=CENSUS_KEY,
                 columns="sentyperank",
                 values="sentype",
             )
@@ -67,13 +122,43 @@ def create_demographics_output(
 
         pupil = pupil.merge(
             right=sen,
-            on=[identifier, "NativeId", "Year", "Term", "LA", "Acad/LA"],
+            on=CENSUS_KEY,
             how="left",
         )
 
+    if drop_key:
+        pupil = pupil.drop(columns=CENSUS_KEY)
+
     return pupil
 
 
+def pivot_sessions(sessions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pivots a sessions table keyed with CENSUS_KEY to one row per key, with a column of sessions for each attendance
+    reason
+
+    :param sessions: A dataframe corresponding to one of the session details tables, with the CENSUS_KEY column
+    :type sessions: pd.DataFrame
+    :return: The attendance values for each CENSUS_KEY
+    :rtype: DataFrame
+    """
+    sessions = sessions.pivot(
+        index=CENSUS_KEY,
+        columns="attendancereason",
+        values="sessions",
+    )
+    # The columns are not named so that the table is the same when it is read back from parquet
+    return (
+        sessions.rename(
+            columns=lambda x: "attendancereason BLANK"
+            if pd.isna(x) or x == ""
+            else f"attendancereason {x}"
+        )
+        .rename_axis(columns=None)
+        .reset_index()
+    )
+
+
 def create_sessions_output(
     pupil: pd.DataFrame,
     identifier: str,
@@ -91,26 +176,111 @@ def create_sessions_output(
     :type sessions: pd.DataFrame
     :return: a sessions output with pupil details and pivoted attendance values
     :rtype: DataFrame
-    """
 
-    # Pivot sessions table
-    sessions = sessions.copy()
-    sessions = sessions.pivot(
-        index=[identifier, "NativeId", "Year", "Term", "LA", "Acad/LA"],
-        columns="attendancereason",
-        values="sessions",
-    )
-    sessions = sessions.rename(
-        columns=lambda x: "attendancereason BLANK"
-        if pd.isna(x) or x == ""
-        else f"attendancereason {x}"
-    ).reset_index()
+    As with create_demographics_output, the tables are joined on CENSUS_KEY, which is only kept in the output if both
+    tables already have it.
+    """
+    (pupil, sessions), drop_key = _with_census_key([pupil, sessions], identifier)
 
-    # Join to pupil table
+    # Join pivoted sessions to pupil table
     pupil = pupil.merge(
-        right=sessions,
-        on=[identifier, "NativeId", "Year", "Term", "LA", "Acad/LA"],
+        right=pivot_sessions(sessions),
+        on=CENSUS_KEY,
         how="left",
     )
 
+    if drop_key:
+        pupil = pupil.drop(columns=CENSUS_KEY)
+
     return pupil
+
+
+def create_onroll_intermediates(
+    pupil: pd.DataFrame,
+    addresses: pd.DataFrame,
+    fsm: pd.DataFrame,
+    sen: pd.DataFrame | None,
+    termly_sessions: pd.DataFrame,
+    summer_sessions: pd.DataFrame | None,
+    exclusions: pd.DataFrame,
+) -> DataContainer:
+    """
+    Makes the on roll tables shared by the CROSS and REGION outputs, all keyed with CENSUS_KEY
+
+    :param pupil: A dataframe corresponding to the pupilonroll table from the School Census
+    :type pupil: pd.DataFrame
+    :param addresses: A dataframe corresponding to either addresses, addressesonroll or a concatenation of both tables
+    :type addresses: pd.DataFrame
+    :param fsm: A dataframe corresponding to either fsmperiod, fsmperiodsonroll or a concatenation of both tables
+    :type fsm: pd.DataFrame
+    :param sen: A dataframe corresponding to the senneeds table, which is only present in spring
+    :type sen: pd.DataFrame | None
+    :param termly_sessions: A dataframe corresponding to the termlysessiondetailsonroll table
+    :type termly_sessions: pd.DataFrame
+    :param summer_sessions: A dataframe corresponding to the summerhalfterm2sessiondetailsonroll table, if present
+    :type summer_sessions: pd.DataFrame | None
+    :param exclusions: A dataframe corresponding to the termlyexclusionsonroll table
+    :type exclusions: pd.DataFrame
+    :return: The pupil, demographics, termly_sessions, summer_sessions (if present) and exclusions tables
+    :rtype: DataContainer
+
+    The demographics table has a blank child_home_GIAS column after the address columns, which add_child_home_gias
+    fills in for the CROSS outputs, and the sessions tables are pivoted with pivot_sessions.
+    """
+    (
+        pupil,
+        addresses,
+        fsm,
+        sen,
+        termly_sessions,
+        summer_sessions,
+        exclusions,
+    ) = add_census_key(
+        [pupil, addresses, fsm, sen, termly_sessions, summer_sessions, exclusions],
+        "pupilonrolltableid",
+    )
+
+    intermediates = DataContainer()
+    intermediates["pupil"] = pupil
+    intermediates["demographics"] = create_demographics_output(
+        pupil,
+        "pupilonrolltableid",
+        addresses.assign(child_home_GIAS=np.nan),
+        fsm,
+        sen,
+    )
+    intermediates["termly_sessions"] = pivot_sessions(termly_sessions)
+    if summer_sessions is not None:
+        intermediates["summer_sessions"] = pivot_sessions(summer_sessions)
+    intermediates["exclusions"] = exclusions
+
+    return intermediates
+
+
+def add_child_home_gias(
+    demographics: pd.DataFrame, gias_lookup: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Fills in the child_home_GIAS column of the on roll demographics with the GIAS code of the LA of each child's home
+    address
+
+    :param demographics: The demographics table from create_onroll_intermediates
+    :type demographics: pd.DataFrame
+    :param gias_lookup: A dataframe of the GIAS code for each ctyua25cd
+    :type gias_lookup: pd.DataFrame
+    :return: The demographics table with child_home_GIAS filled in
+    :rtype: DataFrame
+
+    Children whose home LA has no GIAS code are left blank, and those whose home LA has more than one are repeated
+    for each, as when the lookup is joined to the addresses table.
+    """
+    columns = demographics.columns
+    demographics = demographics.drop(columns="child_home_GIAS").merge(
+        right=gias_lookup[["GIAS code", "ctyua25cd"]].rename(
+            columns={"GIAS code": "child_home_GIAS"}
+        ),
+        left_on="child_home_la",
+        right_on="ctyua25cd",
+        how="left",
+    )
+    return demographics[columns]
@@ -1,4 +1,5 @@
 from datetime import date, datetime, timedelta
+from typing import Tuple
 
 import numpy as np
 import pandas as pd
@@ -13,6 +14,32 @@ __DATES = [
 ]
 
 
+def _to_datetime(dates: pd.Series) -> pd.Series:
+    """
+    Convert a column of dates, which may hold datetime.date values and nulls, to a datetime64 column
+    """
+    return pd.to_datetime(dates.astype(object).where(dates.notna(), None))
+
+
+def _to_date(dates: pd.Series) -> pd.Series:
+    """
+    Convert a datetime64 column back to datetime.date values
+    """
+    return pd.Series(dates.dt.date.to_numpy(dtype=object), index=dates.index)
+
+
+def _end_of_year(years: pd.Series, mask: pd.Series) -> pd.Series:
+    """
+    The 31st March at the end of each collection year, only worked out for the masked rows
+    """
+    end_of_year = pd.Series(pd.NaT, index=years.index, dtype="datetime64[ns]")
+    if mask.any():
+        end_of_year[mask] = pd.to_datetime(
+            pd.DataFrame({"year": years[mask], "month": 3, "day": 31})
+        )
+    return end_of_year
+
+
 def create_previous_and_next_episode(
     dataframe: pd.DataFrame, columns: list
 ) -> pd.DataFrame:
@@ -52,15 +79,22 @@ def format_datetime(dataframe: pd.DataFrame, date_columns: list) -> pd.DataFrame
     return dataframe
 
 
-def add_latest_year_and_source_for_la(dataframe: pd.DataFrame) -> pd.DataFrame:
+def add_latest_year_and_source_for_la(
+    dataframe: pd.DataFrame, latest_years: pd.Series = None
+) -> pd.DataFrame:
     """
     Add column to containing latest submission year and source for each LA
 
     :param dataframe: Dataframe with SSDA903 Episodes data
+    :param latest_years: Optional latest submission year indexed by LA, for when the dataframe only holds some of
+        the LA's episodes
     :return: Dataframe with column showing latest submission year for each LA and column showing episode source
     """
     source_for_episode_row = "Original"
-    dataframe["YEAR_latest"] = dataframe.groupby("LA")["YEAR"].transform("max")
+    if latest_years is None:
+        dataframe["YEAR_latest"] = dataframe.groupby("LA")["YEAR"].transform("max")
+    else:
+        dataframe["YEAR_latest"] = dataframe["LA"].map(latest_years)
     dataframe["Episode_source"] = source_for_episode_row
     return dataframe
 
@@ -196,7 +230,22 @@ def identify_stage1_rule_to_apply(dataframe: pd.DataFrame) -> pd.DataFrame:
     :param dataframe: Dataframe with SSDA903 Episodes data
     :return: Dataframe with column showing stage 1 rule to be applied
     """
-    dataframe["Rule_to_apply"] = dataframe.apply(_stage1_rule_to_apply, axis=1)
+    open_episode = dataframe["Has_open_episode_error"].astype(bool)
+    dataframe["Rule_to_apply"] = np.select(
+        [
+            open_episode
+            & (
+                dataframe["Next_episode_is_duplicate"]
+                | dataframe["Previous_episode_is_duplicate"]
+            ),
+            open_episode & dataframe["Previous_episode_submitted_later"],
+            open_episode & ~dataframe["Has_next_episode"].astype(bool),
+            open_episode & dataframe["Has_next_episode_with_RNE_equals_S"],
+            open_episode,
+        ],
+        ["RULE_3", "RULE_3A", "RULE_2", "RULE_1A", "RULE_1"],
+        default=None,
+    )
     return dataframe
 
 
@@ -278,12 +327,32 @@ def apply_stage1_rules(dataframe: pd.DataFrame) -> pd.DataFrame:
     dataframe = dataframe.drop(dataframe[episodes_to_delete].index)
 
     # Apply rules 1, 1A, 2
-    dataframe["DEC"] = dataframe.apply(_update_dec_stage1, axis=1)
-    dataframe["REC"] = dataframe.apply(_update_rec_stage1, axis=1)
-    dataframe["REASON_PLACE_CHANGE"] = dataframe.apply(
-        _update_reason_place_change_stage1, axis=1
+    open_episode = dataframe["Has_open_episode_error"].astype(bool)
+    rule = dataframe["Rule_to_apply"]
+    rule_1 = open_episode & (rule == "RULE_1")
+    rule_1a = open_episode & (rule == "RULE_1A")
+    rule_2 = open_episode & (rule == "RULE_2")
+
+    end_of_year = _end_of_year(dataframe["YEAR"], rule_1a | rule_2)
+    day_before_next_decom = _to_datetime(dataframe["DECOM_next"]) - timedelta(days=1)
+
+    dec = dataframe["DEC"].astype(object)
+    dec[rule_1] = dataframe.loc[rule_1, "DECOM_next"]
+    dec[rule_1a] = _to_date(
+        np.minimum(end_of_year[rule_1a], day_before_next_decom[rule_1a])
+    )
+    dec[rule_2] = _to_date(end_of_year[rule_2])
+    dataframe["DEC"] = dec
+
+    dataframe["REC"] = np.select(
+        [rule_1, rule_1a | rule_2], ["X1", "E99"], default=dataframe["REC"]
+    )
+    dataframe["REASON_PLACE_CHANGE"] = dataframe["REASON_PLACE_CHANGE"].mask(
+        rule_1 & dataframe["RNE_next"].isin(["P", "B", "T", "U"]), "LIIAF"
+    )
+    dataframe["Episode_source"] = dataframe["Episode_source"].mask(
+        open_episode, dataframe["Rule_to_apply"]
     )
-    dataframe["Episode_source"] = dataframe.apply(_update_episode_source_stage1, axis=1)
 
     return dataframe
 
@@ -343,9 +412,17 @@ def add_stage2_rule_identifier_columns(dataframe: pd.DataFrame) -> pd.DataFrame:
     :return: Dataframe with columns showing true if certain conditions are met
     """
     dataframe["Has_next_episode"] = dataframe["DECOM_next"].notnull()
-    dataframe["Overlaps_next_episode"] = dataframe.apply(_overlaps_next_episode, axis=1)
-    dataframe["Has_X1_gap_before_next_episode"] = dataframe.apply(
-        _has_x1_gap_before_next_episode, axis=1
+
+    dec = _to_datetime(dataframe["DEC"])
+    decom_next = _to_datetime(dataframe["DECOM_next"])
+    next_submitted_later = (
+        dataframe["Has_next_episode"]
+        & dec.notna()
+        & (dataframe["YEAR"] < pd.to_numeric(dataframe["YEAR_next"]))
+    )
+    dataframe["Overlaps_next_episode"] = next_submitted_later & (dec > decom_next)
+    dataframe["Has_X1_gap_before_next_episode"] = (
+        next_submitted_later & (dec < decom_next) & (dataframe["REC"] == "X1")
     )
     return dataframe
 
@@ -359,8 +436,23 @@ def identify_stage2_rule_to_apply(dataframe: pd.DataFrame) -> pd.DataFrame:
     :param dataframe: Dataframe with SSDA903 Episodes data
     :return: Dataframe with column showing stage 2 rule to be applied
     """
-    dataframe["Rule_to_apply"] = dataframe.apply(_stage2_rule_to_apply, axis=1)
-    dataframe["Episode_source"] = dataframe.apply(_update_episode_source_stage2, axis=1)
+    dataframe["Rule_to_apply"] = np.select(
+        [
+            dataframe["Overlaps_next_episode"],
+            dataframe["Has_X1_gap_before_next_episode"],
+        ],
+        ["RULE_4", "RULE_5"],
+        default=None,
+    )
+
+    rule = dataframe["Rule_to_apply"].astype(object)
+    source = dataframe["Episode_source"].astype(object)
+    applied = rule.notna()
+    dataframe["Episode_source"] = np.select(
+        [applied & (source == "Original"), applied],
+        [rule, source + " | " + rule],
+        default=source,
+    )
     return dataframe
 
 
@@ -374,22 +466,29 @@ def apply_stage2_rules(dataframe: pd.DataFrame) -> pd.DataFrame:
     :return: Dataframe with stage 2 rules applied
     """
     # Apply rules 4, 5
-    dataframe["DEC"] = dataframe.apply(_update_dec_stage2, axis=1)
+    dataframe["DEC"] = dataframe["DEC"].astype(object).mask(
+        dataframe["Rule_to_apply"].isin(["RULE_4", "RULE_5"]), dataframe["DECOM_next"]
+    )
     return dataframe
 
 
-def stage_1(ssda903_df: pd.DataFrame, transform_cols: list) -> pd.DataFrame:
+def stage_1(
+    ssda903_df: pd.DataFrame, transform_cols: list, latest_years: pd.Series = None
+) -> pd.DataFrame:
     """
     Accept an ssda903 episodes dataframe and apply the stage 1 rules
 
     :param ssda903_df: Dataframe with SSDA903 Episodes data
+    :param latest_years: Optional latest submission year indexed by LA, see add_latest_year_and_source_for_la
     :return: Dataframe with stage 1 rules identified and applied
     """
     # Add columns to dataframe to identify which rules should be applied at stage 1
     ssda903_df = ssda903_df.sort_values(["CHILD", "DECOM"], ignore_index=True)
     ssda903_df_stage1 = create_previous_and_next_episode(ssda903_df, transform_cols)
     ssda903_df_stage1 = format_datetime(ssda903_df_stage1, __DATES)
-    ssda903_df_stage1 = add_latest_year_and_source_for_la(ssda903_df_stage1)
+    ssda903_df_stage1 = add_latest_year_and_source_for_la(
+        ssda903_df_stage1, latest_years
+    )
     ssda903_df_stage1 = add_stage1_rule_identifier_columns(ssda903_df_stage1)
     ssda903_df_stage1 = identify_stage1_rule_to_apply(ssda903_df_stage1)
 
@@ -419,3 +518,81 @@ def stage_2(ssda903_df: pd.DataFrame, columns_to_keep: list, transform_cols: lis
         ["CHILD", "DECOM"], ignore_index=True
     )
     return ssda903_df_final
+
+
+def child_episode_hashes(ssda903_df: pd.DataFrame) -> pd.Series:
+    """
+    Create a content hash of the episodes of each child
+
+    The hash covers every column of the child's episodes, in the order they appear, along with the latest
+    submission year of the LA, as the stage 1 rules depend on it. A child with the same hash will be fixed in
+    the same way.
+
+    :param ssda903_df: Dataframe with SSDA903 Episodes data
+    :return: Series of uint64 hashes indexed by CHILD
+    """
+    episodes = ssda903_df.assign(
+        YEAR_latest=ssda903_df.groupby("LA")["YEAR"].transform("max")
+    )
+    row_hashes = pd.util.hash_pandas_object(episodes, index=False)
+    positions = episodes.groupby("CHILD", sort=False).cumcount()
+    # Hashing the position with each row makes the sum depend on the order of the episodes
+    episode_hashes = pd.util.hash_pandas_object(
+        pd.DataFrame({"row": row_hashes, "position": positions}), index=False
+    )
+    return episode_hashes.groupby(episodes["CHILD"]).sum()
+
+
+def fix_episodes_incrementally(
+    ssda903_df: pd.DataFrame,
+    columns_to_keep: list,
+    transform_cols: list,
+    previous_episodes: pd.DataFrame = None,
+    previous_hashes: pd.Series = None,
+) -> Tuple[pd.DataFrame, pd.Series, pd.Index]:
+    """
+    Apply the stage 1 and 2 rules, only to the children whose episodes have changed since they were last fixed
+
+    The rules only look at episodes of the same child, and at the latest submission year of the LA which is part
+    of each child's hash. The fixed episodes of unchanged children are taken from the previous output and the
+    rest are fixed and spliced in, giving the same result as applying stage_1 and stage_2 to the whole dataframe.
+
+    :param ssda903_df: Dataframe with SSDA903 Episodes data
+    :param columns_to_keep: Columns of the fixed episodes
+    :param transform_cols: Columns to find previous and next episode values for
+    :param previous_episodes: Fixed episodes from the previous run
+    :param previous_hashes: Child hashes from the previous run, from child_episode_hashes
+    :return: Fixed episodes, child hashes to store with them and the children that were fixed
+    """
+    hashes = child_episode_hashes(ssda903_df)
+
+    if (
+        previous_episodes is None
+        or previous_hashes is None
+        or list(previous_episodes.columns) != list(columns_to_keep)
+    ):
+        unchanged = hashes.index[:0]
+    else:
+        unchanged = hashes.index[hashes.eq(previous_hashes.reindex(hashes.index))]
+
+    changed_episodes = ssda903_df[~ssda903_df["CHILD"].isin(unchanged)]
+    changed = pd.Index(changed_episodes["CHILD"].unique())
+    if len(unchanged) == 0:
+        fixed = stage_2(
+            stage_1(ssda903_df, transform_cols), columns_to_keep, transform_cols
+        )
+        return fixed, hashes, changed
+
+    latest_years = ssda903_df.groupby("LA")["YEAR"].max()
+    fixed = [previous_episodes[previous_episodes["CHILD"].isin(unchanged)]]
+    if len(changed_episodes) > 0:
+        fixed.append(
+            stage_2(
+                stage_1(changed_episodes, transform_cols, latest_years),
+                columns_to_keep,
+                transform_cols,
+            )
+        )
+    fixed = pd.concat(fixed, ignore_index=True)[columns_to_keep]
+    fixed = fixed.sort_values(["CHILD", "DECOM"], ignore_index=True)
+    return fixed, hashes, changed
@@ -1,14 +1,26 @@
-from typing import Union, Tuple
+from functools import lru_cache
+from typing import Dict, List, Union, Tuple
+import hashlib
 import logging
 import pandas as pd
 import numpy as np
+from pandas.api.extensions import take
 from fs.base import FS
 import fs.errors as errors
 
 from liiatools.common.pipeline import open_file
+from liiatools.common.reference import authorities
 
 # ALL of the code from here to the creation of factOfstedInspection should be ported to the external data pipeline
 
+# Version of ons_transform, postcode_transform, ofsted_transform and ss903_transform, which is part of the key of
+# their cached and incremental outputs. Increase it when one of them changes so the outputs are rebuilt
+EXTERNAL_DATA_VERSION = 1
+
+# The surrogate keys of an LA's rows in the partitioned LookedAfterChild and factEpisode tables start at the LA code
+# multiplied by this, so they are unique across LAs and stay the same while the LA's data is unchanged
+LA_KEY_OFFSET = 10**8
+
 # Dataset schema for dimension tables
 dim_tables = {
     "dimCategoryOfNeed": {
@@ -517,81 +529,144 @@ def dict_to_dfs() -> dict:
     return dim_dfs
 
 
+class KeyLookup:
+    """
+    A code to key lookup compiled from the code and key columns of a dimension table.
+
+    Looking codes up gives the same keys as a left merge with the dimension table. Where a code appears in more
+    than one row, the looked up row is repeated once for each match as a merge would.
+    """
+
+    def __init__(self, codes: pd.Series, keys: pd.Series):
+        self.codes = pd.Index(codes)
+        self.keys = keys.to_numpy()
+        self.counts = None
+        if not self.codes.is_unique:
+            self.counts = self.codes.value_counts(dropna=False)
+
+    def indexer(self, values: pd.Index) -> Tuple[np.ndarray, np.ndarray | None]:
+        """
+        Find the position of the matching key for each of a set of unique values, or -1 if there is no match.
+
+        If codes are repeated, the positions of all the matches for each value are returned one after the other,
+        along with the number of positions for each value.
+        """
+        if self.counts is None:
+            return self.codes.get_indexer(values), None
+
+        positions, _ = self.codes.get_indexer_non_unique(values)
+        repeats = self.counts.reindex(values).fillna(1).to_numpy(dtype=np.intp)
+        return positions, repeats
+
+
+@lru_cache
+def dim_key_lookup(table_name: str) -> KeyLookup:
+    """Compiles the code to key lookup for one of the static dimension tables"""
+    table = dim_tables[table_name]
+    name = table_name.removeprefix("dim")
+    return KeyLookup(pd.Series(table[f"{name}Code"]), pd.Series(table[f"{name}Key"]))
+
+
+def assign_keys(
+    df: pd.DataFrame, lookups: List[Tuple[str, str, KeyLookup]]
+) -> pd.DataFrame:
+    """
+    Adds a key column for each (code column, key column, lookup), giving the same rows and keys as a chain of
+    left merges without copying the dataframe for each one.
+
+    Each code column is factorised so that only its distinct values are looked up, and the keys are then taken
+    for every row using the integer codes.
+    """
+    rows = np.arange(len(df))
+    keys = {}
+    for code_column, key_column, lookup in lookups:
+        codes, uniques = pd.factorize(df[code_column], use_na_sentinel=False)
+        codes = codes[rows]
+        positions, repeats = lookup.indexer(uniques)
+        if repeats is None:
+            indexer = positions[codes]
+        else:
+            # Repeat each row once for each match and take the matches of its value in turn
+            starts = (np.cumsum(repeats) - repeats)[codes]
+            row_repeats = repeats[codes]
+            row_starts = np.cumsum(row_repeats) - row_repeats
+            within = np.arange(row_repeats.sum()) - np.repeat(row_starts, row_repeats)
+            indexer = positions[np.repeat(starts, row_repeats) + within]
+            rows = np.repeat(rows, row_repeats)
+            keys = {
+                column: np.repeat(values, row_repeats)
+                for column, values in keys.items()
+            }
+        keys[key_column] = take(lookup.keys, indexer, allow_fill=True)
+
+    df = df.take(rows).reset_index(drop=True)
+    return df.assign(**keys)
+
+
 def ons_transform(df: pd.DataFrame) -> pd.DataFrame:
     """Performs steps to transform ONSArea table"""
     # Rename columns and drop unnecessary columns
     df = rename_and_drop(df, "ONSArea")
 
     # Create AreaType, AreaCode and AreaName fields to allow a single primary key to access all area types
-    # For wards
-    ward_df = df.copy()
-    ward_df["AreaType"] = "Ward"
-    ward_df["AreaCode"] = ward_df["WardCode"]
-    ward_df["AreaName"] = ward_df["WardName"]
-
-    # For LAs
-    la_df = df.copy()[
-        [
+    # Each area type only needs its own columns and those of the areas above it. These are deduplicated before
+    # they are joined together, so only the distinct LAs, counties, regions and countries are copied. Keys are
+    # given in the order each area first appears, with wards first, then LAs, counties, regions and countries
+    levels = [
+        ("Ward", "WardCode", "WardName", list(df.columns)),
+        (
+            "LA",
             "LACode",
             "LAName",
+            [
+                "LACode",
+                "LAName",
+                "CountyCode",
+                "CountyName",
+                "RegionCode",
+                "RegionName",
+                "CountryCode",
+                "CountryName",
+            ],
+        ),
+        (
+            "County",
             "CountyCode",
             "CountyName",
+            [
+                "CountyCode",
+                "CountyName",
+                "RegionCode",
+                "RegionName",
+                "CountryCode",
+                "CountryName",
+            ],
+        ),
+        (
+            "Region",
             "RegionCode",
             "RegionName",
-            "CountryCode",
-            "CountryName",
-        ]
+            ["RegionCode", "RegionName", "CountryCode", "CountryName"],
+        ),
+        ("Country", "CountryCode", "CountryName", ["CountryCode", "CountryName"]),
     ]
-    mask_la = la_df["LACode"].notna()
-    la_df.loc[mask_la, "AreaType"] = "LA"
-    la_df.loc[mask_la, "AreaCode"] = la_df["LACode"]
-    la_df.loc[mask_la, "AreaName"] = la_df["LAName"]
 
-    # For counties
-    county_df = df.copy()[
-        [
-            "CountyCode",
-            "CountyName",
-            "RegionCode",
-            "RegionName",
-            "CountryCode",
-            "CountryName",
-        ]
-    ]
-    mask_county = county_df["CountyCode"].notna()
-    county_df.loc[mask_county, "AreaType"] = "County"
-    county_df.loc[mask_county, "AreaCode"] = county_df["CountyCode"]
-    county_df.loc[mask_county, "AreaName"] = county_df["CountyName"]
-
-    # For regions
-    region_df = df.copy()[
-        [
-            "RegionCode",
-            "RegionName",
-            "CountryCode",
-            "CountryName",
-        ]
-    ]
-    mask_region = region_df["RegionCode"].notna()
-    region_df.loc[mask_region, "AreaType"] = "Region"
-    region_df.loc[mask_region, "AreaCode"] = region_df["RegionCode"]
-    region_df.loc[mask_region, "AreaName"] = region_df["RegionName"]
-
-    # For countries
-    country_df = df.copy()[
-        [
-            "CountryCode",
-            "CountryName",
-        ]
-    ]
-    mask_country = country_df["CountryCode"].notna()
-    country_df.loc[mask_country, "AreaType"] = "Country"
-    country_df.loc[mask_country, "AreaCode"] = country_df["CountryCode"]
-    country_df.loc[mask_country, "AreaName"] = country_df["CountryName"]
+    level_dfs = []
+    for area_type, code_column, name_column, columns in levels:
+        level_df = df[columns].drop_duplicates()
+        # Every ward is kept, other areas are only kept when they have a code
+        if area_type != "Ward":
+            level_df = level_df[level_df[code_column].notna()]
+        level_dfs.append(
+            level_df.assign(
+                AreaType=area_type,
+                AreaCode=level_df[code_column],
+                AreaName=level_df[name_column],
+            )
+        )
 
-    # Joining together into a single file and dropping duplicates and rows with no AreaType defined
-    expanded_df = pd.concat([ward_df, la_df, county_df, region_df, country_df]).drop_duplicates()
-    expanded_df.dropna(subset="AreaType", inplace=True)
+    # Joining together into a single file
+    expanded_df = pd.concat(level_dfs)
 
     # Reset indexes and use main index as primary key
     expanded_df.reset_index(drop=True, inplace=True)
@@ -909,108 +984,54 @@ def ss903_transform(
 
     # Create factEpisode table
     # Add bespoke columns
-    # Add LookedAfterChildKey by merge with LookedAfterChild table
-    lac_copy = LookedAfterChild.copy()
-    lac_copy = lac_copy[["LookedAfterChildKey", "ChildIdentifier"]]
-    Episode = Episode.merge(
-        lac_copy, left_on="CHILD", right_on="ChildIdentifier", how="left"
-    )
-
-    # Add ReasonForNewEpisodeKey
-    reason_for_new_episode = pd.DataFrame(dim_tables["dimReasonForNewEpisode"])
-    reason_for_new_episode = reason_for_new_episode[
-        ["ReasonForNewEpisodeKey", "ReasonForNewEpisodeCode"]
-    ]
-    Episode = Episode.merge(
-        reason_for_new_episode,
-        left_on="RNE",
-        right_on="ReasonForNewEpisodeCode",
-        how="left",
-    )
-
-    # Add LegalStatusKey
-    legalstatuskey = pd.DataFrame(dim_tables["dimLegalStatus"])
-    legalstatuskey = legalstatuskey[["LegalStatusKey", "LegalStatusCode"]]
-    Episode = Episode.merge(
-        legalstatuskey, left_on="LS", right_on="LegalStatusCode", how="left"
-    )
-
-    # Add CategoryOfNeedKey
-    category_of_need = pd.DataFrame(dim_tables["dimCategoryOfNeed"])
-    category_of_need = category_of_need[["CategoryOfNeedKey", "CategoryOfNeedCode"]]
-    Episode = Episode.merge(
-        category_of_need, left_on="CIN", right_on="CategoryOfNeedCode", how="left"
-    )
-
-    # Add PlacementTypeKey
-    placement_type = pd.DataFrame(dim_tables["dimPlacementType"])
-    placement_type = placement_type[["PlacementTypeKey", "PlacementTypeCode"]]
-    Episode = Episode.merge(
-        placement_type, left_on="PLACE", right_on="PlacementTypeCode", how="left"
-    )
-
-    # Add PlacementProviderKey
-    placement_provider = pd.DataFrame(dim_tables["dimPlacementProvider"])
-    placement_provider = placement_provider[
-        ["PlacementProviderKey", "PlacementProviderCode"]
-    ]
-    Episode = Episode.merge(
-        placement_provider,
-        left_on="PLACE_PROVIDER",
-        right_on="PlacementProviderCode",
-        how="left",
-    )
-
-    # Add ReasonEpisodeCeasedKey
-    reason_episode_ceased = pd.DataFrame(dim_tables["dimReasonEpisodeCeased"])
-    reason_episode_ceased = reason_episode_ceased[
-        ["ReasonEpisodeCeasedKey", "ReasonEpisodeCeasedCode"]
-    ]
-    Episode = Episode.merge(
-        reason_episode_ceased,
-        left_on="REC",
-        right_on="ReasonEpisodeCeasedCode",
-        how="left",
-    )
-
-    # Add ReasonPlaceChangeKey
-    reason_place_change = pd.DataFrame(dim_tables["dimReasonPlaceChange"])
-    reason_place_change = reason_place_change[
-        ["ReasonPlaceChangeKey", "ReasonPlaceChangeCode"]
-    ]
-    Episode = Episode.merge(
-        reason_place_change,
-        left_on="REASON_PLACE_CHANGE",
-        right_on="ReasonPlaceChangeCode",
-        how="left",
-    )
-
-    # Add HomePostcodeKey
-    pc_copy = Postcode.copy()[["PostcodeKey", "Sector"]]
-    Episode = Episode.merge(
-        pc_copy, left_on="HOME_POST", right_on="Sector", how="left"
+    # Add the key columns by looking up each code column in its dimension table
+    Episode = Episode.assign(URN=Episode.URN.astype(str))
+    postcode_keys = KeyLookup(Postcode["Sector"], Postcode["PostcodeKey"])
+    Episode = assign_keys(
+        Episode,
+        [
+            (
+                "CHILD",
+                "LookedAfterChildKey",
+                KeyLookup(
+                    LookedAfterChild["ChildIdentifier"],
+                    LookedAfterChild["LookedAfterChildKey"],
+                ),
+            ),
+            ("RNE", "ReasonForNewEpisodeKey", dim_key_lookup("dimReasonForNewEpisode")),
+            ("LS", "LegalStatusKey", dim_key_lookup("dimLegalStatus")),
+            ("CIN", "CategoryOfNeedKey", dim_key_lookup("dimCategoryOfNeed")),
+            ("PLACE", "PlacementTypeKey", dim_key_lookup("dimPlacementType")),
+            (
+                "PLACE_PROVIDER",
+                "PlacementProviderKey",
+                dim_key_lookup("dimPlacementProvider"),
+            ),
+            ("REC", "ReasonEpisodeCeasedKey", dim_key_lookup("dimReasonEpisodeCeased")),
+            (
+                "REASON_PLACE_CHANGE",
+                "ReasonPlaceChangeKey",
+                dim_key_lookup("dimReasonPlaceChange"),
+            ),
+            ("HOME_POST", "HomePostcodeKey", postcode_keys),
+            ("PL_POST", "PlacementPostcodeKey", postcode_keys),
+            (
+                "URN",
+                "OfstedProviderKey",
+                KeyLookup(
+                    OfstedProvider["URN"].astype(str),
+                    OfstedProvider["OfstedProviderKey"],
+                ),
+            ),
+            ("LA", "ONSAreaKey", KeyLookup(ONSArea["AreaName"], ONSArea["ONSAreaKey"])),
+        ],
     )
-    Episode = Episode.rename(columns={"PostcodeKey": "HomePostcodeKey"})
-
-    # Add PlacementPostcodeKey
-    Episode = Episode.merge(pc_copy, left_on="PL_POST", right_on="Sector", how="left")
-    Episode = Episode.rename(columns={"PostcodeKey": "PlacementPostcodeKey"})
-
-    # Add OfstedProviderKey
-    op_copy = OfstedProvider.copy()[["OfstedProviderKey", "URN"]]
-    op_copy.URN = op_copy.URN.astype(str)
-    Episode.URN = Episode.URN.astype(str)
-    Episode = Episode.merge(op_copy, left_on="URN", right_on="URN", how="left")
     # Where no match with OfstedProvider, give a value of -3 to differentiate from missing URNs
     Episode.loc[
         (Episode["URN"].notna()) & (Episode["OfstedProviderKey"].isna()),
         "OfstedProviderKey",
     ] = -3
 
-    # Add ONSAreaKey
-    ons_copy = ONSArea.copy()[["ONSAreaKey", "AreaName"]]
-    Episode = Episode.merge(ons_copy, left_on="LA", right_on="AreaName", how="left")
-
     # Rename columns and drop unnecessary columns
     Episode = rename_and_drop(Episode, "Episode")
 
@@ -1024,6 +1045,77 @@ def ss903_transform(
     return LookedAfterChild, Episode
 
 
+def la_partition(la: str) -> str:
+    """
+    The partition for an LA in the partitioned LookedAfterChild and factEpisode tables, which is the LA code. Rows
+    for LAs that are not in the list of authorities are kept together in an 'unknown' partition
+    """
+    if la in authorities.names:
+        return authorities.get_by_name(la)
+    if la in authorities.codes:
+        return la
+    return "unknown"
+
+
+def split_by_la(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Splits a dataframe with an LA column into its LA partitions"""
+    partitions = {la: la_partition(la) for la in df["LA"].dropna().unique()}
+    partition_column = df["LA"].map(partitions).fillna("unknown")
+    return {
+        partition: partition_df
+        for partition, partition_df in df.groupby(partition_column, sort=True)
+    }
+
+
+def partition_hash(tables: List[pd.DataFrame], *inputs) -> str:
+    """
+    A SHA-256 of the rows of the input tables for a partition, along with any other inputs, such as the keys of the
+    external tables the partition is joined to
+    """
+    digest = hashlib.sha256(repr(inputs).encode("utf-8"))
+    for table in tables:
+        digest.update(repr(list(table.columns)).encode("utf-8"))
+        digest.update(pd.util.hash_pandas_object(table, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def ss903_transform_partition(
+    partition: str,
+    header: pd.DataFrame,
+    uasc: pd.DataFrame,
+    ONSArea: pd.DataFrame,
+    Episode: pd.DataFrame,
+    Postcode: pd.DataFrame,
+    OfstedProvider: pd.DataFrame,
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Runs ss903_transform for the ssda903 files of one LA partition and:
+    - offsets the LookedAfterChildKey and FactEpisodeKey by the LA code, so they are stable and unique across LAs
+    - returns the row for unmatched LookedAfterChildKeys separately, as it is shared by all of the partitions"""
+    LookedAfterChild, Episode = ss903_transform(
+        header, uasc, ONSArea, Episode, Postcode, OfstedProvider
+    )
+
+    # All keys have been filled, so they are stored as integers in every partition
+    for df_name, df in [("LookedAfterChild", LookedAfterChild), ("Episode", Episode)]:
+        types = column_names[df_name]["type_map"]
+        key_columns = [col for col, col_type in types.items() if col_type == "key"]
+        df[key_columns] = df[key_columns].astype("int64")
+
+    offset = int(partition) * LA_KEY_OFFSET if partition.isdigit() else 0
+
+    unmatched = LookedAfterChild["LookedAfterChildKey"] == -1
+    unmatched_row = LookedAfterChild[unmatched].reset_index(drop=True)
+    LookedAfterChild = LookedAfterChild[~unmatched].reset_index(drop=True)
+    LookedAfterChild["LookedAfterChildKey"] += offset
+
+    Episode["LookedAfterChildKey"] = Episode["LookedAfterChildKey"].mask(
+        Episode["LookedAfterChildKey"] != -1, Episode["LookedAfterChildKey"] + offset
+    )
+    Episode["FactEpisodeKey"] += offset
+
+    return LookedAfterChild, Episode, unmatched_row
+
+
 def rename_and_drop(df: pd.DataFrame, key: str) -> pd.DataFrame:
     """Takes a pandas DataFrame and:
     - renames columns based on dictionary
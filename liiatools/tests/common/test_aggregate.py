@@ -0,0 +1,137 @@
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from fs import open_fs
+from fs.wrapfs import WrapFS
+
+from liiatools.common.aggregate import DataframeAggregator, RetentionFilter
+from liiatools.common.data import ColumnConfig, PipelineConfig, TableConfig
+
+
+class LatencyFS(WrapFS):
+    """
+    Wraps a filesystem and sleeps on every open to simulate the request latency of a remote filesystem.
+
+    Records the highest number of files open at the same time. If a barrier is set, every open also waits at it,
+    so reads only complete when as many files as the barrier has parties are open at once.
+    """
+
+    def __init__(self, wrap_fs, latency: float):
+        super().__init__(wrap_fs)
+        self.latency = latency
+        self.barrier = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._counter_lock = threading.Lock()
+
+    def open(self, path, mode="r", *args, **kwargs):
+        with self._counter_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.barrier is not None:
+                self.barrier.wait()
+            time.sleep(self.latency)
+            return super().open(path, mode, *args, **kwargs)
+        finally:
+            with self._counter_lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture
+def cfg():
+    return PipelineConfig(
+        sensor_trigger={"move_current_org_sensor": True},
+        retention_columns={"year_column": "Year", "la_column": "LA"},
+        retention_period={"PAN": 12},
+        degrade_at_clean={"PAN": True},
+        reports_to_shared={"PAN": True},
+        la_signed={"BAR": "Yes"},
+        table_list=[
+            TableConfig(
+                id="table1",
+                columns=[
+                    ColumnConfig(id="id", type="integer", unique_key=True),
+                    ColumnConfig(id="LA", type="string"),
+                ],
+            ),
+        ],
+    )
+
+
+@pytest.fixture
+def latency_fs():
+    mem_fs = open_fs("mem://")
+    for ix, la_code in enumerate(["BAR", "BEX", "BRE", "CAM", "CAS", "EAL"]):
+        df = pd.DataFrame({"id": [ix * 10, ix * 10 + 1], "LA": la_code})
+        with mem_fs.open(f"{la_code}_ssda903_table1.csv", "w") as f:
+            df.to_csv(f, index=False)
+    return LatencyFS(mem_fs, latency=0.05)
+
+
+def test_combine_files_order(latency_fs, cfg):
+    sequential = DataframeAggregator(latency_fs, cfg, "ssda903", max_workers=1)
+    concurrent = DataframeAggregator(latency_fs, cfg, "ssda903", max_workers=4)
+
+    pd.testing.assert_frame_equal(
+        sequential.current()["table1"], concurrent.current()["table1"]
+    )
+    assert concurrent.current()["table1"]["LA"].unique().tolist() == [
+        "BAR",
+        "BEX",
+        "BRE",
+        "CAM",
+        "CAS",
+        "EAL",
+    ]
+
+
+def test_combine_files_concurrency(latency_fs, cfg):
+    sequential = DataframeAggregator(latency_fs, cfg, "ssda903", max_workers=1)
+    sequential.current()
+    assert latency_fs.max_in_flight == 1
+
+    # Each open waits until three files are open, so the six files can only be read if three workers read at
+    # once. A sequential read would break the barrier when it times out
+    latency_fs.barrier = threading.Barrier(3, timeout=10)
+    latency_fs.max_in_flight = 0
+    concurrent = DataframeAggregator(latency_fs, cfg, "ssda903", max_workers=3)
+    concurrent.current()
+    assert latency_fs.max_in_flight == 3
+
+
+def test_retention_filter(cfg):
+    mem_fs = open_fs("mem://")
+    for la_code, la_name in [("302", "Barnet"), ("303", "Bexley"), ("XXX", "Other")]:
+        df = pd.DataFrame({"id": [1, 2, 3], "LA": la_name, "Year": [2000, 2025, 2026]})
+        with mem_fs.open(f"{la_code}_ssda903_table1.csv", "w") as f:
+            df.to_csv(f, index=False)
+
+    cfg.table_list[0].columns.append(ColumnConfig(id="Year", type="integer"))
+    cfg.la_signed = {
+        "Barnet": {"PAN": "Yes", "SUFFICIENCY": "No"},
+        "Bexley": {"PAN": "No", "SUFFICIENCY": "No"},
+    }
+    cfg.retention_period = {"PAN": 2, "SUFFICIENCY": 10}
+
+    retention_filter = RetentionFilter.for_profiles(
+        cfg, ["PAN", "SUFFICIENCY"], year_column="Year", la_column="LA"
+    )
+    assert retention_filter.year_cutoff == datetime.now().year - 10
+    assert retention_filter.signed_las == {"Barnet"}
+
+    aggregator = DataframeAggregator(
+        mem_fs, cfg, "ssda903", max_workers=1, retention_filter=retention_filter
+    )
+
+    # Bexley is not signed so is skipped, the unknown LA is read but its rows are not signed either
+    assert aggregator.list_files() == [
+        "302_ssda903_table1.csv",
+        "XXX_ssda903_table1.csv",
+    ]
+    table = aggregator.current()["table1"]
+    assert table["LA"].tolist() == ["Barnet", "Barnet"]
+    assert table["Year"].tolist() == [2025, 2026]
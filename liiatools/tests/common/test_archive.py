@@ -2,8 +2,13 @@ import pandas as pd
 import pytest
 from fs import open_fs
 
-from liiatools.common.archive import DataframeArchive 
-from liiatools.common.data import ColumnConfig, PipelineConfig, TableConfig
+from liiatools.common.archive import DataframeArchive
+from liiatools.common.data import (
+    ColumnConfig,
+    DataContainer,
+    PipelineConfig,
+    TableConfig,
+)
 
 
 @pytest.fixture
@@ -96,3 +101,57 @@ def test_combine(archive: DataframeArchive):
 
     assert sorted(table_1.id.tolist()) == [4]
     assert sorted(table_1.name.tolist()) == sorted(["SNAFU"])
+
+
+def test_combine_concurrent(fs, cfg: PipelineConfig):
+    dataset = {
+        "table1": pd.DataFrame([{"id": 1, "name": "foo"}, {"id": 2, "name": "bar"}]),
+    }
+    archive = DataframeArchive(fs, cfg, "ssda903", max_workers=4)
+    for year in [2020, 2021, 2022]:
+        dataset["table1"]["name"] = f"name_{year}"
+        archive.add(dataset, "BAR", year, month=None, term=None, school_type=None, identifier=None)
+
+    sequential = DataframeArchive(fs, cfg, "ssda903", max_workers=1)
+    snap_ids = archive.list_snapshots()["BAR"]
+
+    pd.testing.assert_frame_equal(
+        archive.combine_snapshots(snap_ids, "N")["table1"],
+        sequential.combine_snapshots(snap_ids, "N")["table1"],
+    )
+    assert archive.combine_snapshots(snap_ids, "N")["table1"]["name"].tolist() == [
+        "name_2020",
+        "name_2020",
+        "name_2021",
+        "name_2021",
+        "name_2022",
+        "name_2022",
+    ]
+
+
+def test_deduplicate_errors(archive: DataframeArchive):
+    data = DataContainer(
+        {"table1": pd.DataFrame({"id": [1, 2, 1, 2], "name": ["a", "b", "c", "d"]})}
+    )
+    result = archive.deduplicate(data)
+
+    assert result.data["table1"]["id"].tolist() == [1, 2]
+    assert [e["row_number"] for e in result.errors] == [4, 5]
+    assert result.errors[0] == dict(
+        type="DuplicateRemoval",
+        message="Row 4 removed as it was a duplicate",
+        row_number=4,
+        table_name="table1",
+    )
+
+
+def test_deduplicate_errors_cin(fs, cfg: PipelineConfig):
+    archive = DataframeArchive(fs, cfg, "cin")
+    data = DataContainer({"table1": pd.DataFrame({"id": [1, 1, 1], "name": "a"})})
+    result = archive.deduplicate(data)
+
+    assert len(result.data["table1"]) == 1
+    assert [e["message"] for e in result.errors] == [
+        "Row removed as it was a duplicate"
+    ] * 2
+    assert "row_number" not in result.errors[0]
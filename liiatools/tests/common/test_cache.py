@@ -0,0 +1,179 @@
+from unittest import mock
+
+import pandas as pd
+import pytest
+from fs import open_fs
+
+from liiatools.common import cache as cache_module
+from liiatools.common.cache import ExternalDataCache, ProcessedFileCache
+from liiatools.common.data import (
+    ColumnConfig,
+    DataContainer,
+    ErrorContainer,
+    PipelineConfig,
+    TableConfig,
+)
+
+
+@pytest.fixture
+def cfg():
+    return PipelineConfig(
+        sensor_trigger={"move_current_org_sensor": True},
+        retention_columns={"year_column": "Year", "la_column": "LA"},
+        retention_period={"PAN": 12},
+        degrade_at_clean={"PAN": True},
+        reports_to_shared={"PAN": True},
+        la_signed={"BAR": "Yes"},
+        table_list=[
+            TableConfig(
+                id="table1",
+                columns=[
+                    ColumnConfig(id="id", type="integer", unique_key=True),
+                    ColumnConfig(id="name", type="string"),
+                ],
+            ),
+        ],
+    )
+
+
+@pytest.fixture
+def cache():
+    return ProcessedFileCache(open_fs("mem://"), "ssda903")
+
+
+def test_key(cfg):
+    metadata = dict(year=2022, la_code="BAR", schema="schema_2022")
+    key = ProcessedFileCache.key("sha-1", "schema_2022", cfg, metadata)
+
+    assert key == ProcessedFileCache.key("sha-1", "schema_2022", cfg, metadata)
+    assert key != ProcessedFileCache.key("sha-2", "schema_2022", cfg, metadata)
+    assert key != ProcessedFileCache.key("sha-1", "schema_2023", cfg, metadata)
+    assert key != ProcessedFileCache.key(
+        "sha-1", "schema_2022", cfg, dict(metadata, year=2023)
+    )
+
+    changed_cfg = cfg.model_copy(update={"retention_period": {"PAN": 7}})
+    assert key != ProcessedFileCache.key("sha-1", "schema_2022", changed_cfg, metadata)
+
+    # A refreshed external lookup or a change to the transforms gives a new key
+    lookup = {"postcode_la_lookup.parquet": "lookup-1"}
+    lookup_key = ProcessedFileCache.key("sha-1", "schema_2022", cfg, metadata, lookup)
+    assert lookup_key != key
+    assert lookup_key != ProcessedFileCache.key(
+        "sha-1",
+        "schema_2022",
+        cfg,
+        metadata,
+        {"postcode_la_lookup.parquet": "lookup-2"},
+    )
+    with mock.patch.object(cache_module, "TRANSFORM_VERSION", -1):
+        assert key != ProcessedFileCache.key("sha-1", "schema_2022", cfg, metadata)
+
+
+def test_get_missing(cache):
+    assert cache.get("unknown") is None
+
+
+def test_put_and_get(cache):
+    cleaned = DataContainer(
+        {"table1": pd.DataFrame([{"id": 1, "name": "foo"}, {"id": 2, "name": None}])}
+    )
+    enriched = DataContainer({"table1": cleaned["table1"].assign(LA="BAR")})
+    errors = ErrorContainer(
+        [dict(type="DuplicateRemoval", row_number=3, table_name="table1")]
+    )
+
+    cache.put("key", {"cleaned": cleaned, "enriched": enriched}, errors)
+    stages, cached_errors = cache.get("key")
+
+    assert sorted(stages) == ["cleaned", "enriched"]
+    pd.testing.assert_frame_equal(stages["cleaned"]["table1"], cleaned["table1"])
+    pd.testing.assert_frame_equal(stages["enriched"]["table1"], enriched["table1"])
+    assert cached_errors == errors
+
+
+def test_prune(cache):
+    for key in ["key1", "key2", "key3"]:
+        cache.put(key, {}, ErrorContainer())
+
+    assert cache.prune(["key2", "unknown"]) == 2
+    assert cache.get("key1") is None
+    assert cache.get("key2") is not None
+    assert cache.fs.listdir("ssda903") == ["key2"]
+    assert ProcessedFileCache(open_fs("mem://"), "cin").prune([]) == 0
+
+
+def test_incomplete_entry_ignored(cache):
+    cache.fs.makedirs("ssda903/key/cleaned")
+    assert cache.get("key") is None
+
+
+def test_external_data_key():
+    input_fs = open_fs("mem://")
+    input_fs.writetext("ons.csv", "a,b\n1,2\n")
+    input_fs.makedir("Ofsted")
+    input_fs.writetext("Ofsted/providers_23.csv", "URN\nSC1\n")
+
+    key = ExternalDataCache.key(input_fs, ["ons.csv", "Ofsted/providers_23.csv"], 1)
+    assert key == ExternalDataCache.key(
+        input_fs, ["Ofsted/providers_23.csv", "ons.csv"], 1
+    )
+    assert key != ExternalDataCache.key(
+        input_fs, ["ons.csv", "Ofsted/providers_23.csv"], 2
+    )
+
+    input_fs.writetext("Ofsted/providers_23.csv", "URN\nSC2\n")
+    assert key != ExternalDataCache.key(
+        input_fs, ["ons.csv", "Ofsted/providers_23.csv"], 1
+    )
+
+
+def test_external_data_put_and_get():
+    cache = ExternalDataCache(open_fs("mem://"), "Ofsted")
+    data = DataContainer(
+        {
+            "dimOfstedProvider": pd.DataFrame(
+                {"URN": ["SC1", "Missing"], "Key": [0, -1]}
+            ),
+            "factOfstedInspection": pd.DataFrame({"Key": [0], "IsLatest": [True]}),
+        }
+    )
+
+    assert cache.get("key1") is None
+    cache.put("key1", data)
+    cached = cache.get("key1")
+    assert list(cached) == ["dimOfstedProvider", "factOfstedInspection"]
+    for table_name in data:
+        pd.testing.assert_frame_equal(cached[table_name], data[table_name])
+
+    # Only the latest entry is kept
+    cache.put("key2", data)
+    assert cache.get("key1") is None
+    assert cache.get("key2") is not None
+
+
+def test_external_data_unstorable_table():
+    cache = ExternalDataCache(open_fs("mem://"), "Ofsted")
+    data = DataContainer({"mixed": pd.DataFrame({"URN": [123, "SC1"]}, dtype=object)})
+
+    cache.put("key", data)
+    assert cache.get("key") is None
+
+
+def test_external_data_removed_while_writing():
+    cache = ExternalDataCache(open_fs("mem://"), "onroll")
+    data = DataContainer({"pupil": pd.DataFrame({"id": [1, 2]})})
+
+    # Another job sharing the cache replaces the entry while this one is writing it
+    export = DataContainer.export
+
+    def export_then_remove(self, fs, *args, **kwargs):
+        export(self, fs, *args, **kwargs)
+        cache.fs.removetree("onroll")
+
+    with mock.patch.object(DataContainer, "export", export_then_remove):
+        cache.put("key", data)
+    assert cache.get("key") is None
+
+    cache.put("key", data)
+    assert cache.get("key") is not None
@@ -1,3 +1,6 @@
+import tracemalloc
+
+import numpy as np
 import pandas as pd
 import pytest
 from fs import open_fs
@@ -56,45 +59,38 @@ def test_export_parquet(sample_data: DataContainer):
     assert fs.exists("test_table1.parquet")
 
 
-def test_export_csv_chunked_creates_multiple_files(tmp_path):
-    import pandas as pd
-    from liiatools.common.data.__container import DataContainer
-    from tablib import Dataset
-    from fs.memoryfs import MemoryFS
-
+def test_export_csv_chunked_creates_multiple_files():
     # Create a DataContainer with enough rows to force chunking
     df = pd.DataFrame({"a": range(100), "b": ["x" * 50] * 100})
     data = DataContainer({"bigtable": df})
-    dataset = data.to_dataset("bigtable")
-    fs = MemoryFS()
+    fs = open_fs("mem://")
 
     # Use a very small max_file_size_mb to force chunking
-    data._export_csv_chunked(fs, "chunked_", "bigtable", dataset, max_file_size_mb=0.001)
+    data.export(fs, "chunked_", "csv", max_file_size_mb=0.001)
 
     # Should create multiple part files
     files = list(fs.walk.files())
     part_files = [f for f in files if "part" in f]
     assert len(part_files) > 1
-    # All files should be non-empty
-    for f in part_files:
+    assert len(part_files) == len(files)
+    # All files should be non-empty and within the size limit
+    rows = []
+    for f in sorted(part_files, key=lambda f: int(f.split("_part")[1].split(".")[0])):
+        assert fs.getsize(f) <= 0.001 * 1024 * 1024
         with fs.open(f, "r") as file:
             content = file.read()
             assert content.strip() != ""
+        rows.append(pd.read_csv(fs.open(f, "r")))
+    pd.testing.assert_frame_equal(pd.concat(rows, ignore_index=True), df)
 
 
 def test_export_csv_chunked_creates_single_file_when_small():
-    import pandas as pd
-    from liiatools.common.data.__container import DataContainer
-    from tablib import Dataset
-    from fs.memoryfs import MemoryFS
-
     df = pd.DataFrame({"a": [1, 2], "b": ["foo", "bar"]})
     data = DataContainer({"smalltable": df})
-    dataset = data.to_dataset("smalltable")
-    fs = MemoryFS()
+    fs = open_fs("mem://")
 
     # Large enough chunk size to avoid splitting
-    data._export_csv_chunked(fs, "single_", "smalltable", dataset, max_file_size_mb=1)
+    data.export(fs, "single_", "csv", max_file_size_mb=1)
 
     files = list(fs.walk.files())
     assert len(files) == 1
@@ -103,3 +99,80 @@ def test_export_csv_chunked_creates_single_file_when_small():
         content = file.read()
         assert "a,b" in content
         assert "foo" in content
+
+
+def test_export_csv_nulls():
+    df = pd.DataFrame(
+        {
+            "name": ["Fernando", None, "nan"],
+            "count": pd.array([1, None, 3], dtype="Int64"),
+            "score": [1.5, None, 2.0],
+            "date": pd.to_datetime(["2022-01-01", None, "2022-05-03"]),
+        }
+    )
+    fs = open_fs("mem://")
+    DataContainer({"table": df}).export(fs, "test_", "csv")
+
+    assert fs.readbytes("test_table.csv").decode("utf-8") == (
+        "name,count,score,date\r\n"
+        "Fernando,1,1.5,2022-01-01 00:00:00\r\n"
+        ",,,\r\n"
+        "nan,3,2.0,2022-05-03 00:00:00\r\n"
+    )
+
+
+def test_export_csv_gzip():
+    df = pd.DataFrame({"a": range(100), "b": ["x" * 50] * 100})
+    fs = open_fs("mem://")
+    DataContainer({"table": df}).export(fs, "test_", "csv", compression="gzip")
+
+    assert fs.listdir("/") == ["test_table.csv.gz"]
+    with fs.openbin("test_table.csv.gz") as f:
+        pd.testing.assert_frame_equal(pd.read_csv(f, compression="gzip"), df)
+
+
+def test_copy_is_copy_on_write(sample_data: DataContainer):
+    copy = sample_data.copy()
+    assert np.shares_memory(
+        copy["table1"]["id"].to_numpy(), sample_data["table1"]["id"].to_numpy()
+    )
+
+    copy["table1"].loc[0, "id"] = 5
+    copy["table2"]["id"] = [7, 8]
+    assert sample_data["table1"]["id"].tolist() == [1, 2]
+    assert sample_data["table2"]["id"].tolist() == [1, 2]
+
+
+def test_deep_copy(sample_data: DataContainer):
+    copy = sample_data.copy(deep=True)
+    assert not np.shares_memory(
+        copy["table1"]["id"].to_numpy(), sample_data["table1"]["id"].to_numpy()
+    )
+
+
+def test_copy_and_export_memory():
+    rows = 50_000
+    data = DataContainer(
+        {
+            "table1": pd.DataFrame(
+                {"id": np.arange(rows), "value": np.linspace(0, 1, rows)}
+            )
+        }
+    )
+
+    def export_peak(deep):
+        fs = open_fs("mem://")
+        tracemalloc.start()
+        try:
+            data.copy(deep=deep).export(fs, "", "csv")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak, fs.readbytes("table1.csv")
+
+    shallow_peak, shallow_csv = export_peak(deep=False)
+    deep_peak, deep_csv = export_peak(deep=True)
+
+    assert shallow_csv == deep_csv
+    # The deep copy duplicates the 800 KB of table data before the export starts
+    assert deep_peak - shallow_peak > data["table1"].memory_usage().sum() / 2
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from liiatools.common.keys import composite_key_codes
+
+
+def test_composite_key_codes():
+    left = pd.DataFrame({"id": ["1", "2", "1", None], "year": [2024, 2024, 2025, 2024]})
+    right = pd.DataFrame({"id": ["1", None, "3"], "year": [2025.0, 2024.0, 2024.0]})
+
+    left_codes, right_codes = composite_key_codes(
+        [[left["id"], left["year"]], [right["id"], right["year"]]]
+    )
+
+    assert left_codes.dtype == np.int64
+    assert len(set(left_codes)) == 4
+    # Equal keys get equal codes across tables, including missing values
+    assert right_codes[0] == left_codes[2]
+    assert right_codes[1] == left_codes[3]
+    assert right_codes[2] not in left_codes
+
+
+def test_composite_key_codes_many_columns():
+    rng = np.random.default_rng(0)
+    # Enough distinct values in each column that the codes must be renumbered to fit in an int64
+    table = pd.DataFrame({i: rng.integers(0, 10**6, 500) for i in range(5)})
+    reversed_table = table.iloc[::-1].reset_index(drop=True)
+
+    codes, reversed_codes = composite_key_codes(
+        [
+            [table[i] for i in table.columns],
+            [reversed_table[i] for i in table.columns],
+        ]
+    )
+
+    assert (codes == reversed_codes[::-1]).all()
+    assert len(set(codes)) == len(table.drop_duplicates())
@@ -1,16 +1,26 @@
+import hashlib
 import unittest
+from collections import OrderedDict
 from unittest import mock
 
+import pytest
 from fs import open_fs
+from fs.errors import OperationFailed
+from fs.memoryfs import MemoryFS
 
+from liiatools.common import pipeline
 from liiatools.common.constants import SessionNames
 from liiatools.common.data import FileLocator
 from liiatools.common.pipeline import (
+    check_encoding,
+    copy_and_hash_file,
     create_session_folder,
     discover_la,
     discover_month,
     discover_year,
+    hash_file,
     move_files_for_processing,
+    open_file,
     restore_session_folder,
 )
 from liiatools.common.reference import LACodeLookup
@@ -55,6 +65,194 @@ def test_move_files_for_processing():
         assert FILE.read() == "foo"
 
 
+def test_move_files_for_processing_concurrent():
+    source_fs = open_fs("mem://")
+    source_fs.makedir("2019")
+    for ix in range(10):
+        source_fs.writetext(f"2019/file{ix}.txt", f"content {ix}")
+
+    session_fs = open_fs("mem://")
+    session_fs.makedir(SessionNames.INCOMING_FOLDER)
+    file_locators = move_files_for_processing(source_fs, session_fs, max_workers=4)
+
+    assert [f.meta["path"] for f in file_locators] == [
+        path for path in source_fs.walk.files()
+    ]
+    for file_locator in file_locators:
+        with file_locator.open("rt") as FILE:
+            assert FILE.read() == source_fs.readtext(file_locator.meta["path"])
+
+
+def test_copy_and_hash_file_streamed():
+    source_fs = open_fs("mem://")
+    source_fs.writebytes("file.bin", b"foo" * 1_000_000)
+    dest_fs = open_fs("mem://")
+
+    file_sha = copy_and_hash_file(source_fs, "file.bin", dest_fs, "copy.bin")
+
+    assert dest_fs.readbytes("copy.bin") == b"foo" * 1_000_000
+    assert file_sha == hashlib.sha256(b"foo" * 1_000_000).hexdigest()
+
+
+def test_copy_and_hash_file_server_side(tmp_path):
+    root_fs = open_fs(tmp_path.as_posix())
+    source_fs = root_fs.makedir("source")
+    dest_fs = root_fs.makedir("dest")
+    source_fs.writetext("file.txt", "foo")
+
+    file_sha = copy_and_hash_file(source_fs, "file.txt", dest_fs, "copy.txt")
+
+    assert dest_fs.readtext("copy.txt") == "foo"
+    assert (
+        file_sha == "2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae"
+    )
+
+
+def test_hash_file():
+    fs = open_fs("mem://")
+    fs.writebytes("file.bin", b"foo" * 1_000_000)
+
+    assert hash_file(fs, "file.bin") == (
+        hashlib.sha256(b"foo" * 1_000_000).hexdigest(),
+        3_000_000,
+    )
+
+
+class FakeS3FS(MemoryFS):
+    """
+    A stand-in for an S3 filesystem, where each instance is a separate view of a bucket in a shared store
+    """
+
+    buckets = {}
+
+    def __init__(self, bucket_name, endpoint_url="https://s3.example.com"):
+        super().__init__()
+        self._bucket_name = bucket_name
+        self.endpoint_url = endpoint_url
+        self.root = self.buckets.setdefault(bucket_name, self.root)
+        self.client = mock.Mock()
+        self.client.copy_object.side_effect = self._copy_object
+
+    def _path_to_key(self, path):
+        return path.lstrip("/")
+
+    def _copy_object(self, Bucket, Key, CopySource):
+        source = FakeS3FS(CopySource["Bucket"], self.endpoint_url)
+        with source.openbin(CopySource["Key"]) as src:
+            FakeS3FS(Bucket, self.endpoint_url).upload(Key, src)
+
+
+@pytest.mark.parametrize(
+    "dest_bucket, dest_endpoint, server_side",
+    [
+        ("input", "https://s3.example.com", True),
+        ("workspace", "https://s3.example.com", True),
+        ("workspace", "https://other.example.com", False),
+    ],
+)
+def test_copy_and_hash_file_s3(dest_bucket, dest_endpoint, server_side):
+    FakeS3FS.buckets.clear()
+    source_fs = FakeS3FS("input")
+    source_fs.writebytes("file.bin", b"foo")
+    dest_fs = FakeS3FS(dest_bucket, dest_endpoint)
+    assert dest_fs is not source_fs
+
+    file_sha = copy_and_hash_file(source_fs, "file.bin", dest_fs, "copy.bin")
+
+    assert dest_fs.client.copy_object.called == server_side
+    assert FakeS3FS(dest_bucket, dest_endpoint).readbytes("copy.bin") == b"foo"
+    assert file_sha == hashlib.sha256(b"foo").hexdigest()
+
+
+@pytest.mark.parametrize("server_side", [True, False])
+def test_copy_and_hash_file_hash_mismatch(tmp_path, server_side):
+    root_fs = open_fs(tmp_path.as_posix()) if server_side else open_fs("mem://")
+    source_fs = root_fs.makedir("source")
+    source_fs.writetext("file.txt", "foo")
+    dest_fs = root_fs.makedir("dest") if server_side else open_fs("mem://")
+    real_hash_file = pipeline.hash_file
+
+    def corrupt_copy(fs, path):
+        file_sha, size = real_hash_file(fs, path)
+        return ("0" * 64 if path == "copy.txt" else file_sha), size
+
+    with mock.patch.object(pipeline, "hash_file", side_effect=corrupt_copy):
+        with pytest.raises(OperationFailed, match="does not match the source"):
+            copy_and_hash_file(source_fs, "file.txt", dest_fs, "copy.txt")
+
+
+def test_check_encoding():
+    fs = open_fs("mem://")
+    fs.writebytes("utf8.csv", "name\nJosé\n".encode("utf-8"))
+    fs.writebytes("bom.csv", "name\nJosé\n".encode("utf-8-sig"))
+    fs.writebytes("utf16.csv", "name\nJosé\n".encode("utf-16"))
+    fs.writebytes("ascii.csv", b"name\nJoe\n")
+
+    assert check_encoding(fs, "utf8.csv") == "utf-8"
+    assert check_encoding(fs, "bom.csv") == "utf-8-sig"
+    assert check_encoding(fs, "utf16.csv") == "utf-16"
+    assert check_encoding(fs, "ascii.csv") == "utf-8"
+
+
+def test_open_file_encodings():
+    fs = open_fs("mem://")
+    fs.writebytes("bom.csv", "name,Unnamed: 1\nJosé,\n".encode("utf-8-sig"))
+    fs.writebytes("latin.csv", "name\nJosé Müller\n".encode("cp1252"))
+
+    df = open_file(fs, "bom.csv")
+    assert df.columns.tolist() == ["name"]
+    assert df["name"].tolist() == ["José"]
+
+    df = open_file(fs, "latin.csv")
+    assert df["name"].tolist() == ["José Müller"]
+
+
+def test_open_file_non_utf8_after_sample():
+    fs = open_fs("mem://")
+    rows = ["name"] + ["Joe"] * (pipeline.ENCODING_SAMPLE_SIZE // 4) + ["José"]
+    fs.writebytes("latin.csv", "\n".join(rows).encode("cp1252"))
+
+    df = open_file(fs, "latin.csv")
+    assert df["name"].iloc[-1] == "José"
+
+
+def test_encoding_cached_until_file_changes():
+    fs = open_fs("mem://")
+    fs.writebytes("file.csv", "name\nJosé\n".encode("utf-8"))
+    assert check_encoding(fs, "file.csv") == "utf-8"
+
+    with mock.patch.object(pipeline, "_detect_encoding") as detect:
+        assert check_encoding(fs, "file.csv") == "utf-8"
+        detect.assert_not_called()
+
+    fs.writebytes("file.csv", "name\nJosé Müller\n".encode("utf-16"))
+    assert check_encoding(fs, "file.csv") == "utf-16"
+
+
+def test_encoding_cache_is_bounded():
+    fs = open_fs("mem://")
+    for name in ["a", "b", "c"]:
+        fs.writebytes(f"{name}.csv", b"name\nJoe\n")
+
+    with mock.patch.object(pipeline, "ENCODING_CACHE_SIZE", 2), mock.patch.object(
+        pipeline, "_encoding_cache", OrderedDict()
+    ):
+        check_encoding(fs, "a.csv")
+        check_encoding(fs, "b.csv")
+        check_encoding(fs, "a.csv")
+        check_encoding(fs, "c.csv")
+        assert len(pipeline._encoding_cache) == 2
+
+        # b was the least recently used so has been evicted, a has not
+        with mock.patch.object(
+            pipeline, "_detect_encoding", return_value="utf-8"
+        ) as detect:
+            check_encoding(fs, "a.csv")
+            detect.assert_not_called()
+            check_encoding(fs, "b.csv")
+            detect.assert_called_once()
+
+
 def test_restore_session_folder():
     session_folder = open_fs("mem://")
     incoming_folder = session_folder.makedirs(SessionNames.INCOMING_FOLDER)
@@ -0,0 +1,63 @@
+from unittest import mock
+
+import pandas as pd
+import pytest
+from fs import open_fs
+
+from liiatools.common.reference import PostcodeLookup
+
+
+def _write_lookup(folder, postcodes, codes):
+    with folder.open("lookup.parquet", "wb") as f:
+        pd.DataFrame({"pcds": postcodes, "CTYUA25CD": codes}).to_parquet(f)
+
+
+@pytest.fixture
+def folder():
+    folder = open_fs("mem://")
+    _write_lookup(folder, ["AB1 2CD", "E1 6AN", "SW1A 1AA"], ["E1", "E2", "E3"])
+    return folder
+
+
+@pytest.fixture
+def lookup(folder):
+    return PostcodeLookup(lambda: folder, "lookup.parquet", "pcds", "CTYUA25CD")
+
+
+def test_lookup(lookup):
+    postcodes = pd.Series(
+        ["sw1a1aa", "AB1 2CD", None, "", "ZZ9 9ZZ", " e1  6an "],
+        index=[5, 3, 9, 1, 0, 7],
+    )
+
+    codes = lookup.lookup(postcodes)
+
+    assert codes.index.tolist() == [5, 3, 9, 1, 0, 7]
+    assert codes.tolist()[:2] == ["E3", "E1"]
+    assert codes[[9, 1, 0]].isna().all()
+    assert codes[7] == "E2"
+
+
+def test_lookup_is_loaded_once(folder, lookup):
+    with mock.patch.object(
+        lookup, "_read_table", wraps=lookup._read_table
+    ) as read_table:
+        lookup.lookup(pd.Series(["AB1 2CD"]))
+        lookup.lookup(pd.Series(["E1 6AN"]))
+
+    assert read_table.call_count == 1
+
+
+def test_lookup_reloads_when_file_changes(folder, lookup):
+    assert lookup.lookup(pd.Series(["AB1 2CD"]))[0] == "E1"
+
+    _write_lookup(folder, ["AB1 2CD", "E1 6AN"], ["W1", "W2"])
+    assert lookup.lookup(pd.Series(["AB1 2CD"]))[0] == "W1"
+
+
+def test_lookup_uses_first_duplicate():
+    folder = open_fs("mem://")
+    _write_lookup(folder, ["AB1 2CD", "ab12cd"], ["E1", "E2"])
+    lookup = PostcodeLookup(lambda: folder, "lookup.parquet", "pcds", "CTYUA25CD")
+
+    assert lookup.lookup(pd.Series(["AB12CD"]))[0] == "E1"
@@ -0,0 +1,94 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from liiatools.common._transform_functions import hash_column_sha256
+from liiatools.common.data import ColumnConfig
+from liiatools.common.pseudonymise import Sha256Pseudonymiser
+
+
+def _expected(value, salt=None):
+    digest = hashlib.sha256(str(value).encode("utf-8"))
+    if salt:
+        digest.update(salt.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def test_hash_series():
+    pseudonymiser = Sha256Pseudonymiser()
+    values = pd.Series(
+        ["A", "B", "A", "", None, np.nan, 12], index=[10, 11, 12, 13, 14, 15, 16]
+    )
+
+    hashed = pseudonymiser.hash_series(values, "salt")
+
+    assert hashed.index.tolist() == values.index.tolist()
+    assert hashed.tolist()[:5] == [
+        _expected("A", "salt"),
+        _expected("B", "salt"),
+        _expected("A", "salt"),
+        "",
+        None,
+    ]
+    assert hashed[15] == _expected("nan", "salt")
+    assert hashed[16] == _expected(12, "salt")
+
+
+def test_hash_series_unsalted():
+    pseudonymiser = Sha256Pseudonymiser()
+    hashed = pseudonymiser.hash_series(pd.Series(["A"]))
+    assert hashed[0] == _expected("A")
+
+
+def test_cache_is_shared_across_columns():
+    pseudonymiser = Sha256Pseudonymiser()
+    pseudonymiser.hash_series(pd.Series(["A", "B", "A"]), "salt")
+    assert (pseudonymiser.hits, pseudonymiser.misses) == (0, 2)
+
+    pseudonymiser.hash_series(pd.Series(["B", "C"]), "salt")
+    assert (pseudonymiser.hits, pseudonymiser.misses) == (1, 3)
+
+    # A different salt gives different digests so must not be served from the cache
+    hashed = pseudonymiser.hash_series(pd.Series(["B"]), "other")
+    assert hashed[0] == _expected("B", "other")
+    assert (pseudonymiser.hits, pseudonymiser.misses) == (1, 4)
+
+
+def test_cache_is_bounded():
+    pseudonymiser = Sha256Pseudonymiser(max_cache_size=2)
+    pseudonymiser.hash_strings(["A", "B"])
+    pseudonymiser.hash_strings(["A"])
+    pseudonymiser.hash_strings(["C"])
+    assert len(pseudonymiser) == 2
+
+    # B was the least recently used so has been evicted, A has not
+    pseudonymiser.hash_strings(["A", "B"])
+    assert (pseudonymiser.hits, pseudonymiser.misses) == (2, 4)
+
+
+def test_process_pool():
+    pseudonymiser = Sha256Pseudonymiser(process_threshold=10, max_workers=2)
+    values = [f"child-{ix}" for ix in range(25)]
+
+    assert pseudonymiser.hash_strings(values, "salt") == [
+        _expected(value, "salt") for value in values
+    ]
+
+
+def test_hash_series_mixed_types():
+    pseudonymiser = Sha256Pseudonymiser()
+    values = pd.Series(
+        [1, "1", 1.0, True, 0, 0.0, False, "0", "", "A", None], dtype=object
+    )
+    column_config = ColumnConfig(id="CHILD", type="string")
+    metadata = {"sha256_salt": "salt"}
+
+    hashed = pseudonymiser.hash_series(values, "salt")
+
+    expected = [
+        hash_column_sha256(pd.Series({"CHILD": value}), column_config, metadata)
+        for value in values
+    ]
+    assert hashed.tolist() == expected
+    assert hashed[6] is False
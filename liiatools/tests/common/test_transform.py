@@ -0,0 +1,197 @@
+import hashlib
+from datetime import date, datetime
+from unittest import mock
+
+import pandas as pd
+import pytest
+from fs import open_fs
+
+from liiatools.common.data import (
+    ColumnConfig,
+    DataContainer,
+    PipelineConfig,
+    TableConfig,
+)
+from liiatools.common.transform import (
+    ExportPlan,
+    ReportPlan,
+    apply_retention,
+    degrade_data,
+    enrich_data,
+    external_data_hashes,
+    prepare_export,
+)
+
+
+@pytest.fixture
+def cfg():
+    cfg = PipelineConfig(
+        sensor_trigger={"move_current_org_sensor": True},
+        retention_columns={"year_column": "YEAR", "la_column": "LA"},
+        retention_period={"PAN": 12, "SUFFICIENCY": 7},
+        degrade_at_clean={"PAN": True, "SUFFICIENCY": True},
+        reports_to_shared={"PAN": True, "SUFFICIENCY": False},
+        la_signed={"BAR": "Yes"},
+        table_list=[
+            TableConfig(
+                id="table1",
+                retain=["PAN", "SUFFICIENCY"],
+                columns=[
+                    ColumnConfig(id="id", type="string", unique_key=True),
+                    ColumnConfig(id="dob", type="date", degrade="first_of_month"),
+                    ColumnConfig(id="count", type="integer"),
+                    ColumnConfig(id="name", type="string", exclude=["PAN"]),
+                    ColumnConfig(id="ref", type="string", degrade="remove_row"),
+                    ColumnConfig(id="YEAR", type="integer", enrich="year"),
+                    ColumnConfig(id="LA", type="string", enrich="la_code"),
+                ],
+            ),
+            TableConfig(
+                id="table2",
+                retain=["SUFFICIENCY"],
+                columns=[
+                    ColumnConfig(id="id", type="string", degrade="hash_sha256"),
+                ],
+            ),
+        ],
+    )
+    return cfg
+
+
+@pytest.fixture
+def data():
+    return DataContainer(
+        {
+            "table1": pd.DataFrame(
+                {
+                    "id": ["1", "2", "3"],
+                    "dob": [date(2020, 5, 17), date(2019, 1, 2), None],
+                    "count": ["4", "", "6"],
+                    "name": ["a", "b", "c"],
+                    "ref": ["x", "", "z"],
+                    "other": [1, 2, 3],
+                }
+            ),
+            "table2": pd.DataFrame({"id": ["1", "2"]}),
+            "table3": pd.DataFrame({"id": ["1"]}),
+        }
+    )
+
+
+@pytest.fixture
+def metadata():
+    return dict(year=2024, la_code="BAR")
+
+
+def _assert_containers_equal(actual: DataContainer, expected: DataContainer):
+    assert list(actual) == list(expected)
+    for table_name in expected:
+        pd.testing.assert_frame_equal(actual[table_name], expected[table_name])
+
+
+@pytest.mark.parametrize("profile", ["PAN", ["PAN", "SUFFICIENCY"]])
+def test_export_plan_matches_transforms(cfg, data, metadata, profile):
+    cleaned = prepare_export(data, cfg, profile)
+    enriched = enrich_data(cleaned, cfg, metadata)
+    degraded = degrade_data(enriched.data, cfg, metadata)
+
+    result = ExportPlan(cfg, profile).run(data, metadata)
+
+    _assert_containers_equal(result.cleaned, cleaned)
+    _assert_containers_equal(result.enriched, enriched.data)
+    _assert_containers_equal(result.degraded, degraded.data)
+    assert list(result.errors) == list(enriched.errors) + list(degraded.errors)
+    assert [e["row_number"] for e in result.errors] == [3]
+
+
+def test_export_plan_does_not_modify_input(cfg, data, metadata):
+    original = data.copy()
+    ExportPlan(cfg, "PAN").run(data, metadata)
+    _assert_containers_equal(data, original)
+
+
+def test_export_plan_without_degrade(cfg, data, metadata):
+    result = ExportPlan(cfg, "PAN", degrade=False).run(data, metadata)
+    assert result.degraded is None
+    assert result.errors == []
+    assert result.enriched["table1"]["ref"].tolist() == ["x", "", "z"]
+
+
+def test_export_plan_degrade_error(cfg, data, metadata):
+    data["table1"]["dob"] = ["not a date", None, None]
+
+    result = ExportPlan(cfg, "PAN").run(data, metadata)
+
+    assert list(result.enriched) == ["table1"]
+    assert len(result.degraded) == 0
+    assert [e["type"] for e in result.errors] == ["TransformError"]
+
+
+def test_report_plan(cfg, data, metadata):
+    current_year = datetime.now().year
+    cfg.degrade_at_clean = {"PAN": True, "SUFFICIENCY": False}
+    cfg.la_signed = {
+        "Barnet": {"PAN": "Yes", "SUFFICIENCY": "Yes"},
+        "Bexley": {"PAN": "No", "SUFFICIENCY": "Yes"},
+    }
+    aggregate = enrich_data(
+        prepare_export(data, cfg, ["PAN", "SUFFICIENCY"]), cfg, metadata
+    ).data
+    aggregate["table1"]["YEAR"] = [current_year, current_year - 10, current_year]
+    aggregate["table1"]["LA"] = ["Barnet", "Barnet", "Bexley"]
+    aggregate["table2"]["YEAR"] = current_year
+    aggregate["table2"]["LA"] = "Bexley"
+    cfg.table_list[1].columns += [
+        ColumnConfig(id="YEAR", type="integer"),
+        ColumnConfig(id="LA", type="string"),
+    ]
+
+    plan = ReportPlan(cfg, year_column="YEAR", la_column="LA")
+    with mock.patch(
+        "liiatools.common.transform.degrade_data", wraps=degrade_data
+    ) as degrade:
+        reports = dict(plan.reports(aggregate))
+        # PAN is degraded and SUFFICIENCY is not, the aggregate is only degraded once
+        assert degrade.call_count == 1
+
+    expected = {}
+    for profile in ["PAN", "SUFFICIENCY"]:
+        source = aggregate
+        if profile == "PAN":
+            source = degrade_data(aggregate, cfg).data
+        expected[profile] = apply_retention(
+            prepare_export(source, cfg, profile), cfg, profile, "YEAR", "LA"
+        )
+
+    assert list(reports) == ["PAN", "SUFFICIENCY"]
+    for profile in reports:
+        _assert_containers_equal(reports[profile], expected[profile])
+
+    assert reports["PAN"]["table1"]["dob"].tolist() == [date(2020, 5, 1)]
+    assert reports["SUFFICIENCY"]["table1"]["dob"].tolist() == [
+        date(2020, 5, 17),
+        None,
+    ]
+    assert "name" in reports["SUFFICIENCY"]["table1"]
+    assert "name" not in reports["PAN"]["table1"]
+
+
+def test_external_data_hashes(cfg):
+    assert external_data_hashes(cfg) == {}
+
+    postcode_cfg = cfg.model_copy(deep=True)
+    postcode_cfg.table_list[0].columns.append(
+        ColumnConfig(id="child_home_la", type="string", enrich="postcode_la_lookup")
+    )
+    external_folder = open_fs("mem://")
+    with mock.patch(
+        "liiatools.common._transform_functions.postcode_las.open_folder",
+        return_value=external_folder,
+    ):
+        assert external_data_hashes(postcode_cfg) == {
+            "postcode_la_lookup.parquet": None
+        }
+        external_folder.writebytes("postcode_la_lookup.parquet", b"lookup")
+        assert external_data_hashes(postcode_cfg) == {
+            "postcode_la_lookup.parquet": hashlib.sha256(b"lookup").hexdigest()
+        }
@@ -1,11 +1,23 @@
+import os
+import time
 import unittest
+from datetime import date
 
 import numpy as np
 import pandas as pd
 
-from liiatools.common._transform_functions import to_integer
+from liiatools.common._transform_functions import (
+    degrade_column_functions,
+    degrade_functions,
+    enrich_column_functions,
+    enrich_functions,
+    to_integer,
+)
 from liiatools.common.data import ColumnConfig
 
+# Timing tests depend on the machine they run on, so they are only run when asked for
+RUN_BENCHMARKS = os.environ.get("LIIATOOLS_BENCHMARKS") == "1"
+
 
 class TestToInteger(unittest.TestCase):
     def setUp(self):
@@ -41,3 +53,140 @@ class TestToInteger(unittest.TestCase):
         row = pd.Series({"test_column": None})
         result = to_integer(row, self.column_config, self.metadata)
         self.assertEqual(result, "")
+
+
+class TestColumnFunctions(unittest.TestCase):
+    """The column-wise transforms must give the same result as applying the row-wise ones to every row"""
+
+    def setUp(self):
+        self.data = pd.DataFrame(
+            {
+                "text": ["abc", " 123.0", "", None, "x1", "45", " abc123 "],
+                "numbers": [1, 0, 2.5, np.nan, -3.7, 12, 100],
+                "date": [
+                    date(2020, 3, 15),
+                    "",
+                    date(2019, 12, 31),
+                    "2021-06-30",
+                    None,
+                    date(2022, 9, 1),
+                    " ",
+                ],
+                "postcode": ["AB1 2CD", "", "ab12cd", None, "SW1A 1AA", "e1 6an", " "],
+                "PersonBirthDate": pd.to_datetime(
+                    [
+                        "2010-09-01",
+                        "2011-08-31",
+                        "2012-01-15",
+                        "2013-12-25",
+                        "2014-06-01",
+                        "2015-10-10",
+                        "2016-02-29",
+                    ]
+                ),
+                "CHILD": ["1", "2", "1", "", None, "3", "2"],
+                "underscores": ["1_000", "5", "abc", None, "2_5.5", 7, " 12 "],
+                "timestamps": pd.Series(
+                    [
+                        pd.Timestamp("2020-03-15"),
+                        pd.Timestamp("2021-06-30 10:00"),
+                        date(2019, 12, 31),
+                        "2021-06-30",
+                        None,
+                        pd.Timestamp("2022-09-01"),
+                        "",
+                    ],
+                    dtype=object,
+                ),
+            }
+        )
+        self.metadata = {
+            "la_code": "BAR",
+            "year": 2022,
+            "month": "mar",
+            "term": "autumn",
+            "school_type": "acad",
+            "sha256_salt": "salt",
+        }
+
+    def assert_equivalent(self, name, column, functions, column_functions):
+        column_config = ColumnConfig(id=column, type="string")
+        expected = self.data.apply(
+            lambda row: functions[name](row, column_config, self.metadata), axis=1
+        )
+        result = column_functions[name](self.data, column_config, self.metadata)
+        pd.testing.assert_series_equal(result, expected, check_names=False)
+        # Object series compare 5 and 5.0, or a date and a Timestamp, as equal so the types are checked too
+        self.assertEqual(result.map(type).tolist(), expected.map(type).tolist())
+
+    def test_enrich_column_functions(self):
+        cases = {
+            "add_la_suffix": "CHILD",
+            "la_code": "text",
+            "year": "text",
+            "month": "text",
+            "term": "text",
+            "school_type": "text",
+            "school_year": "PersonBirthDate",
+        }
+        for name, column in cases.items():
+            with self.subTest(name=name):
+                self.assert_equivalent(
+                    name, column, enrich_functions, enrich_column_functions
+                )
+        for column in ["text", "numbers", "CHILD", "underscores"]:
+            with self.subTest(name="integer", column=column):
+                self.assert_equivalent(
+                    "integer", column, enrich_functions, enrich_column_functions
+                )
+
+    def test_degrade_column_functions(self):
+        cases = [
+            ("first_of_month", "date"),
+            ("first_of_month", "PersonBirthDate"),
+            ("first_of_month", "timestamps"),
+            ("short_postcode", "postcode"),
+            ("hash_sha256", "CHILD"),
+            ("hash_sha256", "numbers"),
+            ("remove_row", "CHILD"),
+            ("remove_row", "numbers"),
+        ]
+        for name, column in cases:
+            with self.subTest(name=name, column=column):
+                self.assert_equivalent(
+                    name, column, degrade_functions, degrade_column_functions
+                )
+
+    def test_column_functions_cover_row_functions(self):
+        self.assertEqual(
+            set(enrich_column_functions), set(enrich_functions) - {"postcode_la_lookup"}
+        )
+        self.assertEqual(set(degrade_column_functions), set(degrade_functions))
+
+    @unittest.skipUnless(RUN_BENCHMARKS, "set LIIATOOLS_BENCHMARKS=1 to run")
+    def test_column_functions_speed(self):
+        data = pd.concat([self.data] * 2000, ignore_index=True)
+        cases = [
+            ("year", "text", enrich_functions, enrich_column_functions),
+            ("integer", "numbers", enrich_functions, enrich_column_functions),
+            ("hash_sha256", "CHILD", degrade_functions, degrade_column_functions),
+            ("first_of_month", "date", degrade_functions, degrade_column_functions),
+        ]
+        for name, column, functions, column_functions in cases:
+            with self.subTest(name=name):
+                column_config = ColumnConfig(id=column, type="string")
+
+                start = time.perf_counter()
+                expected = data.apply(
+                    lambda row: functions[name](row, column_config, self.metadata),
+                    axis=1,
+                )
+                row_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                result = column_functions[name](data, column_config, self.metadata)
+                column_time = time.perf_counter() - start
+
+                pd.testing.assert_series_equal(result, expected, check_names=False)
+                # 14,000 rows: the column-wise version should be several times faster
+                self.assertLess(column_time, row_time)
@@ -0,0 +1,132 @@
+import pandas as pd
+import pytest
+
+from liiatools.pnw_census_pipeline.join_plan import PNWJoinPlan
+from liiatools.pnw_census_pipeline.pnw_dataset_join import (
+    add_missing_cans_columns,
+    join_cans_data,
+    join_episode_data,
+    join_header_data,
+    join_missing_data,
+    join_oc2_data,
+    join_onspd_data,
+    join_uasc_data,
+)
+
+CANS_COLUMNS = ["Assessment Date", "Trauma"]
+
+
+@pytest.fixture
+def pnw_census():
+    return pd.DataFrame(
+        {
+            "Identifier": ["1", "2", "3", "1", "4"],
+            "Age": [10, 12, 15, 10, 9],
+            "snapshot_date": pd.to_datetime(
+                ["2024-12-31", "2024-12-31", "2024-12-31", "2024-11-30", "2024-12-31"]
+            ),
+        }
+    )
+
+
+@pytest.fixture
+def datasets():
+    episodes = pd.DataFrame(
+        {
+            "CHILD": ["1", "1", "2", "2", "3"],
+            "DECOM": [
+                "2024-01-01",
+                "2024-06-01",
+                "2024-03-01",
+                "2024-03-01",
+                "2023-01-01",
+            ],
+            "DEC": ["2024-06-01", None, None, None, "2023-06-01"],
+            "PLACE": ["U1", "U2", "U3", "U4", "U5"],
+            "PLACE_PROVIDER": "PR1",
+            "HOME_POST": ["AB1 1", "AB1 1", "AB2 2", "XY9 9", "AB1 1"],
+            "PL_POST": ["AB2 2", "AB2 2", "AB1 1", None, "AB2 2"],
+        }
+    )
+    postcode = pd.DataFrame(
+        {
+            "pcd2": ["AB1  1", "AB2 2 "],
+            "oseast1m": [1, 2],
+            "osnrth1m": [3, 4],
+            "oslaua": ["E1", "E2"],
+        }
+    )
+    # Child 2 has a header in two years, so its rows are repeated as with a merge
+    header = pd.DataFrame(
+        {"CHILD": ["1", "2", "2"], "SEX": [1, 2, 2], "ETHNIC": ["WBRI", "AIND", "AIND"]}
+    )
+    uasc = pd.DataFrame({"CHILD": ["1", "3"], "DUC": ["2025-05-06", "2022-01-30"]})
+    oc2 = pd.DataFrame(
+        {
+            "CHILD": ["1", "1", "3"],
+            "YEAR": [2025, 2025, 2024],
+            "CONVICTED": [None, 1, 0],
+            "SUBSTANCE_MISUSE": [1, 0, 1],
+            "INTERVENTION_RECEIVED": [0, 1, 1],
+            "INTERVENTION_OFFERED": [1, 0, 1],
+        }
+    )
+    missing = pd.DataFrame(
+        {
+            "CHILD": ["1", "2", "2"],
+            "MIS_START": ["2024-05-01", "2024-02-01", "2022-01-01"],
+            "MIS_END": ["2024-05-02", "2024-02-03", "2022-01-02"],
+        }
+    )
+    cans = pd.DataFrame(
+        {
+            "Child Unique ID": ["1", "1", "4"],
+            "Assessment Date": ["2024-01-01", "2024-06-01", "2024-02-01"],
+            "Trauma": [1, 2, 3],
+        }
+    )
+    return episodes, postcode, header, uasc, oc2, missing, cans
+
+
+def test_join_plan_matches_joins(pnw_census, datasets):
+    episodes, postcode, header, uasc, oc2, missing, cans = datasets
+
+    expected = join_episode_data(episodes, pnw_census)
+    expected = join_onspd_data(postcode.copy(), expected)
+    expected = join_header_data(header, expected)
+    expected = join_uasc_data(uasc, expected)
+    expected = join_oc2_data(oc2, expected)
+    expected = join_missing_data(missing, expected)
+    expected = join_cans_data(cans.copy(), expected, CANS_COLUMNS)
+
+    plan = PNWJoinPlan(pnw_census)
+    plan.join_episode_data(episodes)
+    plan.join_onspd_data(postcode.copy())
+    plan.join_header_data(header)
+    plan.join_uasc_data(uasc)
+    plan.join_oc2_data(oc2)
+    plan.join_missing_data(missing)
+    plan.join_cans_data(cans.copy(), CANS_COLUMNS)
+    actual = plan.result()
+
+    assert len(actual) == len(pnw_census) + 3
+    assert list(actual.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_join_plan_empty_columns(pnw_census, datasets):
+    header = datasets[2]
+
+    expected = pnw_census.copy()
+    expected["Home postcode"] = None
+    expected = join_header_data(header, expected)
+    expected = add_missing_cans_columns(expected, CANS_COLUMNS)
+
+    plan = PNWJoinPlan(pnw_census)
+    plan.assign({"Home postcode": None})
+    plan.join_header_data(header)
+    plan.add_missing_cans_columns(CANS_COLUMNS)
+
+    pd.testing.assert_frame_equal(plan.result(), expected)
+    # The census itself is left unchanged
+    assert list(pnw_census.columns) == ["Identifier", "Age", "snapshot_date"]
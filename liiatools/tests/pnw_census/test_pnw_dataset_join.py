@@ -1,7 +1,9 @@
 import numpy as np
 import pandas as pd
+import pytest
 
 from liiatools.pnw_census_pipeline.pnw_dataset_join import (
+    IntervalLookup,
     _filter_to_open_in_last_12m,
     _filter_to_open_on_snapshot_date,
     join_episode_data,
@@ -80,6 +82,56 @@ def test_filter_to_open_on_snapshot_date():
         print("Test failed")
 
 
+@pytest.mark.parametrize("seed", range(5))
+def test_interval_lookup_matches_filters(seed):
+    rng = np.random.default_rng(seed)
+    start = pd.Series(
+        pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 800, 300), "D")
+    )
+    # Includes overlapping episodes, episodes ending before they start and open episodes
+    end = start + pd.to_timedelta(rng.integers(-10, 200, 300), "D")
+    start[rng.random(300) < 0.05] = pd.NaT
+    end[rng.random(300) < 0.2] = pd.NaT
+    episodes = pd.DataFrame(
+        {
+            "CHILD": rng.choice(["1", "2", "3", "4"], 300),
+            "DECOM": start.dt.strftime("%Y-%m-%d"),
+            "DEC": end.dt.strftime("%Y-%m-%d"),
+        }
+    )
+    pnw = pd.DataFrame(
+        {
+            "Identifier": rng.choice(["1", "2", "3", "5"], 40),
+            "snapshot_date": pd.Timestamp("2023-01-31")
+            + pd.to_timedelta(rng.integers(0, 900, 40), "D"),
+        }
+    )
+
+    merged = episodes.reset_index(names="row").merge(
+        pnw.reset_index(names="query"), left_on="CHILD", right_on="Identifier"
+    )
+    in_last_12m = _filter_to_open_in_last_12m(merged, "DECOM", "snapshot_date", "DEC")
+    open_on_snapshot = _filter_to_open_on_snapshot_date(
+        in_last_12m, "DEC", "snapshot_date", "DECOM"
+    )
+
+    intervals = IntervalLookup(episodes["CHILD"], episodes["DECOM"], episodes["DEC"])
+    query, rows = intervals.overlapping(
+        pnw["Identifier"],
+        pnw["snapshot_date"] - pd.DateOffset(months=12),
+        pnw["snapshot_date"],
+    )
+    assert query.tolist() == in_last_12m["query"].tolist()
+    assert rows.tolist() == in_last_12m["row"].tolist()
+
+    query, rows = intervals.overlapping(
+        pnw["Identifier"], pnw["snapshot_date"], pnw["snapshot_date"], include_end=False
+    )
+    assert len(query) > 0
+    assert query.tolist() == open_on_snapshot["query"].tolist()
+    assert rows.tolist() == open_on_snapshot["row"].tolist()
+
+
 def test_join_episode_data():
     episodes_df = pd.DataFrame(
         {
@@ -0,0 +1,137 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from dagster import build_op_context
+from fs import open_fs
+
+from liiatools.common.data import ColumnConfig, TableConfig
+from liiatools.tests.s903.test_fix_episodes_vectorised import (
+    EPISODE_COLS,
+    _random_episodes,
+)
+from liiatools_pipeline.ops import ssda903_la
+from liiatools_pipeline.ops.common_config import FixEpisodesConfig
+
+LAS = ["BAR", "CAM", "ENF"]
+
+
+@pytest.fixture
+def folders():
+    session_folder = open_fs("mem://")
+    for seed, la in enumerate(LAS):
+        episodes = _random_episodes(seed).assign(LA=la)
+        session_folder.writetext(
+            f"{la}_ssda903_episodes.csv", episodes.to_csv(index=False)
+        )
+    shared = open_fs("mem://")
+    shared.makedirs("concatenated/ssda903")
+    return session_folder, shared, open_fs("mem://")
+
+
+def _run_fix_episodes(folders, fix_la_episodes, max_workers=2):
+    """
+    Runs the fix_episodes op with threads in place of worker processes, so that fix_la_episodes can stand in for
+    _fix_la_episodes, and returns the log and the LAs whose fixed episodes were exported
+    """
+    session_folder, shared, workspace = folders
+    # YEAR_latest is added by the fix, so it is not a column of the concatenated episodes
+    episodes_config = TableConfig(
+        id="episodes",
+        columns=[
+            ColumnConfig(id=c, type="string")
+            for c in EPISODE_COLS
+            if c != "YEAR_latest"
+        ],
+    )
+    log = mock.Mock()
+    with mock.patch.multiple(
+        ssda903_la,
+        shared_folder=lambda: shared,
+        workspace_folder=lambda: workspace,
+        load_pipeline_config=lambda: {"episodes": episodes_config},
+        ProcessPoolExecutor=ThreadPoolExecutor,
+        _fix_la_episodes=fix_la_episodes,
+        log=log,
+    ):
+        try:
+            with build_op_context() as context:
+                ssda903_la.fix_episodes(
+                    context,
+                    session_folder=session_folder,
+                    config=FixEpisodesConfig(max_workers=max_workers),
+                )
+        finally:
+            exported = sorted(
+                file.split("_")[0] for file in shared.listdir("concatenated/ssda903")
+            )
+    return log, exported
+
+
+def _failing_for(errors):
+    """
+    Returns a stand-in for _fix_la_episodes which raises the given error for an LA and fixes the others
+    """
+    fix_la_episodes = ssda903_la._fix_la_episodes
+
+    def fix(raw_episodes, *args):
+        for la, error in errors.items():
+            if f",{la}".encode() in raw_episodes:
+                raise error
+        return fix_la_episodes(raw_episodes, *args)
+
+    return fix
+
+
+def test_fix_episodes_type_error_is_isolated(folders):
+    log, exported = _run_fix_episodes(folders, _failing_for({"CAM": TypeError("bad")}))
+
+    assert exported == ["BAR", "ENF"]
+    log.error.assert_called_once_with("Fixing episodes table failed for CAM: bad")
+    # The fixed episodes of the other LAs are stored for the next run
+    store_folder = folders[2].opendir("cache/ssda903_fix_episodes")
+    assert sorted(store_folder.listdir("/")) == [
+        "BAR_episodes.parquet",
+        "BAR_episodes_hashes.parquet",
+        "ENF_episodes.parquet",
+        "ENF_episodes_hashes.parquet",
+    ]
+
+
+def test_fix_episodes_failures_are_raised_together(folders):
+    errors = {"CAM": ValueError("bad CAM"), "ENF": KeyError("DECOM")}
+
+    with pytest.raises(RuntimeError) as excinfo:
+        _run_fix_episodes(folders, _failing_for(errors))
+
+    message = str(excinfo.value)
+    assert message.startswith("Fixing episodes failed for ")
+    assert sorted(message.removeprefix("Fixing episodes failed for ").split(", ")) == [
+        "CAM",
+        "ENF",
+    ]
+    assert excinfo.value.__cause__ in errors.values()
+
+    # The LA that was fixed is still exported
+    assert folders[1].listdir("concatenated/ssda903") == ["BAR_ssda903_episodes.csv"]
+
+
+def test_fix_episodes_reads_files_as_workers_are_free(folders):
+    session_folder = folders[0]
+    events = []
+    readbytes = session_folder.readbytes
+    fix_la_episodes = ssda903_la._fix_la_episodes
+
+    def read(path):
+        events.append(f"read {path.split('_')[0]}")
+        return readbytes(path)
+
+    def fix(raw_episodes, *args):
+        events.append("fix")
+        return fix_la_episodes(raw_episodes, *args)
+
+    with mock.patch.object(session_folder, "readbytes", read):
+        _, exported = _run_fix_episodes(folders, fix, max_workers=1)
+
+    assert exported == LAS
+    assert events == ["read BAR", "fix", "read CAM", "fix", "read ENF", "fix"]
@@ -0,0 +1,232 @@
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from liiatools.ssda903_pipeline.fix_episodes import (
+    _has_x1_gap_before_next_episode,
+    _overlaps_next_episode,
+    _stage1_rule_to_apply,
+    _stage2_rule_to_apply,
+    _update_dec_stage1,
+    _update_dec_stage2,
+    _update_episode_source_stage1,
+    _update_episode_source_stage2,
+    _update_reason_place_change_stage1,
+    _update_rec_stage1,
+    add_latest_year_and_source_for_la,
+    add_stage1_rule_identifier_columns,
+    create_previous_and_next_episode,
+    fix_episodes_incrementally,
+    format_datetime,
+    stage_1,
+    stage_2,
+)
+
+DATES = ["DECOM", "DEC", "DECOM_previous", "DEC_previous", "DECOM_next", "DEC_next"]
+
+EPISODE_COLS = [
+    "CHILD",
+    "DECOM",
+    "RNE",
+    "LS",
+    "PLACE",
+    "PLACE_PROVIDER",
+    "DEC",
+    "REC",
+    "REASON_PLACE_CHANGE",
+    "PL_POST",
+    "URN",
+    "YEAR",
+    "LA",
+    "YEAR_latest",
+    "Episode_source",
+]
+TRANSFORM_COLS = [
+    c for c in EPISODE_COLS if c not in ["CHILD", "LA", "YEAR_latest", "Episode_source"]
+]
+
+
+def _stage_1_rowwise(df: pd.DataFrame, transform_cols: list) -> pd.DataFrame:
+    """
+    Stage 1 as it was implemented with row-wise apply, kept as the reference for the vectorised rules
+    """
+    df = df.sort_values(["CHILD", "DECOM"], ignore_index=True)
+    df = create_previous_and_next_episode(df, transform_cols)
+    df = format_datetime(df, DATES)
+    df = add_latest_year_and_source_for_la(df)
+    df = add_stage1_rule_identifier_columns(df)
+    df["Rule_to_apply"] = df.apply(_stage1_rule_to_apply, axis=1)
+
+    df = df.drop(df[df["Rule_to_apply"].isin(["RULE_3", "RULE_3A"])].index)
+    df["DEC"] = df.apply(_update_dec_stage1, axis=1)
+    df["REC"] = df.apply(_update_rec_stage1, axis=1)
+    df["REASON_PLACE_CHANGE"] = df.apply(_update_reason_place_change_stage1, axis=1)
+    df["Episode_source"] = df.apply(_update_episode_source_stage1, axis=1)
+    return df
+
+
+def _stage_2_rowwise(
+    df: pd.DataFrame, columns_to_keep: list, transform_cols: list
+) -> pd.DataFrame:
+    df = df[columns_to_keep]
+    df = create_previous_and_next_episode(df, transform_cols)
+    df = format_datetime(df, DATES)
+    df["Has_next_episode"] = df["DECOM_next"].notnull()
+    df["Overlaps_next_episode"] = df.apply(_overlaps_next_episode, axis=1)
+    df["Has_X1_gap_before_next_episode"] = df.apply(
+        _has_x1_gap_before_next_episode, axis=1
+    )
+    df["Rule_to_apply"] = df.apply(_stage2_rule_to_apply, axis=1)
+    df["Episode_source"] = df.apply(_update_episode_source_stage2, axis=1)
+    df["DEC"] = df.apply(_update_dec_stage2, axis=1)
+    return df[columns_to_keep].sort_values(["CHILD", "DECOM"], ignore_index=True)
+
+
+def _random_episodes(seed: int, children: int = 40) -> pd.DataFrame:
+    """
+    Random episodes with many open, duplicated, overlapping and re-submitted episodes, read back from csv as
+    the fix_episodes op does
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for child in range(children):
+        la = rng.choice(["BAR", "CAM"])
+        decom = date(2016, 4, 1) + timedelta(days=int(rng.integers(0, 700)))
+        for _ in range(rng.integers(1, 7)):
+            length = int(rng.integers(0, 400))
+            dec = decom + timedelta(days=length)
+            row = dict(
+                CHILD=f"C{child}",
+                DECOM=decom.isoformat(),
+                RNE=rng.choice(["S", "L", "P", "B", "T", "U"]),
+                LS=rng.choice(["C2", "V2", None]),
+                PLACE=rng.choice(["U1", "U4", None]),
+                PLACE_PROVIDER=rng.choice(["PR1", "PR2"]),
+                DEC=dec.isoformat() if rng.random() < 0.6 else None,
+                REC=rng.choice(["X1", "E11", None]),
+                REASON_PLACE_CHANGE=rng.choice(["CARPL", None]),
+                PL_POST=rng.choice(["AB1 2", None]),
+                URN=rng.choice(["SC1", None]),
+                YEAR=int(min(2021, dec.year + 1 + rng.integers(0, 2))),
+                LA=la,
+            )
+            rows.append(row)
+            if rng.random() < 0.15:
+                # Re-submitted episode
+                rows.append(dict(row, YEAR=row["YEAR"] + int(rng.integers(0, 2))))
+            if rng.random() < 0.1:
+                # Open episode duplicated with a later start date
+                row["DEC"] = None
+                shift = timedelta(days=int(rng.integers(1, 20)))
+                rows.append(dict(row, DECOM=(decom + shift).isoformat()))
+            # Next episode starts before, on or after the end of this one
+            decom = dec + timedelta(days=int(rng.integers(-30, 30)))
+
+    buffer = StringIO()
+    pd.DataFrame(rows).to_csv(buffer, index=False)
+    buffer.seek(0)
+    return pd.read_csv(buffer)
+
+
+def _normalise(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.reset_index(drop=True).astype(object)
+    return df.where(df.notna(), None)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_stages_match_rowwise_rules(seed):
+    episodes = _random_episodes(seed)
+
+    expected_stage1 = _stage_1_rowwise(episodes.copy(), TRANSFORM_COLS)
+    actual_stage1 = stage_1(episodes.copy(), TRANSFORM_COLS)
+    pd.testing.assert_frame_equal(
+        _normalise(actual_stage1), _normalise(expected_stage1), check_dtype=False
+    )
+
+    expected = _stage_2_rowwise(expected_stage1, EPISODE_COLS, TRANSFORM_COLS)
+    actual = stage_2(actual_stage1, EPISODE_COLS, TRANSFORM_COLS)
+    pd.testing.assert_frame_equal(
+        _normalise(actual), _normalise(expected), check_dtype=False
+    )
+
+
+def test_random_episodes_cover_all_rules():
+    episodes = pd.concat(
+        [
+            _random_episodes(seed).assign(CHILD=lambda df: f"{seed}_" + df["CHILD"])
+            for seed in range(20)
+        ]
+    )
+    stage1 = _stage_1_rowwise(episodes.copy(), TRANSFORM_COLS)
+    assert len(stage1) < len(episodes)
+    stage2 = _stage_2_rowwise(stage1, EPISODE_COLS, TRANSFORM_COLS)
+    sources = set(stage1["Episode_source"]) | set(
+        s for source in stage2["Episode_source"] for s in source.split(" | ")
+    )
+    assert {"RULE_1", "RULE_1A", "RULE_2", "RULE_4", "RULE_5"} <= sources
+
+
+def _parquet_roundtrip(df: pd.DataFrame) -> pd.DataFrame:
+    buffer = BytesIO()
+    df.to_parquet(buffer, index=False)
+    buffer.seek(0)
+    return pd.read_parquet(buffer)
+
+
+def _fix_all(episodes: pd.DataFrame) -> pd.DataFrame:
+    return stage_2(
+        stage_1(episodes.copy(), TRANSFORM_COLS), EPISODE_COLS, TRANSFORM_COLS
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fix_episodes_incrementally(seed):
+    episodes = _random_episodes(seed).assign(
+        LA="BAR", YEAR=lambda df: df["YEAR"].clip(upper=2020)
+    )
+    fixed, hashes, changed = fix_episodes_incrementally(
+        episodes.copy(), EPISODE_COLS, TRANSFORM_COLS
+    )
+    assert len(changed) == len(hashes) == episodes["CHILD"].nunique()
+    pd.testing.assert_frame_equal(_normalise(fixed), _normalise(_fix_all(episodes)))
+
+    # Change one child's episodes, remove a child and add a new one
+    updated = episodes[episodes["CHILD"] != "C1"].copy()
+    updated.loc[updated["CHILD"] == "C2", "PLACE_PROVIDER"] = "PR3"
+    updated = pd.concat(
+        [updated, episodes[episodes["CHILD"] == "C3"].assign(CHILD="C100")],
+        ignore_index=True,
+    )
+    refixed, hashes, changed = fix_episodes_incrementally(
+        updated.copy(),
+        EPISODE_COLS,
+        TRANSFORM_COLS,
+        _parquet_roundtrip(fixed),
+        hashes,
+    )
+    assert sorted(changed) == ["C100", "C2"]
+    pd.testing.assert_frame_equal(
+        _normalise(refixed), _normalise(_fix_all(updated)), check_dtype=False
+    )
+
+    # Nothing has changed
+    _, _, changed = fix_episodes_incrementally(
+        updated.copy(), EPISODE_COLS, TRANSFORM_COLS, refixed, hashes
+    )
+    assert len(changed) == 0
+
+    # A new latest year changes which open episodes are errors, so every child is fixed again
+    new_year = pd.concat(
+        [updated, episodes[episodes["CHILD"] == "C3"].assign(CHILD="C101", YEAR=2021)],
+        ignore_index=True,
+    )
+    refixed, _, changed = fix_episodes_incrementally(
+        new_year.copy(), EPISODE_COLS, TRANSFORM_COLS, refixed, hashes
+    )
+    assert len(changed) == new_year["CHILD"].nunique()
+    pd.testing.assert_frame_equal(
+        _normalise(refixed), _normalise(_fix_all(new_year)), check_dtype=False
+    )
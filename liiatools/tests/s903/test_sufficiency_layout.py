@@ -0,0 +1,40 @@
+from unittest import mock
+
+from fs import open_fs
+
+from liiatools_pipeline.ops import ssda903_org
+
+
+def _files(folder):
+    return sorted(path for path in folder.walk.files())
+
+
+@mock.patch.object(ssda903_org, "log", mock.Mock())
+def test_switch_between_full_tables_and_la_partitions():
+    cache_folder = open_fs("mem://")
+    folders = [open_fs("mem://"), open_fs("mem://")]
+    for folder in folders:
+        for table in ["dimLookedAfterChild", "factEpisode", "dimOfstedProvider"]:
+            folder.writetext(f"{table}.csv", "a\n1\n")
+
+    # Switching to LA partitions removes the full tables that they replace
+    ssda903_org._remove_other_layout(cache_folder, folders, incremental=True)
+    for folder in folders:
+        assert _files(folder) == ["/dimOfstedProvider.csv"]
+        folder.makedirs("factEpisode").writetext("302.parquet", "")
+        folder.makedirs("dimLookedAfterChild").writetext("302.parquet", "")
+    cache_folder.writetext(ssda903_org.PARTITIONS_MANIFEST, "{}")
+
+    # Running incrementally again keeps the partitions
+    ssda903_org._remove_other_layout(cache_folder, folders, incremental=True)
+    assert _files(folders[0]) == [
+        "/dimLookedAfterChild/302.parquet",
+        "/dimOfstedProvider.csv",
+        "/factEpisode/302.parquet",
+    ]
+
+    # Switching back to the full tables removes the partitions and their manifest
+    ssda903_org._remove_other_layout(cache_folder, folders, incremental=False)
+    for folder in folders:
+        assert _files(folder) == ["/dimOfstedProvider.csv"]
+    assert not cache_folder.exists(ssda903_org.PARTITIONS_MANIFEST)
@@ -0,0 +1,257 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from liiatools.ssda903_pipeline.sufficiency_transform import (
+    LA_KEY_OFFSET,
+    KeyLookup,
+    assign_keys,
+    dim_key_lookup,
+    dim_tables,
+    la_partition,
+    ons_transform,
+    partition_hash,
+    postcode_transform,
+    split_by_la,
+    ss903_transform_partition,
+)
+
+
+def test_dim_key_lookup():
+    lookup = dim_key_lookup("dimReasonForNewEpisode")
+    assert lookup is dim_key_lookup("dimReasonForNewEpisode")
+
+    positions, repeats = lookup.indexer(pd.Index(["S", "X", "-1"]))
+    assert repeats is None
+    assert lookup.keys[positions[[0, 2]]].tolist() == [4, -1]
+    assert positions[1] == -1
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_assign_keys_matches_merges(seed):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "RNE": rng.choice(["S", "L", "X", None], 200),
+            "AREA": rng.choice(["Barnet", "Abbey", "Nowhere", None], 200),
+            "POST": rng.choice(["AB1 1", "AB2 2", None], 200),
+            "value": np.arange(200),
+        }
+    )
+    # Areas and postcodes have repeated codes, as ward names do in the ONS areas
+    areas = pd.DataFrame(
+        {
+            "AreaName": ["Abbey", "Barnet", "Abbey", "Barnet", "Abbey", np.nan],
+            "ONSAreaKey": [0.0, 1.0, 2.0, 3.0, 4.0, -1.0],
+        }
+    )
+    postcodes = pd.DataFrame(
+        {"Sector": ["AB1 1", "AB2 2", "AB1 1"], "PostcodeKey": [0, 1, 2]}
+    )
+
+    expected = df
+    for code_column, dim, code, key in [
+        (
+            "RNE",
+            pd.DataFrame(dim_tables["dimReasonForNewEpisode"]),
+            "ReasonForNewEpisodeCode",
+            "ReasonForNewEpisodeKey",
+        ),
+        ("AREA", areas, "AreaName", "ONSAreaKey"),
+        ("POST", postcodes, "Sector", "PostcodeKey"),
+    ]:
+        expected = expected.merge(
+            dim[[key, code]], left_on=code_column, right_on=code, how="left"
+        ).drop(columns=code)
+
+    actual = assign_keys(
+        df,
+        [
+            ("RNE", "ReasonForNewEpisodeKey", dim_key_lookup("dimReasonForNewEpisode")),
+            ("AREA", "ONSAreaKey", KeyLookup(areas["AreaName"], areas["ONSAreaKey"])),
+            (
+                "POST",
+                "PostcodeKey",
+                KeyLookup(postcodes["Sector"], postcodes["PostcodeKey"]),
+            ),
+        ],
+    )
+
+    assert len(actual) > len(df)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_ons_transform():
+    ons = pd.DataFrame(
+        {
+            "_WD21CD": ["W1", "W2", "W3", "W1"],
+            "WD21NM": ["Ward 1", "Ward 2", "Ward 3", "Ward 1"],
+            "LAD21CD": ["E1", "E1", "E2", "E1"],
+            "LAD21NM": ["Barnet", "Barnet", "Bexley", "Barnet"],
+            "CTY21CD": [np.nan, np.nan, np.nan, np.nan],
+            "CTY21NM": [np.nan, np.nan, np.nan, np.nan],
+            "RGN21CD": ["R1", "R1", "R1", "R1"],
+            "RGN21NM": ["London", "London", "London", "London"],
+            "CTRY21CD": ["E92", "E92", "E92", "E92"],
+            "CTRY21NM": ["England", "England", "England", "England"],
+        }
+    )
+
+    areas = ons_transform(ons)
+
+    assert areas["ONSAreaKey"].tolist() == [0, 1, 2, 3, 4, 5, 6, -1]
+    assert areas["AreaType"].tolist() == [
+        "Ward",
+        "Ward",
+        "Ward",
+        "LA",
+        "LA",
+        "Region",
+        "Country",
+        "Unknown",
+    ]
+    assert areas["AreaName"].tolist() == [
+        "Ward 1",
+        "Ward 2",
+        "Ward 3",
+        "Barnet",
+        "Bexley",
+        "London",
+        "England",
+        "Unknown",
+    ]
+    assert areas.loc[3, "WardCode"] == "Unknown"
+    assert areas.loc[3, "RegionName"] == "London"
+
+
+@pytest.fixture
+def ssda903_inputs():
+    header = pd.DataFrame(
+        {
+            "CHILD": ["1", "2", "3"],
+            "SEX": [1, 2, 1],
+            "DOB": "2010-01-01",
+            "ETHNIC": ["WBRI", "AIND", "WBRI"],
+            "YEAR": 2023,
+            "LA": ["Barnet", "Barnet", "Bexley"],
+        }
+    )
+    uasc = pd.DataFrame(
+        {"CHILD": ["2"], "DUC": ["2022-01-01"], "YEAR": [2023], "LA": ["Barnet"]}
+    )
+    episodes = pd.DataFrame(
+        {
+            "CHILD": ["1", "1", "2", "3", "4"],
+            "DECOM": "2022-05-01",
+            "RNE": ["S", "P", "S", "L", "S"],
+            "LS": "C2",
+            "CIN": "N1",
+            "PLACE": "U1",
+            "PLACE_PROVIDER": "PR1",
+            "DEC": None,
+            "REC": None,
+            "REASON_PLACE_CHANGE": None,
+            "HOME_POST": "AB1 2",
+            "PL_POST": None,
+            "URN": "SC1",
+            "YEAR": 2023,
+            "LA": ["Barnet", "Barnet", "Barnet", "Bexley", "Nowhere"],
+        }
+    )
+    ons_area = ons_transform(
+        pd.DataFrame(
+            {
+                "_WD21CD": ["W1", "W2"],
+                "WD21NM": ["Ward 1", "Ward 2"],
+                "LAD21CD": ["E1", "E2"],
+                "LAD21NM": ["Barnet", "Bexley"],
+                "CTY21CD": np.nan,
+                "CTY21NM": np.nan,
+                "RGN21CD": "R1",
+                "RGN21NM": "London",
+                "CTRY21CD": "E92",
+                "CTRY21NM": "England",
+            }
+        )
+    )
+    postcode = postcode_transform(
+        pd.DataFrame(
+            {
+                "pcd2": ["AB1  2"],
+                "oslaua": "E1",
+                "lsoa11": "L1",
+                "lat": 1.0,
+                "long": 2.0,
+                "oseast1m": 1,
+                "osnrth1m": 2,
+                "imd": 3,
+            }
+        )
+    )
+    ofsted_provider = pd.DataFrame(
+        {"OfstedProviderKey": [0, -1], "URN": ["SC1", "Missing"]}
+    )
+    return header, uasc, episodes, ons_area, postcode, ofsted_provider
+
+
+def test_split_by_la(ssda903_inputs):
+    episodes = ssda903_inputs[2]
+    assert la_partition("Barnet") == "302"
+    assert la_partition("302") == "302"
+    assert la_partition("Nowhere") == "unknown"
+
+    partitions = split_by_la(episodes)
+    assert list(partitions) == ["302", "303", "unknown"]
+    assert partitions["302"]["CHILD"].tolist() == ["1", "1", "2"]
+    assert partitions["unknown"]["CHILD"].tolist() == ["4"]
+
+
+def test_partition_hash(ssda903_inputs):
+    header, uasc, episodes = ssda903_inputs[:3]
+    key = partition_hash([header, uasc, episodes], "ons-key")
+
+    assert key == partition_hash([header.copy(), uasc, episodes], "ons-key")
+    assert key != partition_hash([header, uasc, episodes], "other-ons-key")
+    assert key != partition_hash([header, uasc, episodes.iloc[::-1]], "ons-key")
+    assert key != partition_hash([header, uasc, episodes.assign(RNE="P")], "ons-key")
+
+
+def test_ss903_transform_partition(ssda903_inputs):
+    header, uasc, episodes, ons_area, postcode, ofsted_provider = ssda903_inputs
+    header_partitions = split_by_la(header)
+    episode_partitions = split_by_la(episodes)
+
+    children, facts = [], []
+    for partition in ["302", "303"]:
+        LookedAfterChild, factEpisode, unmatched = ss903_transform_partition(
+            partition,
+            header_partitions[partition],
+            uasc,
+            ons_area,
+            episode_partitions[partition],
+            postcode,
+            ofsted_provider,
+        )
+        assert unmatched["LookedAfterChildKey"].tolist() == [-1]
+        la_keys = LookedAfterChild["LookedAfterChildKey"] // LA_KEY_OFFSET
+        assert (la_keys == int(partition)).all()
+        children.append(LookedAfterChild)
+        facts.append(factEpisode)
+
+    LookedAfterChild = pd.concat(children, ignore_index=True)
+    factEpisode = pd.concat(facts, ignore_index=True)
+    assert LookedAfterChild["LookedAfterChildKey"].tolist() == [
+        302 * LA_KEY_OFFSET,
+        302 * LA_KEY_OFFSET + 1,
+        303 * LA_KEY_OFFSET,
+    ]
+    assert LookedAfterChild["UASCStatusCode"].tolist() == [0, 1, 0]
+    assert factEpisode["FactEpisodeKey"].is_unique
+    assert factEpisode["LookedAfterChildKey"].tolist() == [
+        302 * LA_KEY_OFFSET,
+        302 * LA_KEY_OFFSET,
+        302 * LA_KEY_OFFSET + 1,
+        303 * LA_KEY_OFFSET,
+    ]
+    assert factEpisode["ReasonForNewEpisodeKey"].tolist() == [4, 3, 4, 2]
+    assert factEpisode["LookedAfterChildKey"].dtype == "int64"
@@ -0,0 +1,50 @@
+import pandas as pd
+
+from liiatools_pipeline.ops.school_census_org import iter_partitions
+
+
+def _assert_matches_groupby(df, column):
+    partitions = list(iter_partitions(df, column))
+    groups = list(df.groupby(column))
+
+    assert [value for value, _ in partitions] == [value for value, _ in groups]
+    for (_, partition), (_, group) in zip(partitions, groups):
+        pd.testing.assert_frame_equal(partition, group.reset_index(drop=True))
+    return partitions
+
+
+def test_iter_partitions():
+    df = pd.DataFrame(
+        {
+            "LA": ["Enfield", "Barnet", "Camden", "Barnet", "Enfield", "Barnet"],
+            "id": [1, 2, 3, 4, 5, 6],
+        },
+        index=[10, 11, 12, 13, 14, 15],
+    )
+
+    partitions = _assert_matches_groupby(df, "LA")
+
+    # Rows keep their order within each partition and are indexed from 0
+    assert [(value, p["id"].tolist()) for value, p in partitions] == [
+        ("Barnet", [2, 4, 6]),
+        ("Camden", [3]),
+        ("Enfield", [1, 5]),
+    ]
+    for _, partition in partitions:
+        assert partition.index.tolist() == list(range(len(partition)))
+
+
+def test_iter_partitions_single():
+    df = pd.DataFrame({"LA": ["Barnet"] * 3, "id": [1, 2, 3]}, index=[5, 6, 7])
+
+    partitions = _assert_matches_groupby(df, "LA")
+
+    assert len(partitions) == 1
+    assert partitions[0][1].index.tolist() == [0, 1, 2]
+
+
+def test_iter_partitions_empty():
+    df = pd.DataFrame({"LA": pd.Series([], dtype=object), "id": []})
+
+    assert list(iter_partitions(df, "LA")) == []
+    assert list(df.groupby("LA")) == []
@@ -0,0 +1,90 @@
+from unittest import mock
+
+import pandas as pd
+import pytest
+from fs import open_fs
+
+from liiatools.school_census_pipeline import school_census_outputs
+from liiatools.tests.school_census.test_school_census_outputs import (  # noqa: F401
+    IDENTIFIER,
+    key_columns,
+    pupil,
+    tables,
+)
+from liiatools_pipeline.ops import school_census_org
+
+
+@pytest.fixture
+def session_folder(pupil, tables):
+    addresses, fsm, sen, sessions = tables
+    exclusions = pupil[key_columns(IDENTIFIER)].iloc[[1]].assign(category="FIXD")
+
+    session_folder = open_fs("mem://")
+    for name, df in {
+        "pupilonroll": pupil,
+        "addressesonroll": addresses,
+        "fsmperiodsonroll": fsm,
+        "senneeds": sen,
+        "termlysessiondetailsonroll": sessions,
+        "termlyexclusionsonroll": exclusions,
+    }.items():
+        session_folder.writetext(f"school_census_{name}.csv", df.to_csv(index=False))
+    return session_folder
+
+
+def _open_onroll_intermediates(session_folder, workspace):
+    """
+    Runs open_onroll_intermediates on the workspace and returns the tables and whether they were built rather than
+    read from the cache
+    """
+    with mock.patch.multiple(
+        school_census_org,
+        workspace_folder=lambda: workspace,
+        create_onroll_intermediates=mock.Mock(
+            wraps=school_census_outputs.create_onroll_intermediates
+        ),
+        log=mock.Mock(),
+    ):
+        intermediates = school_census_org.open_onroll_intermediates(
+            session_folder, session_folder.listdir("/")
+        )
+        return intermediates, school_census_org.create_onroll_intermediates.called
+
+
+def _assert_containers_equal(actual, expected):
+    assert list(actual) == list(expected)
+    for table_name in expected:
+        pd.testing.assert_frame_equal(actual[table_name], expected[table_name])
+
+
+def test_onroll_intermediates_cache(session_folder):
+    workspace = open_fs("mem://")
+
+    built, was_built = _open_onroll_intermediates(session_folder, workspace)
+    assert was_built
+    assert list(built) == ["pupil", "demographics", "termly_sessions", "exclusions"]
+    assert len(workspace.listdir("cache/school_census/onroll")) == 1
+
+    cached, was_built = _open_onroll_intermediates(session_folder, workspace)
+    assert not was_built
+    _assert_containers_equal(cached, built)
+
+
+def test_onroll_intermediates_rebuilt_when_files_change(session_folder, pupil):
+    workspace = open_fs("mem://")
+    _open_onroll_intermediates(session_folder, workspace)
+    (first_key,) = workspace.listdir("cache/school_census/onroll")
+
+    session_folder.writetext(
+        "school_census_pupilonroll.csv",
+        pupil.assign(termlysessionspossible=[50, 60, 70]).to_csv(index=False),
+    )
+    rebuilt, was_built = _open_onroll_intermediates(session_folder, workspace)
+
+    assert was_built
+    assert rebuilt["pupil"]["termlysessionspossible"].tolist() == [50, 60, 70]
+    assert workspace.listdir("cache/school_census/onroll") != [first_key]
+
+    cached, was_built = _open_onroll_intermediates(session_folder, workspace)
+    assert not was_built
+    _assert_containers_equal(cached, rebuilt)
@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from liiatools.school_census_pipeline.school_census_outputs import (
+    CENSUS_KEY,
+    add_census_key,
+    add_child_home_gias,
+    create_demographics_output,
+    create_onroll_intermediates,
+    create_sessions_output,
+    key_columns,
+)
+
+IDENTIFIER = "pupilonrolltableid"
+
+
+@pytest.fixture
+def pupil():
+    return pd.DataFrame(
+        {
+            IDENTIFIER: [1, 2, 3],
+            "NativeId": ["302123", "303456", None],
+            "Year": [2025, 2025, 2025],
+            "Term": "Spring",
+            "LA": ["Barnet", "Bexley", "Bexley"],
+            "Acad/LA": "LA",
+            "termlysessionspossible": [100, 90, 80],
+        }
+    )
+
+
+@pytest.fixture
+def tables(pupil):
+    keys = pupil[key_columns(IDENTIFIER)]
+    addresses = keys.assign(child_home_la=["E1", "E2", "E2"])
+    fsm = keys.iloc[[0, 1]].assign(fsmenddate=[None, "2025-01-01"])
+    sen = pd.concat(
+        [
+            keys.iloc[[0]].assign(sentyperank=1, sentype="SLD"),
+            keys.iloc[[0]].assign(sentyperank=2, sentype="MLD"),
+            keys.iloc[[2]].assign(sentyperank=1, sentype="ASD"),
+        ],
+        ignore_index=True,
+    )
+    sessions = pd.concat(
+        [
+            keys.iloc[[0, 2]].assign(attendancereason="I", sessions=[2, 4]),
+            keys.iloc[[2]].assign(attendancereason=None, sessions=[1]),
+        ],
+        ignore_index=True,
+    )
+    return addresses, fsm, sen, sessions
+
+
+def test_create_demographics_output(pupil, tables):
+    addresses, fsm, sen, _ = tables
+
+    demographics = create_demographics_output(pupil, IDENTIFIER, addresses, fsm, sen)
+
+    assert CENSUS_KEY not in demographics
+    assert list(demographics.columns) == list(pupil.columns) + [
+        "child_home_la",
+        "fsmenddate",
+        "sentype1",
+        "sentype2",
+    ]
+    assert demographics["child_home_la"].tolist() == ["E1", "E2", "E2"]
+    assert demographics["fsmenddate"].isna().tolist() == [True, True, True]
+    assert demographics["sentype1"].tolist() == ["SLD", np.nan, "ASD"]
+    assert demographics["sentype2"].tolist() == ["MLD", np.nan, np.nan]
+
+
+def test_create_sessions_output(pupil, tables):
+    sessions = create_sessions_output(
+        pupil, IDENTIFIER, "termlysessionspossible", tables[3]
+    )
+
+    assert list(sessions.columns) == list(pupil.columns) + [
+        "attendancereason BLANK",
+        "attendancereason I",
+    ]
+    np.testing.assert_equal(sessions["attendancereason I"].tolist(), [2.0, np.nan, 4.0])
+    np.testing.assert_equal(
+        sessions["attendancereason BLANK"].tolist(), [np.nan, np.nan, 1.0]
+    )
+
+
+def test_outputs_with_census_key(pupil, tables):
+    addresses, fsm, sen, sessions = tables
+    expected_demographics = create_demographics_output(
+        pupil, IDENTIFIER, addresses, fsm, sen
+    )
+    expected_sessions = create_sessions_output(
+        expected_demographics, IDENTIFIER, "termlysessionspossible", sessions
+    )
+
+    keyed = add_census_key([pupil, addresses, None, fsm, sen, sessions], IDENTIFIER)
+    pupil, addresses, missing, fsm, sen, sessions = keyed
+    assert missing is None
+    assert pupil[CENSUS_KEY].dtype == np.int64
+    assert addresses[CENSUS_KEY].tolist() == pupil[CENSUS_KEY].tolist()
+
+    # Tables which are all keyed are joined on the key, which is kept in the output
+    demographics = create_demographics_output(pupil, IDENTIFIER, addresses, fsm, sen)
+    sessions = create_sessions_output(
+        demographics, IDENTIFIER, "termlysessionspossible", sessions
+    )
+
+    pd.testing.assert_frame_equal(
+        demographics.drop(columns=CENSUS_KEY), expected_demographics
+    )
+    pd.testing.assert_frame_equal(sessions.drop(columns=CENSUS_KEY), expected_sessions)
+
+
+def test_onroll_intermediates(pupil, tables):
+    addresses, fsm, sen, sessions = tables
+    exclusions = pupil[key_columns(IDENTIFIER)].iloc[[1]].assign(category="FIXD")
+
+    intermediates = create_onroll_intermediates(
+        pupil, addresses, fsm, sen, sessions, None, exclusions
+    )
+    assert list(intermediates) == [
+        "pupil",
+        "demographics",
+        "termly_sessions",
+        "exclusions",
+    ]
+    assert intermediates["exclusions"][CENSUS_KEY].tolist() == [
+        intermediates["pupil"][CENSUS_KEY][1]
+    ]
+
+    # The REGION outputs have no GIAS code
+    demographics = intermediates["demographics"]
+    pd.testing.assert_frame_equal(
+        demographics.drop(columns=["child_home_GIAS", CENSUS_KEY]),
+        create_demographics_output(pupil, IDENTIFIER, addresses, fsm, sen),
+    )
+    pd.testing.assert_frame_equal(
+        intermediates["pupil"]
+        .merge(intermediates["termly_sessions"], on=CENSUS_KEY, how="left")
+        .drop(columns=CENSUS_KEY),
+        create_sessions_output(pupil, IDENTIFIER, "termlysessionspossible", sessions),
+    )
+
+    # The CROSS outputs have the GIAS code of the home LA in place of joining it to the addresses, and only keep
+    # children who have one
+    gias_lookup = pd.DataFrame({"GIAS code": [302], "ctyua25cd": ["E1"]})
+    expected = create_demographics_output(
+        pupil,
+        IDENTIFIER,
+        addresses.merge(gias_lookup, left_on="child_home_la", right_on="ctyua25cd")
+        .rename(columns={"GIAS code": "child_home_GIAS"})
+        .drop(columns="ctyua25cd"),
+        fsm,
+        sen,
+    )
+    actual = add_child_home_gias(demographics, gias_lookup).drop(columns=CENSUS_KEY)
+    assert list(actual.columns) == list(expected.columns)
+    assert actual["child_home_GIAS"].tolist()[0] == 302
+    pd.testing.assert_frame_equal(
+        actual[actual["child_home_GIAS"].notna()],
+        expected[expected["child_home_GIAS"].notna()],
+    )
@@ -47,7 +47,9 @@ def deduplicate_pan(
     config: CleanConfig,
 ):
     log.info("Creating PAN Data Frames...")
-    pan = DataframeAggregator(session_folder, pipeline_config(config), config.dataset)
+    pan = DataframeAggregator(
+        session_folder, pipeline_config(config), config.dataset, config.max_workers
+    )
 
     log.info("Deduplicating PAN Data Frames...")
     pan_data = pan.current(deduplicate=True)
@@ -1,11 +1,22 @@
 from dagster import Config
 
+from liiatools.common.archive import DEFAULT_MAX_WORKERS
+
 
 class CleanConfig(Config):
     dataset_folder: str | None
     la_folder: str | None
     input_la_code: str | None
     dataset: str | None
+    max_workers: int = DEFAULT_MAX_WORKERS
+
+
+class FixEpisodesConfig(Config):
+    max_workers: int = DEFAULT_MAX_WORKERS
+
+
+class SufficiencyConfig(Config):
+    incremental: bool = False
 
 
 class ReportsConfig(Config):
@@ -20,12 +20,13 @@ from liiatools.cin_census_pipeline.stream_pipeline import (
 )
 from liiatools.common import pipeline as pl
 from liiatools.common.archive import DataframeArchive
+from liiatools.common.cache import ProcessedFileCache
 from liiatools.common.checks import check_year_within_range
-from liiatools.common.constants import SessionNames
-from liiatools.common.data import ErrorContainer, FileLocator
+from liiatools.common.constants import ProcessNames, SessionNames
+from liiatools.common.data import DataContainer, ErrorContainer, FileLocator
 from liiatools.common.reference import authorities
 from liiatools.common.stream_errors import StreamError
-from liiatools.common.transform import degrade_data, enrich_data, prepare_export
+from liiatools.common.transform import ExportPlan, external_data_hashes
 from liiatools.pnw_census_pipeline.spec import load_schema as load_schema_pnw_census
 from liiatools.pnw_census_pipeline.stream_pipeline import (
     task_cleanfile as task_cleanfile_pnw_census,
@@ -65,7 +66,7 @@ def create_session_folder(config: CleanConfig) -> Tuple[FS, str, List[FileLocato
     )
     log.info(f"Session folder id: {session_id}")
     incoming_files = pl.move_files_for_processing(
-        open_fs(config.dataset_folder), session_folder
+        open_fs(config.dataset_folder), session_folder, max_workers=config.max_workers
     )
 
     return session_folder, session_id, incoming_files
@@ -77,7 +78,9 @@ def create_session_folder(config: CleanConfig) -> Tuple[FS, str, List[FileLocato
 def open_current(config: CleanConfig) -> DataframeArchive:
     log.info("Opening Current folder...")
     current_folder = workspace_folder().makedirs("current", recreate=True)
-    current = DataframeArchive(current_folder, pipeline_config(config), config.dataset)
+    current = DataframeArchive(
+        current_folder, pipeline_config(config), config.dataset, config.max_workers
+    )
     return current
 
 
@@ -120,6 +123,17 @@ def process_files(
         )
     else:
         log.info(f"{la_name} is signed for {config.dataset} data processing.")
+        # Each LA's files are processed together, so the LA's entries which this run does not use are removed
+        cache = ProcessedFileCache(
+            workspace_folder().makedirs(ProcessNames.CACHE_FOLDER, recreate=True),
+            f"{config.dataset}/{config.input_la_code}",
+        )
+        cache_keys = set()
+        cache_hits = 0
+        cache_misses = 0
+        external_hashes = external_data_hashes(output_config)
+        degrade_flag = all(output_config.degrade_at_clean.values())
+        export_plan = ExportPlan(output_config, la_profiles, degrade=degrade_flag)
 
         for file_locator in incoming_files:
             log.info(f"Processing file {la_name} {basename(file_locator.name)}")
@@ -268,100 +282,103 @@ def process_files(
                 school_type=school_type,
             )
 
-            try:
-                cleanfile_result = (
-                    globals()[f"task_cleanfile_{config.dataset}"](
-                        file_locator, schema, output_config, logger=log
-                    )
-                    if config.dataset in ["cin", "cans"]
-                    else globals()[f"task_cleanfile_{config.dataset}"](
-                        file_locator, schema, logger=log
-                    )
+            cache_key = cache.key(
+                file_locator.meta["sha256"],
+                schema,
+                output_config,
+                metadata,
+                external_hashes,
+            )
+            cache_keys.add(cache_key)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                cache_hits += 1
+                stages, file_errors = cached
+                log.info(
+                    f"Restored cached results for {la_name} {basename(file_locator.name)}"
                 )
-            except StreamError as e:
-                error_report.append(
-                    dict(
-                        type="StreamError",
-                        message=str(e),
-                        filename=file_locator.name,
-                        uuid=uuid,
+            else:
+                cache_misses += 1
+                stages = {}
+                file_errors = ErrorContainer()
+
+                try:
+                    cleanfile_result = (
+                        globals()[f"task_cleanfile_{config.dataset}"](
+                            file_locator, schema, output_config, logger=log
+                        )
+                        if config.dataset in ["cin", "cans"]
+                        else globals()[f"task_cleanfile_{config.dataset}"](
+                            file_locator, schema, logger=log
+                        )
                     )
+                except StreamError as e:
+                    error_report.append(
+                        dict(
+                            type="StreamError",
+                            message=str(e),
+                            filename=file_locator.name,
+                            uuid=uuid,
+                        )
+                    )
+                    continue
+                log.info(
+                    f"Cleanfile task completed for {la_name} {basename(str(file_locator.name))}"
                 )
-                continue
-            log.info(
-                f"Cleanfile task completed for {la_name} {basename(str(file_locator.name))}"
-            )
-
-            cleanfile_result.data = prepare_export(
-                cleanfile_result.data, output_config, la_profiles
-            )
-
-            cleanfile_result.data.export(
-                session_folder.opendir(SessionNames.CLEANED_FOLDER),
-                file_locator.meta["uuid"] + "_",
-                "parquet",
-            )
-            error_report.extend(cleanfile_result.errors)
-
-            log.info(f"Cleanfile exported for {la_name} {basename(file_locator.name)}")
-
-            enrich_result = enrich_data(cleanfile_result.data, output_config, metadata)
-            enrich_result.data.export(
-                session_folder.opendir(SessionNames.ENRICHED_FOLDER),
-                file_locator.meta["uuid"] + "_",
-                "parquet",
-            )
-            error_report.extend(enrich_result.errors)
-
-            log.info(f"Enrichfile exported for {la_name} {basename(file_locator.name)}")
 
-            # Evaluate whether degrade step should occur
-            degrade_flag = all(output_config.degrade_at_clean.values())
-            if degrade_flag:
-                degraded_result = degrade_data(
-                    enrich_result.data, output_config, metadata
+                export_result = export_plan.run(cleanfile_result.data, metadata)
+                stages[SessionNames.CLEANED_FOLDER] = export_result.cleaned
+                stages[SessionNames.ENRICHED_FOLDER] = export_result.enriched
+                if degrade_flag:
+                    stages[SessionNames.DEGRADED_FOLDER] = export_result.degraded
+                file_errors.extend(cleanfile_result.errors)
+                file_errors.extend(export_result.errors)
+
+                # Deduplicate a shallow copy so the cleaned tables are kept as exported
+                file_errors.extend(
+                    current.deduplicate(DataContainer(export_result.cleaned)).errors
                 )
-                degraded_result.data.export(
-                    session_folder.opendir(SessionNames.DEGRADED_FOLDER),
+                cache.put(cache_key, stages, file_errors)
+
+            for stage, stage_data in stages.items():
+                stage_data.export(
+                    session_folder.opendir(stage),
                     file_locator.meta["uuid"] + "_",
                     "parquet",
                 )
-                error_report.extend(degraded_result.errors)
-                current.add(
-                    degraded_result.data,
-                    config.input_la_code,
-                    year,
-                    month,
-                    term,
-                    school_type,
-                    identifier,
-                )
-
                 log.info(
-                    f"Degraded file exported for {la_name} {basename(file_locator.name)}"
+                    f"{stage.capitalize()} file exported for {la_name} {basename(file_locator.name)}"
                 )
+
+            if degrade_flag:
+                current_data = stages[SessionNames.DEGRADED_FOLDER]
             else:
                 log.info(
                     f"Skipping degrade step for {la_name} {basename(file_locator.name)}"
                 )
-                current.add(
-                    enrich_result.data,
-                    config.input_la_code,
-                    year,
-                    month,
-                    term,
-                    school_type,
-                    identifier,
-                )
-
-            error_report.extend(current.deduplicate(cleanfile_result.data).errors)
+                current_data = stages[SessionNames.ENRICHED_FOLDER]
+            current.add(
+                current_data,
+                config.input_la_code,
+                year,
+                month,
+                term,
+                school_type,
+                identifier,
+            )
 
+            error_report.extend(file_errors)
             error_report.set_property("filename", file_locator.name)
             error_report.set_property("uuid", uuid)
             log.info(
                 f"Finished processing {la_name} {basename(file_locator.name)} errors"
             )
 
+        cache_removed = cache.prune(cache_keys)
+        log.info(
+            f"Processed {la_name} {config.dataset} files with {cache_hits} cache hits and {cache_misses} cache misses, removing {cache_removed} unused cache entries"
+        )
+
     log.info(f"Writing error report for {config.input_la_code} {config.dataset}")
     error_report.set_property("session_id", session_id)
     error_report_name = (
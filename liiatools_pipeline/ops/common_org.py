@@ -2,10 +2,10 @@ from dagster import In, Out, get_dagster_logger, op
 from fs.base import FS
 
 from liiatools.common import pipeline as pl
-from liiatools.common.aggregate import DataframeAggregator
+from liiatools.common.aggregate import DataframeAggregator, RetentionFilter
 from liiatools.common.constants import SessionNamesOrg
 from liiatools.common.reference import authorities
-from liiatools.common.transform import apply_retention, prepare_export, degrade_data
+from liiatools.common.transform import ReportPlan
 from liiatools_pipeline.assets.common import (
     incoming_folder,
     pipeline_config,
@@ -110,33 +110,29 @@ def create_reports(
     )
     log.info("Aggregating Data Frames...")
     output_config = pipeline_config(config)
+    retention_filter = RetentionFilter.for_profiles(
+        output_config,
+        output_config.retention_period.keys(),
+        year_column=output_config.retention_columns["year_column"],
+        la_column=output_config.retention_columns["la_column"],
+    )
     aggregate = DataframeAggregator(
-        session_folder, output_config, config.dataset
+        session_folder,
+        output_config,
+        config.dataset,
+        config.max_workers,
+        retention_filter=retention_filter,
     )
     aggregate_data = aggregate.current()
     log.debug(f"Using config: {config}")
-    for report in output_config.retention_period.keys():
+    report_plan = ReportPlan(
+        output_config,
+        year_column=output_config.retention_columns["year_column"],
+        la_column=output_config.retention_columns["la_column"],
+    )
+    for report, report_data in report_plan.reports(aggregate_data):
         log.info(f"Processing report {report}...")
         report_folder = export_folder.makedirs(report, recreate=True)
-        
-        # Evaluate whether to degrade report contents
-        degrade_flag = any(not v for v in output_config.degrade_at_clean.values()) and output_config.degrade_at_clean[report]
-        if degrade_flag:
-            log.info(f"Degrading report {report}...")
-            degraded_data = degrade_data(aggregate_data, output_config)
-            aggregate_data = degraded_data.data
-
-        report_data = prepare_export(
-            aggregate_data, output_config, profile=report
-        )
-        log.info(f"Applying retention to {report}...")
-        report_data = apply_retention(
-            report_data,
-            output_config,
-            profile=report,
-            year_column=output_config.retention_columns["year_column"],
-            la_column=output_config.retention_columns["la_column"],
-        )
 
         existing_report_files = report_folder.listdir("/")
         pl.remove_files(f"{config.dataset}", existing_report_files, report_folder)
@@ -12,16 +12,7 @@ from liiatools.common import pipeline as pl
 from liiatools.common.constants import SessionNamesPNWCensusJoins
 from liiatools.common.data import DataContainer
 from liiatools.common.pipeline import open_file
-from liiatools.pnw_census_pipeline.pnw_dataset_join import (
-    add_missing_cans_columns,
-    join_cans_data,
-    join_episode_data,
-    join_header_data,
-    join_missing_data,
-    join_oc2_data,
-    join_onspd_data,
-    join_uasc_data,
-)
+from liiatools.pnw_census_pipeline.join_plan import PNWJoinPlan
 from liiatools_pipeline.assets.common import shared_folder, workspace_folder
 from liiatools_pipeline.assets.external_dataset import external_data_folder
 
@@ -119,17 +110,21 @@ def joins_pnw_census(
         pnw_census[["Year", "Month"]].assign(day=1)
     ) + MonthEnd(0)
 
+    # Each join is looked up against the census rows and the joined frame is assembled once
+    # all of the available datasets have been added
+    plan = PNWJoinPlan(pnw_census)
+
     # Check and process each SSDA903 file type
     if any(episodes_pattern.search(f) for f in files):
         log.info("Joining SSDA903 episode data with PNW Census data")
         episodes_file = next(f for f in files if episodes_pattern.search(f))
         episodes = open_file(session_folder, episodes_file)
-        pnw_census = join_episode_data(episodes, pnw_census)
+        plan.join_episode_data(episodes)
         try:
             ext_folder = external_data_folder()
             postcode = open_file(ext_folder, "ONSPD_reduced_to_postcode_sector.csv")
             log.info("ONSPD file found")
-            pnw_census = join_onspd_data(postcode, pnw_census)
+            plan.join_onspd_data(postcode)
         except errors.ResourceNotFound as err:
             log.error(f"No ONSPD postcode file to open: {err}")
             empty_ONSPD_cols = [
@@ -139,8 +134,7 @@ def joins_pnw_census(
                 "Placement northings",
                 "Placement LA code",
             ]
-            for col in empty_ONSPD_cols:
-                pnw_census[col] = None
+            plan.assign({col: None for col in empty_ONSPD_cols})
     else:
         log.error("No 903 episodes data to join")
         empty_episode_cols = [
@@ -155,36 +149,33 @@ def joins_pnw_census(
             "Placement northings",
             "Placement LA code",
         ]
-        for col in empty_episode_cols:
-            pnw_census[col] = None
+        plan.assign({col: None for col in empty_episode_cols})
 
     if any(header_pattern.search(f) for f in files):
         log.info("Joining SSDA903 header data with PNW Census data")
         header_file = next(f for f in files if header_pattern.search(f))
         header = open_file(session_folder, header_file)
-        pnw_census = join_header_data(header, pnw_census)
+        plan.join_header_data(header)
     else:
         log.error("No 903 header data to join")
         empty_header_cols = ["Gender 903", "Ethnicity 903"]
-        for col in empty_header_cols:
-            pnw_census[col] = None
+        plan.assign({col: None for col in empty_header_cols})
 
     if any(uasc_pattern.search(f) for f in files):
         log.info("Joining SSDA903 UASC data with PNW Census data")
         uasc_file = next(f for f in files if uasc_pattern.search(f))
         uasc = open_file(session_folder, uasc_file)
-        pnw_census = join_uasc_data(uasc, pnw_census)
+        plan.join_uasc_data(uasc)
     else:
         log.error("No 903 uasc data to join")
         empty_uasc_cols = ["UASC 903"]
-        for col in empty_uasc_cols:
-            pnw_census[col] = None
+        plan.assign({col: None for col in empty_uasc_cols})
 
     if any(oc2_pattern.search(f) for f in files):
         log.info("Joining SSDA903 OC2 data with PNW Census data")
         oc2_file = next(f for f in files if oc2_pattern.search(f))
         oc2 = open_file(session_folder, oc2_file)
-        pnw_census = join_oc2_data(oc2, pnw_census)
+        plan.join_oc2_data(oc2)
     else:
         log.error("No 903 oc2 data to join")
         empty_oc2_cols = [
@@ -193,19 +184,17 @@ def joins_pnw_census(
             "Child received intervention for substance misuse problem",
             "Child offered intervention for substance misuse problem",
         ]
-        for col in empty_oc2_cols:
-            pnw_census[col] = None
+        plan.assign({col: None for col in empty_oc2_cols})
 
     if any(missing_pattern.search(f) for f in files):
         log.info("Joining SSDA903 missing data with PNW Census data")
         missing_file = next(f for f in files if missing_pattern.search(f))
         missing = open_file(session_folder, missing_file)
-        pnw_census = join_missing_data(missing, pnw_census)
+        plan.join_missing_data(missing)
     else:
         log.error("No 903 missing data to join")
         empty_missing_cols = ["# missing episodes in last 12 months"]
-        for col in empty_missing_cols:
-            pnw_census[col] = None
+        plan.assign({col: None for col in empty_missing_cols})
 
     # Load CANS summary sheet column order, use 6 -21 as it has superset of columns
     cans_columns = ["Assessment Date"] + load_summary_sheet_column_order()["6_21"]
@@ -229,14 +218,14 @@ def joins_pnw_census(
                 cans_data = pd.concat([child_cans, youth_cans], ignore_index=True)
             else:
                 cans_data = child_cans if child_cans is not None else youth_cans
-            pnw_census = join_cans_data(cans_data, pnw_census, cans_columns)
+            plan.join_cans_data(cans_data, cans_columns)
 
         else:
             log.error("No CANS data to join")
-            pnw_census = add_missing_cans_columns(pnw_census, cans_columns)
+            plan.add_missing_cans_columns(cans_columns)
 
     # Drop snapshot date field
-    pnw_census = pnw_census.drop(columns="snapshot_date")
+    pnw_census = plan.result().drop(columns="snapshot_date")
 
     # Export PNW file
     pnw_dc = DataContainer({"ENRICHED_pnw_census_pnw_census": pnw_census})
@@ -1,17 +1,28 @@
 import re
-from typing import List
+from typing import Iterator, List, Tuple
 
+import numpy as np
 import pandas as pd
 from dagster import In, Out, get_dagster_logger, op
 from fs import errors
 from fs.base import FS
 
 from liiatools.common import pipeline as pl
-from liiatools.common.constants import SessionNamesSCCross, SessionNamesSCRegion
+from liiatools.common.cache import ExternalDataCache
+from liiatools.common.constants import (
+    ProcessNames,
+    SessionNamesSCCross,
+    SessionNamesSCRegion,
+)
 from liiatools.common.data import DataContainer
 from liiatools.common.pipeline import open_file
 from liiatools.school_census_pipeline.school_census_outputs import (
+    CENSUS_KEY,
+    INTERMEDIATES_VERSION,
+    add_census_key,
+    add_child_home_gias,
     create_demographics_output,
+    create_onroll_intermediates,
     create_sessions_output,
 )
 from liiatools_pipeline.assets.common import shared_folder, workspace_folder
@@ -46,6 +57,120 @@ def open_and_concat_patterns(
     raise ValueError("No files matched the patterns provided")
 
 
+def iter_partitions(
+    df: pd.DataFrame, column: str
+) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Yields each value of a column with the rows that have it, in the same order as groupby
+
+    The rows are sorted by the column once and each partition is sliced from the sorted rows as it is needed, so
+    only the partition being used is copied rather than every group at once.
+
+    :param df: Dataframe to partition, with no blanks in the column
+    :type df: pd.DataFrame
+    :param column: Name of the column to partition on
+    :type column: str
+    :return: The value and rows of each partition, with the rows indexed from 0
+    :rtype: Iterator[Tuple[str, pd.DataFrame]]
+    """
+    df = df.sort_values(column, kind="stable")
+    values = df[column].to_numpy()
+    starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+    for start, end in zip(
+        np.r_[0, starts].astype(int), np.r_[starts, len(df)].astype(int)
+    ):
+        if start < end:
+            yield values[start], df.iloc[start:end].reset_index(drop=True)
+
+
+# The files which the on roll intermediates are made from, where there may be one or two addresses and fsm files
+ADDRESSES_PATTERNS = [
+    re.compile(r"school_census_addresses\.csv$"),
+    re.compile(r"school_census_addressesonroll\.csv$"),
+]
+FSM_PATTERNS = [
+    re.compile(r"school_census_fsmperiod\.csv$"),
+    re.compile(r"school_census_fsmperiodsonroll\.csv$"),
+]
+ONROLL_FILES = [
+    "school_census_pupilonroll.csv",
+    "school_census_senneeds.csv",
+    "school_census_termlysessiondetailsonroll.csv",
+    "school_census_summerhalfterm2sessiondetailsonroll.csv",
+    "school_census_termlyexclusionsonroll.csv",
+]
+
+
+def open_onroll_intermediates(session_folder: FS, files: List[str]) -> DataContainer:
+    """
+    Opens the on roll pupil, demographics, sessions and exclusions tables shared by the CROSS and REGION outputs
+
+    The tables are made from the session's input files once and stored as parquet in the workspace cache, under a
+    key made from the hashes of the input files, so whichever of the CROSS and REGION jobs runs second on the same
+    files reads them from the cache. A session with different files has a different key, so the tables are rebuilt.
+    If the two jobs run at the same time, each may build the tables itself, as an entry that is being replaced
+    while it is read or written is treated as missing.
+
+    :param session_folder: session folder with all files in
+    :type session_folder: FS
+    :param files: List of filenames in the session folder
+    :type files: List[str]
+    :return: The tables from create_onroll_intermediates
+    :rtype: DataContainer
+    """
+    input_files = [
+        f
+        for f in files
+        if f in ONROLL_FILES
+        or any(pattern.search(f) for pattern in ADDRESSES_PATTERNS + FSM_PATTERNS)
+    ]
+    cache = ExternalDataCache(
+        workspace_folder().makedirs(
+            f"{ProcessNames.CACHE_FOLDER}/school_census", recreate=True
+        ),
+        "onroll",
+    )
+    key = cache.key(session_folder, input_files, INTERMEDIATES_VERSION)
+    cached = cache.get(key)
+    if cached is not None:
+        log.info(
+            "Using cached on roll tables as the School Census input files are unchanged"
+        )
+        return cached
+
+    log.info("Creating on roll tables from the School Census input files")
+    pupil = open_file(session_folder, "school_census_pupilonroll.csv")
+
+    addresses = open_and_concat_patterns(files, ADDRESSES_PATTERNS, session_folder)
+    addresses = addresses.drop(
+        columns=["addressesorderseqcolumn", "addressesonrollorderseqcolumn"],
+        errors="ignore",
+    )
+
+    fsm = open_and_concat_patterns(files, FSM_PATTERNS, session_folder)
+
+    # Open sen file if exists (only in spring)
+    sen = None
+    if "school_census_senneeds.csv" in files:
+        sen = open_file(session_folder, "school_census_senneeds.csv")
+
+    termly_sessions = open_file(
+        session_folder, "school_census_termlysessiondetailsonroll.csv"
+    )
+    summer_sessions = None
+    if "school_census_summerhalfterm2sessiondetailsonroll.csv" in files:
+        summer_sessions = open_file(
+            session_folder, "school_census_summerhalfterm2sessiondetailsonroll.csv"
+        )
+    exclusions = open_file(session_folder, "school_census_termlyexclusionsonroll.csv")
+
+    intermediates = create_onroll_intermediates(
+        pupil, addresses, fsm, sen, termly_sessions, summer_sessions, exclusions
+    )
+    cache.put(key, intermediates)
+    return intermediates
+
+
 @op(
     out={
         "session_folder": Out(FS),
@@ -124,43 +249,10 @@ def school_census_cross_outputs(
     # Create empty dict to store outputs
     outputs = {}
 
-    # Make demographics output
-    pupil = open_file(session_folder, "school_census_pupilonroll.csv")
-
-    # Open addresses files, where there may be one or two files to open
-    addresses_pattern = re.compile(r"school_census_addresses\.csv$")
-    addresses_onroll_pattern = re.compile(r"school_census_addressesonroll\.csv$")
-    addresses_patterns = [addresses_pattern, addresses_onroll_pattern]
-    addresses = open_and_concat_patterns(files, addresses_patterns, session_folder)
-    addresses = addresses.drop(
-        columns=["addressesorderseqcolumn", "addressesonrollorderseqcolumn"],
-        errors="ignore",
-    )
-
-    # Join GIAS code to addresses
-    addresses = addresses.merge(
-        right=GIAS_lookup[["GIAS code", "ctyua25cd"]],
-        left_on="child_home_la",
-        right_on="ctyua25cd",
-    )
-    addresses = addresses.rename(columns={"GIAS code": "child_home_GIAS"})
-    addresses = addresses.drop("ctyua25cd", axis=1)
-
-    # Open fsm files, where there may be one or two files to open
-    fsm_pattern = re.compile(r"school_census_fsmperiod\.csv$")
-    fsm_onroll_pattern = re.compile(r"school_census_fsmperiodsonroll\.csv$")
-    fsm_patterns = [fsm_pattern, fsm_onroll_pattern]
-    fsm = open_and_concat_patterns(files, fsm_patterns, session_folder)
-
-    # Open sen file if exists (only in spring)
-    sen = None
-    if "school_census_senneeds.csv" in files:
-        sen = open_file(session_folder, "school_census_senneeds.csv")
+    intermediates = open_onroll_intermediates(session_folder, files)
 
-    # Create demographics output
-    demographics = create_demographics_output(
-        pupil, "pupilonrolltableid", addresses, fsm, sen
-    )
+    # Create demographics output, with the GIAS code of each child's home LA
+    demographics = add_child_home_gias(intermediates["demographics"], GIAS_lookup)
     outputs["children"] = demographics
 
     # Create sessions outputs
@@ -175,20 +267,14 @@ def school_census_cross_outputs(
             "Year",
             "Term",
             "Acad/LA",
+            CENSUS_KEY,
         ]
     ].copy()
-    termly_sessions = open_file(
-        session_folder, "school_census_termlysessiondetailsonroll.csv"
-    )
-    termly_sessions = create_sessions_output(
-        pupil=pupil_termly_sessions,
-        identifier="pupilonrolltableid",
-        session_identifier="termlysessionspossible",
-        sessions=termly_sessions,
+    outputs["termly_attendance"] = pupil_termly_sessions.merge(
+        right=intermediates["termly_sessions"], on=CENSUS_KEY, how="left"
     )
-    outputs["termly_attendance"] = termly_sessions
 
-    if "school_census_summerhalfterm2sessiondetailsonroll.csv" in files:
+    if "summer_sessions" in intermediates:
         pupil_summer_sessions = demographics[
             [
                 "pupilonrolltableid",
@@ -199,41 +285,26 @@ def school_census_cross_outputs(
                 "Year",
                 "Term",
                 "Acad/LA",
+                CENSUS_KEY,
             ]
         ].copy()
-        summer_sessions = open_file(
-            session_folder, "school_census_summerhalfterm2sessiondetailsonroll.csv"
+        outputs["summer_attendance"] = pupil_summer_sessions.merge(
+            right=intermediates["summer_sessions"], on=CENSUS_KEY, how="left"
         )
-        summer_sessions = create_sessions_output(
-            pupil=pupil_summer_sessions,
-            identifier="pupilonrolltableid",
-            session_identifier="summerhalfterm2sessionspossible",
-            sessions=summer_sessions,
-        )
-        outputs["summer_attendance"] = summer_sessions
 
     # Create exclusions output
-    exclusions = open_file(session_folder, "school_census_termlyexclusionsonroll.csv")
-    exclusions = exclusions.merge(
-        right=demographics[
-            [
-                "pupilonrolltableid",
-                "NativeId",
-                "child_home_GIAS",
-                "LA",
-                "Year",
-                "Term",
-                "Acad/LA",
-            ]
-        ].copy(),
-        on=["pupilonrolltableid", "NativeId", "LA", "Year", "Term", "Acad/LA"],
+    exclusions = intermediates["exclusions"].merge(
+        right=demographics[[CENSUS_KEY, "child_home_GIAS"]],
+        on=CENSUS_KEY,
     )
     outputs["exclusions"] = exclusions
 
     # Filter each output table into a separate table for each child_home_GIAS, only keeping rows where child_home_GIAS <> first three digits of NativeID
-    final_output_dict = {}
+    log.info("Writing School Census CROSS outputs to shared folder")
 
     for key, df in outputs.items():
+        df = df.drop(columns=CENSUS_KEY)
+
         # Filter the dfs to rows with different GIAS codes
         df = df[df["child_home_GIAS"].notna()]
         df = df[df["NativeId"].notna()]
@@ -245,19 +316,13 @@ def school_census_cross_outputs(
         after_count = len(filtered)
         log.info(f"{key} rows removed: {before_count - after_count}")
 
-        # Group into separate outputs for each child_home_GIAS
-        groups = list(filtered.groupby("child_home_GIAS"))
-        num_groups = len(groups)
+        # Write a separate output for each child_home_GIAS as soon as it is sliced
+        num_groups = filtered["child_home_GIAS"].nunique()
         log.info(f"{key} number of outputs created: {num_groups}")
 
-        for group_value, output in groups:
+        for group_value, output in iter_partitions(filtered, "child_home_GIAS"):
             name = f"CROSS_{group_value}_{key}"
-            final_output_dict[name] = output.reset_index(drop=True)
-
-    # Export outputs
-    cross_dc = DataContainer(final_output_dict)
-    log.info("Writing School Census CROSS outputs to shared folder")
-    cross_dc.export(output_folder, "", "csv")
+            DataContainer({name: output}).export(output_folder, "", "csv")
 
 
 @op(
@@ -329,34 +394,11 @@ def school_census_region_outputs(
     outputs = {}
 
     # On roll tables
-    # Make demographics output
-    pupil_on = open_file(session_folder, "school_census_pupilonroll.csv")
-
-    # Open addresses files, where there may be one or two files to open
-    addresses_pattern = re.compile(r"school_census_addresses\.csv$")
-    addresses_onroll_pattern = re.compile(r"school_census_addressesonroll\.csv$")
-    addresses_patterns = [addresses_pattern, addresses_onroll_pattern]
-    addresses_on = open_and_concat_patterns(files, addresses_patterns, session_folder)
-    addresses_on = addresses_on.drop(
-        columns=["addressesorderseqcolumn", "addressesonrollorderseqcolumn"],
-        errors="ignore",
-    )
-
-    # Open fsm files, where there may be one or two files to open
-    fsm_pattern = re.compile(r"school_census_fsmperiod\.csv$")
-    fsm_onroll_pattern = re.compile(r"school_census_fsmperiodsonroll\.csv$")
-    fsm_patterns = [fsm_pattern, fsm_onroll_pattern]
-    fsm_on = open_and_concat_patterns(files, fsm_patterns, session_folder)
+    intermediates = open_onroll_intermediates(session_folder, files)
+    pupil_on = intermediates["pupil"]
 
-    # Open sen file if exists (only in spring)
-    sen_on = None
-    if "school_census_senneeds.csv" in files:
-        sen_on = open_file(session_folder, "school_census_senneeds.csv")
-
-    # Create demographics output
-    demographics_on = create_demographics_output(
-        pupil_on, "pupilonrolltableid", addresses_on, fsm_on, sen_on
-    )
+    # Create demographics output, which has no GIAS code
+    demographics_on = intermediates["demographics"].drop(columns="child_home_GIAS")
     outputs["REGION_OUTPUT_onroll_children"] = demographics_on
 
     # Create sessions outputs
@@ -369,20 +411,14 @@ def school_census_region_outputs(
             "Year",
             "Term",
             "Acad/LA",
+            CENSUS_KEY,
         ]
     ].copy()
-    termly_sessions_on = open_file(
-        session_folder, "school_census_termlysessiondetailsonroll.csv"
+    outputs["REGION_OUTPUT_onroll_termly_attendance"] = pupil_on_termly_sessions.merge(
+        right=intermediates["termly_sessions"], on=CENSUS_KEY, how="left"
     )
-    termly_sessions_on = create_sessions_output(
-        pupil=pupil_on_termly_sessions,
-        identifier="pupilonrolltableid",
-        session_identifier="termlysessionspossible",
-        sessions=termly_sessions_on,
-    )
-    outputs["REGION_OUTPUT_onroll_termly_attendance"] = termly_sessions_on
 
-    if "school_census_summerhalfterm2sessiondetailsonroll.csv" in files:
+    if "summer_sessions" in intermediates:
         pupil_on_summer_sessions = pupil_on[
             [
                 "pupilonrolltableid",
@@ -392,24 +428,17 @@ def school_census_region_outputs(
                 "Year",
                 "Term",
                 "Acad/LA",
+                CENSUS_KEY,
             ]
         ].copy()
-        summer_sessions_on = open_file(
-            session_folder, "school_census_summerhalfterm2sessiondetailsonroll.csv"
+        outputs[
+            "REGION_OUTPUT_onroll_summer_attendance"
+        ] = pupil_on_summer_sessions.merge(
+            right=intermediates["summer_sessions"], on=CENSUS_KEY, how="left"
         )
-        summer_sessions_on = create_sessions_output(
-            pupil=pupil_on_summer_sessions,
-            identifier="pupilonrolltableid",
-            session_identifier="summerhalfterm2sessionspossible",
-            sessions=summer_sessions_on,
-        )
-        outputs["REGION_OUTPUT_onroll_summer_attendance"] = summer_sessions_on
 
     # Create exclusions output
-    exclusions_on = open_file(
-        session_folder, "school_census_termlyexclusionsonroll.csv"
-    )
-    outputs["REGION_OUTPUT_onroll_exclusions"] = exclusions_on
+    outputs["REGION_OUTPUT_onroll_exclusions"] = intermediates["exclusions"]
 
     # Off roll tables
     # Make demographics output
@@ -424,6 +453,26 @@ def school_census_region_outputs(
         fsm_off = None
         sen_off = None
 
+        termly_sessions_off = open_file(
+            session_folder, "school_census_termlysessiondetailsoffroll.csv"
+        )
+        summer_sessions_off = None
+        if "school_census_summerhalfterm2sessiondetailsoffroll.csv" in files:
+            summer_sessions_off = open_file(
+                session_folder, "school_census_summerhalfterm2sessiondetailsoffroll.csv"
+            )
+
+        # Key every table once so the joins below are on a single integer column
+        (
+            pupil_off,
+            addresses_off,
+            termly_sessions_off,
+            summer_sessions_off,
+        ) = add_census_key(
+            [pupil_off, addresses_off, termly_sessions_off, summer_sessions_off],
+            "pupilnolongeronrolltableid",
+        )
+
         # Create demographics output if addresses exists
         if addresses_off is not None:
             demographics_off = create_demographics_output(
@@ -443,11 +492,9 @@ def school_census_region_outputs(
                 "Year",
                 "Term",
                 "Acad/LA",
+                CENSUS_KEY,
             ]
         ].copy()
-        termly_sessions_off = open_file(
-            session_folder, "school_census_termlysessiondetailsoffroll.csv"
-        )
         termly_sessions_off = create_sessions_output(
             pupil=pupil_off_termly_sessions,
             identifier="pupilnolongeronrolltableid",
@@ -456,7 +503,7 @@ def school_census_region_outputs(
         )
         outputs["REGION_OUTPUT_offroll_termly_attendance"] = termly_sessions_off
 
-        if "school_census_summerhalfterm2sessiondetailsoffroll.csv" in files:
+        if summer_sessions_off is not None:
             pupil_off_summer_sessions = pupil_off[
                 [
                     "pupilnolongeronrolltableid",
@@ -466,11 +513,9 @@ def school_census_region_outputs(
                     "Year",
                     "Term",
                     "Acad/LA",
+                    CENSUS_KEY,
                 ]
             ].copy()
-            summer_sessions_off = open_file(
-                session_folder, "school_census_summerhalfterm2sessiondetailsoffroll.csv"
-            )
             summer_sessions_off = create_sessions_output(
                 pupil=pupil_off_summer_sessions,
                 identifier="pupilnolongeronrolltableid",
@@ -488,7 +533,12 @@ def school_census_region_outputs(
     else:
         log.info("No pupilnolongeronroll file found; skipping off roll outputs")
 
-    # Export outputs
-    region_dc = DataContainer(outputs)
+    # Export outputs, without the key used to join them
+    region_dc = DataContainer(
+        {
+            name: output.drop(columns=CENSUS_KEY, errors="ignore")
+            for name, output in outputs.items()
+        }
+    )
     log.info("Writing School Census REGION outputs to shared folder")
     region_dc.export(output_folder, "", "csv", max_file_size_mb=50)
@@ -1,20 +1,54 @@
 import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO
 
 import pandas as pd
 from dagster import In, Out, get_dagster_logger, op
 from fs.base import FS
 
 from liiatools.common import pipeline as pl
-from liiatools.common.constants import SessionNamesFixEpisodes
+from liiatools.common.constants import ProcessNames, SessionNamesFixEpisodes
 from liiatools.common.data import DataContainer
 from liiatools.ssda903_pipeline.spec import load_pipeline_config
 
-from liiatools.ssda903_pipeline.fix_episodes import stage_1, stage_2
+from liiatools.ssda903_pipeline.fix_episodes import fix_episodes_incrementally
 from liiatools_pipeline.assets.common import shared_folder, workspace_folder
+from liiatools_pipeline.ops.common_config import FixEpisodesConfig
 
 log = get_dagster_logger()
 
 
+def _load_fixed_episodes(store_folder: FS, la_code: str):
+    """
+    Load the fixed episodes and child hashes stored for an LA by the previous run, if there are any
+    """
+    hashes_file = f"{la_code}_episodes_hashes.parquet"
+    if not store_folder.exists(hashes_file):
+        return None, None
+    with store_folder.open(f"{la_code}_episodes.parquet", "rb") as f:
+        episodes = pd.read_parquet(f)
+    with store_folder.open(hashes_file, "rb") as f:
+        hashes = pd.read_parquet(f).set_index("CHILD")["hash"]
+    return episodes, hashes
+
+
+def _save_fixed_episodes(
+    store_folder: FS, la_code: str, episodes: pd.DataFrame, hashes: pd.Series
+):
+    """
+    Store the fixed episodes and child hashes for an LA. The hashes are removed first and written last so that
+    an interrupted write is not read back as a match for the episodes
+    """
+    hashes_file = f"{la_code}_episodes_hashes.parquet"
+    if store_folder.exists(hashes_file):
+        store_folder.remove(hashes_file)
+    with store_folder.open(f"{la_code}_episodes.parquet", "wb") as f:
+        episodes.to_parquet(f, index=False)
+    with store_folder.open(hashes_file, "wb") as f:
+        hashes.rename("hash").reset_index().to_parquet(f, index=False)
+
+
 @op(
     out={
         "session_folder": Out(FS),
@@ -34,6 +68,25 @@ def create_fix_episodes_session_folder() -> FS:
     return session_folder
 
 
+def _fix_la_episodes(
+    raw_episodes: bytes,
+    episode_cols: list,
+    transform_cols: list,
+    previous_episodes: pd.DataFrame = None,
+    previous_hashes: pd.Series = None,
+):
+    """
+    Fix the episodes of one LA. This runs in a worker process, so it takes the file contents rather than a
+    filesystem and returns the time taken for the op to log
+    """
+    start = time.perf_counter()
+    df = pd.read_csv(BytesIO(raw_episodes))
+    df, hashes, changed = fix_episodes_incrementally(
+        df, episode_cols, transform_cols, previous_episodes, previous_hashes
+    )
+    return df, hashes, len(changed), time.perf_counter() - start
+
+
 @op(
     ins={
         "session_folder": In(FS),
@@ -41,6 +94,7 @@ def create_fix_episodes_session_folder() -> FS:
 )
 def fix_episodes(
     session_folder: FS,
+    config: FixEpisodesConfig,
 ):
     log.info("Opening Concatenated folder for 903...")
     concat_folder = shared_folder().opendir("concatenated/ssda903")
@@ -50,21 +104,79 @@ def fix_episodes(
     episodes_config = pipeline_config["episodes"]
     episode_cols = [c.id for c in episodes_config.columns]
     transform_cols = [x for x in episode_cols if x not in ["CHILD", "LA", "Year_latest", "Episode_source"]]
+    store_folder = workspace_folder().makedirs(
+        f"{ProcessNames.CACHE_FOLDER}/ssda903_fix_episodes", recreate=True
+    )
 
+    # Each LA is fixed independently on a pool of worker processes. An LA's files are only read when a worker is
+    # free for it, so no more than max_workers LAs are held in memory at once. A failure for one LA is logged and
+    # the others are still exported.
+    la_files = {}
     for file in files:
-        log.info(f"Fixing episodes for {file}")
-        data = DataContainer()
         episode_table = re.search(r"episodes", file)
         la_code = re.search(r"([A-Za-z0-9]*)_", file)
-        if episode_table is not None:
-            log.info("Episode table found...")
-            with session_folder.open(file, "r") as f:
+        if episode_table is not None and la_code is not None:
+            la_files[la_code.group(1)] = file
+
+    max_workers = max(1, min(config.max_workers, len(la_files)))
+    failures = {}
+    pending = iter(la_files.items())
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+
+        def submit_next():
+            for la_code, file in pending:
+                log.info(f"Fixing episodes for {file}")
+                try:
+                    previous_episodes, previous_hashes = _load_fixed_episodes(
+                        store_folder, la_code
+                    )
+                except (OSError, ValueError) as err:
+                    log.error(f"Failed to load previously fixed episodes: {err}")
+                    previous_episodes, previous_hashes = None, None
+                future = executor.submit(
+                    _fix_la_episodes,
+                    session_folder.readbytes(file),
+                    episode_cols,
+                    transform_cols,
+                    previous_episodes,
+                    previous_hashes,
+                )
+                futures[future] = la_code
+                return
+
+        for _ in range(max_workers):
+            submit_next()
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                la_code = futures.pop(future)
+                submit_next()
+
+                data = DataContainer()
                 try:
-                    df = pd.read_csv(f)
-                    df = stage_1(df, transform_cols)
-                    df = stage_2(df, episode_cols, transform_cols)
-                    data[episode_table.group(0)] = df
+                    df, hashes, changed, elapsed = future.result()
                 except TypeError as err:
-                    log.error(f"Fixing episodes table failed: {err}")
-        log.info(f"Exporting episodes fix for {file}...")
-        data.export(concat_folder, f"{la_code.group(1)}_ssda903_", "csv")
+                    log.error(f"Fixing episodes table failed for {la_code}: {err}")
+                except Exception as err:
+                    log.error(f"Fixing episodes table failed for {la_code}: {err}")
+                    failures[la_code] = err
+                    continue
+                else:
+                    log.info(
+                        f"Fixed episodes for {changed} of {len(hashes)} children for {la_code} in {elapsed:.1f}s"
+                    )
+                    data["episodes"] = df
+                    try:
+                        _save_fixed_episodes(store_folder, la_code, df, hashes)
+                    except (OSError, ValueError, TypeError) as err:
+                        log.error(f"Failed to store fixed episodes: {err}")
+                log.info(f"Exporting episodes fix for {la_files[la_code]}...")
+                data.export(concat_folder, f"{la_code}_ssda903_", "csv")
+
+    if failures:
+        error = next(iter(failures.values()))
+        raise RuntimeError(
+            f"Fixing episodes failed for {', '.join(failures)}"
+        ) from error
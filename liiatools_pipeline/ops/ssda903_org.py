@@ -1,24 +1,164 @@
+import json
+from typing import List
+
+import pandas as pd
 from dagster import In, Out, op, get_dagster_logger
 from fs.base import FS
 from fs import errors
 import re
 
 from liiatools.common import pipeline as pl
-from liiatools.common.constants import SessionNamesSufficiency
+from liiatools.common.cache import ExternalDataCache
+from liiatools.common.constants import ProcessNames, SessionNamesSufficiency
 from liiatools.common.data import DataContainer
 from liiatools.ssda903_pipeline.sufficiency_transform import (
+    EXTERNAL_DATA_VERSION,
     dict_to_dfs,
     ofsted_transform,
     ons_transform,
     open_file,
     postcode_transform,
+    partition_hash,
+    split_by_la,
     ss903_transform,
+    ss903_transform_partition,
 )
 from liiatools_pipeline.assets.common import shared_folder, workspace_folder
 from liiatools_pipeline.assets.external_dataset import external_data_folder
+from liiatools_pipeline.ops.common_config import SufficiencyConfig
 
 log = get_dagster_logger()
 
+PARTITIONED_TABLES = ["dimLookedAfterChild", "factEpisode"]
+PARTITIONS_MANIFEST = "la_partitions.json"
+
+
+def _remove_other_layout(cache_folder: FS, output_folders: List[FS], incremental: bool):
+    """
+    Remove dimLookedAfterChild and factEpisode in the layout that is not being written, i.e. the full csv tables
+    when writing LA partitions and the partitions when writing the full tables, so that switching between them
+    never leaves two copies of the tables in an output folder
+    """
+    for folder in output_folders:
+        for table in PARTITIONED_TABLES:
+            if incremental and folder.exists(f"{table}.csv"):
+                log.info(f"Removing {table}.csv as it is replaced by LA partitions")
+                folder.remove(f"{table}.csv")
+            elif not incremental and folder.isdir(table):
+                log.info(
+                    f"Removing {table} LA partitions as it is replaced by {table}.csv"
+                )
+                folder.removetree(table)
+
+    if not incremental and cache_folder.exists(PARTITIONS_MANIFEST):
+        cache_folder.remove(PARTITIONS_MANIFEST)
+
+
+def _export_la_partitions(
+    cache_folder: FS,
+    output_folders: List[FS],
+    header: pd.DataFrame,
+    uasc: pd.DataFrame,
+    episodes: pd.DataFrame,
+    ONSArea: pd.DataFrame,
+    Postcode: pd.DataFrame,
+    OfstedProvider: pd.DataFrame,
+    inputs: list,
+):
+    """
+    Write dimLookedAfterChild and factEpisode as one parquet file per LA in each output folder, e.g.
+    factEpisode/302.parquet. An LA is only transformed and written again when its 903 data or the external tables
+    it is joined to have changed since the hashes recorded in the cache folder.
+    """
+    previous = {}
+    if cache_folder.exists(PARTITIONS_MANIFEST):
+        previous = json.loads(cache_folder.readtext(PARTITIONS_MANIFEST))
+
+    if "LA" not in uasc.columns:
+        # UASC rows are only used where they match a header row, so they go in the same partitions
+        uasc = uasc.merge(
+            header[["CHILD", "YEAR", "LA"]].drop_duplicates(),
+            on=["CHILD", "YEAR"],
+            how="inner",
+        )
+
+    headers = split_by_la(header)
+    uascs = split_by_la(uasc)
+    episode_partitions = split_by_la(episodes)
+    partitions = sorted(set(headers) | set(uascs) | set(episode_partitions))
+
+    manifest = {}
+    unmatched_row = None
+    for partition in partitions:
+        tables = [
+            headers.get(partition, header.iloc[:0]),
+            uascs.get(partition, uasc.iloc[:0]),
+            episode_partitions.get(partition, episodes.iloc[:0]),
+        ]
+        manifest[partition] = partition_hash(tables, *inputs)
+        written = all(
+            folder.exists(f"{table}/{partition}.parquet")
+            for folder in output_folders
+            for table in PARTITIONED_TABLES
+        )
+        if previous.get(partition) == manifest[partition] and written:
+            log.info(
+                f"Keeping dimLookedAfterChild and factEpisode for {partition} as its data is unchanged"
+            )
+            continue
+
+        log.info(f"Creating dimLookedAfterChild and factEpisode for {partition}")
+        LookedAfterChild, factEpisode, unmatched_row = ss903_transform_partition(
+            partition,
+            tables[0],
+            tables[1],
+            ONSArea,
+            tables[2],
+            Postcode,
+            OfstedProvider,
+        )
+        for folder in output_folders:
+            DataContainer({partition: LookedAfterChild}).export(
+                folder.makedirs("dimLookedAfterChild", recreate=True), "", "parquet"
+            )
+            DataContainer({partition: factEpisode}).export(
+                folder.makedirs("factEpisode", recreate=True), "", "parquet"
+            )
+
+    # The row for unmatched LookedAfterChildKeys is the same for every LA, so it is kept in its own file. It is
+    # written again whenever an LA has been transformed, in case the transform has changed
+    unmatched_folders = [
+        folder
+        for folder in output_folders
+        if unmatched_row is not None
+        or not folder.exists("dimLookedAfterChild/unmatched.parquet")
+    ]
+    if unmatched_folders and unmatched_row is None:
+        _, _, unmatched_row = ss903_transform_partition(
+            "unknown",
+            header.iloc[:0],
+            uasc.iloc[:0],
+            ONSArea,
+            episodes.iloc[:0],
+            Postcode,
+            OfstedProvider,
+        )
+    for folder in unmatched_folders:
+        DataContainer({"unmatched": unmatched_row}).export(
+            folder.makedirs("dimLookedAfterChild", recreate=True), "", "parquet"
+        )
+
+    # Remove the partitions of LAs that are no longer in the data
+    for partition in set(previous) - set(manifest):
+        log.info(f"Removing dimLookedAfterChild and factEpisode for {partition}")
+        for folder in output_folders:
+            for table in PARTITIONED_TABLES:
+                if folder.exists(f"{table}/{partition}.parquet"):
+                    folder.remove(f"{table}/{partition}.parquet")
+
+    cache_folder.writetext(PARTITIONS_MANIFEST, json.dumps(manifest, sort_keys=True))
+
+
 @op(
     out={
         "session_folder": Out(FS),
@@ -47,6 +187,7 @@ def create_sufficiency_session_folder() -> FS:
 )
 def create_dim_fact_tables(
     session_folder: FS,
+    config: SufficiencyConfig,
 ):
     # Check that the files necessary for the job are in the folder
     log.info("Checking required input files are all present")
@@ -70,41 +211,98 @@ def create_dim_fact_tables(
         # Create dictionary to store tables, starting with basic dim tables
         dim_tables = dict_to_dfs()
 
+        # The transformed external tables are cached in the workspace and only rebuilt when their input files change
+        cache_folder = workspace_folder().makedirs(
+            f"{ProcessNames.CACHE_FOLDER}/sufficiency", recreate=True
+        )
+
         # Create dimONSArea table
         # Open external file
+        ons_cache = ExternalDataCache(cache_folder, "dimONSArea")
         try:
-            ONSArea = open_file(ext_folder, "ONS_Area.csv")
+            ons_key = ons_cache.key(
+                ext_folder, ["ONS_Area.csv"], EXTERNAL_DATA_VERSION
+            )
         except errors.ResourceNotFound as err:
             log.error(f"No ONS_Area file to open: {err}")
             log.info("Exiting run as external dataset resources not available")
             return
-        
-        # Transform ONSArea table
-        ONSArea = ons_transform(ONSArea)
+
+        cached = ons_cache.get(ons_key)
+        if cached is not None:
+            log.info("Using cached dimONSArea table as ONS_Area file is unchanged")
+            ONSArea = cached["dimONSArea"]
+        else:
+            # Transform ONSArea table
+            log.info("Transforming ONS_Area file as it has changed since the cached table")
+            ONSArea = ons_transform(open_file(ext_folder, "ONS_Area.csv"))
+            ons_cache.put(ons_key, DataContainer({"dimONSArea": ONSArea}))
         log.info("Creating dimONSArea table")
         dim_tables["dimONSArea"] = ONSArea
 
         # Create dimPostcode table
         # Open external file
+        postcode_cache = ExternalDataCache(cache_folder, "dimPostcode")
         try:
-            Postcode = open_file(ext_folder, "ONSPD_reduced_to_postcode_sector.csv")
+            postcode_key = postcode_cache.key(
+                ext_folder,
+                ["ONSPD_reduced_to_postcode_sector.csv"],
+                EXTERNAL_DATA_VERSION,
+            )
         except errors.ResourceNotFound as err:
             log.error(f"No ONSPD postcode file to open: {err}")
             log.info("Exiting run as external dataset resources not available")
             return
-                    
-        # Transform Postcode table
-        Postcode = postcode_transform(Postcode)
+
+        cached = postcode_cache.get(postcode_key)
+        if cached is not None:
+            log.info("Using cached dimPostcode table as ONSPD postcode file is unchanged")
+            Postcode = cached["dimPostcode"]
+        else:
+            # Transform Postcode table
+            log.info("Transforming ONSPD postcode file as it has changed since the cached table")
+            Postcode = postcode_transform(
+                open_file(ext_folder, "ONSPD_reduced_to_postcode_sector.csv")
+            )
+            postcode_cache.put(postcode_key, DataContainer({"dimPostcode": Postcode}))
         log.info("Creating dimPostcode table")
         dim_tables["dimPostcode"] = Postcode
 
         # Create dimOfstedProvider and factOfstedInspection tables
-        # Open and transform files
-        OfstedProvider, factOfstedInspection = ofsted_transform(ext_folder, ONSArea, log)
-        if OfstedProvider is None and factOfstedInspection is None:
-            log.info("Terminating process")
-            return
-        
+        # Open and transform files, which also depend on the ONS areas
+        ofsted_cache = ExternalDataCache(cache_folder, "Ofsted")
+        ofsted_files = []
+        if ext_folder.isdir("Ofsted"):
+            ofsted_files = [
+                f"Ofsted/{f}"
+                for f in ext_folder.listdir("Ofsted")
+                if ext_folder.isfile(f"Ofsted/{f}")
+            ]
+        ofsted_key = ofsted_cache.key(
+            ext_folder, ["ONS_Area.csv", *ofsted_files], EXTERNAL_DATA_VERSION
+        )
+
+        cached = ofsted_cache.get(ofsted_key)
+        if cached is not None:
+            log.info("Using cached Ofsted tables as Ofsted files are unchanged")
+            OfstedProvider = cached["dimOfstedProvider"]
+            factOfstedInspection = cached["factOfstedInspection"]
+        else:
+            log.info("Transforming Ofsted files as they have changed since the cached tables")
+            OfstedProvider, factOfstedInspection = ofsted_transform(ext_folder, ONSArea, log)
+            if OfstedProvider is None and factOfstedInspection is None:
+                log.info("Terminating process")
+                return
+            ofsted_cache.put(
+                ofsted_key,
+                DataContainer(
+                    {
+                        "dimOfstedProvider": OfstedProvider,
+                        "factOfstedInspection": factOfstedInspection,
+                    }
+                ),
+            )
+
         log.info("Creating dimOfstedProvider table")
         dim_tables["dimOfstedProvider"] = OfstedProvider
         log.info("Creating factOfstedInspection table")
@@ -116,19 +314,36 @@ def create_dim_fact_tables(
         UASC = open_file(session_folder, "ssda903_uasc.csv")
         Episode = open_file(session_folder, "ssda903_episodes.csv")
 
-        # Transform tables
-        LookedAfterChild, factEpisode = ss903_transform(
-            LookedAfterChild, UASC, ONSArea, Episode, Postcode, OfstedProvider
+        reports_folder = workspace_folder().opendir("current/ssda903/SUFFICIENCY")
+        _remove_other_layout(
+            cache_folder, [reports_folder, output_folder], config.incremental
         )
-        log.info("Creating dimLookedAfterChild table")
-        dim_tables["dimLookedAfterChild"] = LookedAfterChild
-        log.info("Creating factEpisode table")
-        dim_tables["factEpisode"] = factEpisode
+        if config.incremental:
+            # Only the LAs whose 903 data has changed are transformed and written to their partitions
+            _export_la_partitions(
+                cache_folder,
+                [reports_folder, output_folder],
+                LookedAfterChild,
+                UASC,
+                Episode,
+                ONSArea,
+                Postcode,
+                OfstedProvider,
+                [ons_key, postcode_key, ofsted_key, EXTERNAL_DATA_VERSION],
+            )
+        else:
+            # Transform tables
+            LookedAfterChild, factEpisode = ss903_transform(
+                LookedAfterChild, UASC, ONSArea, Episode, Postcode, OfstedProvider
+            )
+            log.info("Creating dimLookedAfterChild table")
+            dim_tables["dimLookedAfterChild"] = LookedAfterChild
+            log.info("Creating factEpisode table")
+            dim_tables["factEpisode"] = factEpisode
 
         # Export tables
         dim_tables = DataContainer(dim_tables)
 
-        reports_folder = workspace_folder().opendir("current/ssda903/SUFFICIENCY")
         log.info("Exporting output tables to org current folder")
         dim_tables.export(reports_folder, "", "csv")
 